@@ -137,18 +137,10 @@ def multiformat_test_view(request, val):
 @http
 @jsonview
 def ajax_doubler(request, number):
-    num = None
-    try:
-        num = int(number)
-    except ValueError:
-        pass
-
-    if num is not None:
-        num *= 2
-
+    # number is already an int, thanks to the <number:int> converter
     return (
             200,
-            {'result': num, },
+            {'result': number * 2, },
             {'mimetype': 'application/json', },
             )
 
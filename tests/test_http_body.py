@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / tests / HTTP request bodies
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+HTTP request body parsing tests
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+'''
+
+from __future__ import unicode_literals, division
+
+import io
+import unittest
+
+from multipart import parse_options_header
+
+from weiyu import registry
+from weiyu.adapters.http.util import BodyStream, HTTPHelper
+from weiyu.adapters.http.util import RequestBodyError
+from weiyu.adapters.http.wsgi import WSGIReflex
+
+BOUNDARY = 'xxBOUNDARYxx'
+
+MULTIPART_BODY = (
+        b'--xxBOUNDARYxx\r\n'
+        b'Content-Disposition: form-data; name="a"\r\n'
+        b'\r\n'
+        b'1\r\n'
+        b'--xxBOUNDARYxx\r\n'
+        b'Content-Disposition: form-data; name="f"; filename="f.txt"\r\n'
+        b'Content-Type: text/plain\r\n'
+        b'\r\n'
+        b'file content\r\n'
+        b'--xxBOUNDARYxx--\r\n'
+        )
+
+
+class FakeRequest(object):
+    '''Just enough of a request for :meth:`HTTPHelper.parse_payload`.'''
+
+    def __init__(self, helper, c_type, body, length=True):
+        self.method = 'POST'
+        self.content_type = parse_options_header(c_type)
+        self.content_length = len(body) if length else -1
+        self.body_stream = BodyStream(
+                io.BytesIO(body),
+                self.content_length,
+                helper.body_limit(self.content_type[0]),
+                )
+
+
+def multipart_type(boundary=BOUNDARY):
+    return 'multipart/form-data; boundary=%s' % (boundary, )
+
+
+class ParsePayloadTest(unittest.TestCase):
+    def parse(self, c_type, body, config=None, length=True):
+        helper = HTTPHelper({'request': config or {}, })
+        return helper.parse_payload(FakeRequest(helper, c_type, body, length))
+
+    def assertStatus(self, status, *args, **kwargs):
+        with self.assertRaises(RequestBodyError) as ctx:
+            self.parse(*args, **kwargs)
+
+        self.assertEqual(ctx.exception.status, status)
+
+    def test_urlencoded(self):
+        self.assertEqual(
+                self.parse('application/x-www-form-urlencoded', b'a=1&b=2'),
+                ({'a': '1', 'b': '2', }, None, ),
+                )
+
+    def test_json(self):
+        self.assertEqual(
+                self.parse('application/json', b'{"a": [1, 2]}'),
+                ({'a': [1, 2, ], }, None, ),
+                )
+        self.assertStatus(400, 'application/json', b'{"a": ')
+
+    def test_multipart(self):
+        form, files = self.parse(multipart_type(), MULTIPART_BODY)
+        self.assertEqual(form, {'a': '1', })
+        self.assertEqual(files['f'].filename, 'f.txt')
+        self.assertEqual(files['f'].raw, b'file content')
+
+    def test_malformed_multipart(self):
+        self.assertStatus(400, 'multipart/form-data', MULTIPART_BODY)
+        self.assertStatus(400, multipart_type('other'), MULTIPART_BODY)
+        self.assertStatus(400, multipart_type(), MULTIPART_BODY[:-20])
+
+    def test_over_limit(self):
+        # without a Content-Length, the limit is only hit while reading
+        limits = {'body_limits': {
+            'application/x-www-form-urlencoded': 4,
+            'application/json': 4,
+            'multipart/form-data': 64,
+            }, }
+
+        self.assertStatus(
+                413,
+                'application/x-www-form-urlencoded',
+                b'a=1&b=2',
+                limits,
+                length=False,
+                )
+        self.assertStatus(
+                413,
+                'application/json',
+                b'{"a": 1}',
+                limits,
+                length=False,
+                )
+        self.assertStatus(
+                413,
+                multipart_type(),
+                MULTIPART_BODY,
+                limits,
+                length=False,
+                )
+
+    def test_over_multipart_mem_limit(self):
+        field = (
+                b'--xxBOUNDARYxx\r\n'
+                b'Content-Disposition: form-data; name="a"\r\n'
+                b'\r\n'
+                b'12\r\n'
+                )
+        body = field * 3 + b'--xxBOUNDARYxx--\r\n'
+
+        config = {'multipart_mem_limit': 6, }
+        self.assertEqual(
+                self.parse(multipart_type(), body, config),
+                ({'a': ['12', '12', '12', ], }, {}, ),
+                )
+
+        config = {'multipart_mem_limit': 4, }
+        self.assertStatus(413, multipart_type(), body, config)
+
+    def test_not_parsed(self):
+        self.assertEqual(self.parse('text/plain', b'a=1'), (None, None, ))
+
+
+class BodyErrorResponseTest(unittest.TestCase):
+    def setUp(self):
+        registry.request('site', autocreate=True, nodup=False)
+        registry.request('weiyu.adapter', autocreate=True, nodup=False)
+        self.reflex = WSGIReflex()
+
+    def respond(self, exc):
+        class Request(object):
+            short_circuit = None
+            cors_preflight = False
+
+        def fn(request):
+            raise exc
+
+        request = Request()
+        request.callback_info = (fn, (), {}, )
+        return self.reflex._do_generate_response(request)
+
+    def test_status(self):
+        self.assertEqual(self.respond(RequestBodyError(413)).status, 413)
+        self.assertEqual(self.respond(RequestBodyError(400)).status, 400)
+
+    def test_other_errors_propagate(self):
+        self.assertRaises(ValueError, self.respond, ValueError('x'))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
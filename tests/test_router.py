@@ -0,0 +1,611 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / tests / router dispatch
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Router dispatch tests
+~~~~~~~~~~~~~~~~~~~~~
+
+Every way of dispatching must give exactly the same results as the plain
+first-match-wins walk of the route tree, so the URLfiles here are loaded
+in every router mode, and each lookup is checked against the walk.
+
+'''
+
+from __future__ import unicode_literals, division
+
+import io
+import os
+import re
+import glob
+import shutil
+import tempfile
+import unittest
+
+from weiyu import registry
+from weiyu.router import router_hub
+from weiyu.router.base import DISPATCH_MISS, STATUS_NOROUTE, STATUS_REACHED
+from weiyu.router.converters import BaseConverter
+from weiyu.router.reverser import Reverser
+
+EXAMPLES_DIR = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'examples',
+        )
+
+# (name, router kind, router options, )
+MODES = (
+        ('regex', 'regex', {}, ),
+        ('compiled', 'compiled', {}, ),
+        ('flat-regex', 'regex', {'flatten': True}, ),
+        ('flat-compiled', 'compiled', {'flatten': True}, ),
+        ('adaptive', 'regex', {
+            'adaptive_order': 1,
+            'adaptive_order_sample': 1,
+            }, ),
+        ('cached', 'regex', {
+            'dispatch_cache': 16,
+            'negative_cache': 16,
+            }, ),
+        )
+
+HOSTS = (None, 'example.com', 'other.example.com', )
+
+ROUTES_URLFILE = r'''--{kind}
+--default-type={kind}
+--renderer=json
+
+^$ index
+^static/(?P<path>.*)$ static
+# shadowed by the previous entry, first match wins
+^static/special$ shadowed
+
+# odd numbers fall through to the next entry
+^calc/<v:test_even>/json/$ even
+^calc/(?P<v>\d+)/json/$ number
+^calc/7/json/$ shadowed
+
+^pos/(\d+)/(\d+)/$ positional
+
+^v/:
+    --host=example.com
+    ^x/$ host-x
+    ^(?P<n>\d+)/$ host-n
+^v/:
+    ^x/$ any-x
+    ^(?P<n>\d+)/:
+        ^$ nested-n
+        ^(\d+)/$ nested-nm
+        ^<m:test_even>/even/$ nested-even
+    ^(?P<n>\d+)/(?P<m>\d+)/even/$ nested-fallback
+
+^ex/:
+    --exact
+    ab e-ab
+    a e-a
+    b/:
+        --regex
+        ^(?P<id>\d+)/$ e-b-id
+^ex/(?P<rest>.*)$ ex-rest
+
+^api/:
+    --scope=api
+    ^ping/$ ping
+    ^<id:int>/$ item
+
+# the child only ever sees what the greedy a+ left over, so it is never
+# reached
+^bt/a+:
+    ^ab/$ bt-ab
+
+^(?P<a>[a-z]+)/(?P<b>[a-z]+)/$ catchall
+'''
+
+ROUTES_QUERIES = (
+        '',
+        'static/',
+        'static/special',
+        'static/a/b.css',
+        'calc/8/json/',
+        'calc/7/json/',
+        'calc/x/json/',
+        'calc/8/json',
+        'pos/1/2/',
+        'pos/1/',
+        'v/x/',
+        'v/12/',
+        'v/12/3/',
+        'v/12/4/even/',
+        'v/12/5/even/',
+        'v/12/x/',
+        'v/',
+        'ex/a',
+        'ex/ab',
+        'ex/abc',
+        'ex/b/12/',
+        'ex/b/x/',
+        'ex/c',
+        'api/ping/',
+        'api/42/',
+        'api/x/',
+        'api/1x/',
+        'bt/aab/',
+        'bt/ab/',
+        'foo/bar/',
+        'foo/bar',
+        'FOO/bar/',
+        'no/such/route/at/all',
+        )
+
+EXAMPLE_QUERIES = (
+        '',
+        '/',
+        '/static/js/app.js',
+        '/calc/12/text/',
+        '/calc/12/json/',
+        '/calc/x/json/',
+        '/ajax/doubler/21/json/',
+        '/ajax/doubler/x/json/',
+        '/add/1/2/',
+        '/add/1/2/redis/',
+        '/add/1/2/memcached/',
+        '/ajax/github/',
+        '/css/main.css',
+        '/socket.io/1/',
+        '/no/such/route',
+        )
+
+EXAMPLE_ENDPOINTS = (
+        '404',
+        'ajax-doubler',
+        'cached-add-memcached',
+        'cached-add-redis',
+        'delayed-add',
+        'gh-webhook-post-receive',
+        'index',
+        'multiformat-test',
+        'scss-bridge',
+        'socketio-handler',
+        'staticfile',
+        )
+
+ROUTES_ENDPOINTS = (
+        'any-x',
+        'bt-ab',
+        'catchall',
+        'e-a',
+        'e-ab',
+        'e-b-id',
+        'even',
+        'ex-rest',
+        'host-n',
+        'host-x',
+        'index',
+        'item',
+        'nested-even',
+        'nested-fallback',
+        'nested-n',
+        'nested-nm',
+        'number',
+        'ping',
+        'positional',
+        'shadowed',
+        'static',
+        )
+
+
+@router_hub.register_converter('test_even')
+class EvenConverter(BaseConverter):
+    # matches every number, but only accepts the even ones
+    regex = r'\d+'
+
+    def to_python(self, value):
+        value = int(value)
+        if value % 2:
+            raise ValueError('odd number')
+        return value
+
+    def to_url(self, value):
+        return '%d' % (value, )
+
+
+def _endpoint(name):
+    def _endpoint_(request, *args, **kwargs):
+        return name
+
+    return _endpoint_
+
+
+ENDPOINTS = dict(
+        (name, _endpoint(name))
+        for name in set(EXAMPLE_ENDPOINTS + ROUTES_ENDPOINTS)
+        )
+
+
+def reference_lookup(router, querystr, host, args=(), kwargs=None):
+    '''The plain first-match-wins walk of the route tree, ignoring any
+    lookup plan, cache or flattening.
+
+    '''
+
+    if router.host is not None and host != router.host:
+        return None
+
+    kwargs = {} if kwargs is None else kwargs
+    for entry in router.route_table:
+        status, new_args, new_kwargs, new_qs = entry.check(
+                querystr,
+                list(args),
+                dict(kwargs),
+                )
+        if status == STATUS_NOROUTE:
+            continue
+
+        if status == STATUS_REACHED:
+            return (entry.target, tuple(new_args), new_kwargs, entry.data, )
+
+        result = reference_lookup(
+                entry.target,
+                new_qs,
+                host,
+                new_args,
+                new_kwargs,
+                )
+        if result is not None:
+            return result
+
+    return None
+
+
+def normalize(result):
+    if result is DISPATCH_MISS:
+        return None
+
+    target, args, kwargs, data = result
+    return (target, tuple(args), dict(kwargs), dict(data or {}), )
+
+
+def with_kind(content, kind):
+    # switch the regex routers of a URLfile to another kind
+    return re.sub(
+            r'(?m)^(\s*--(?:default-type=)?)regex$',
+            r'\g<1>' + kind,
+            content.replace('{kind}', 'regex'),
+            )
+
+
+class _RouterModesTestBase(unittest.TestCase):
+    # subclasses set these
+    queries = ()
+    endpoints = ()
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='weiyu-test-')
+        self._types = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+        options = registry.request('weiyu.router')['options']
+        for typ in self._types:
+            options.pop(typ, None)
+
+    def write_urlfiles(self, files, kind):
+        '''Writes ``files``, a ``dict`` mapping names to contents, into a
+        fresh directory with the routers switched to ``kind``. Returns the
+        directory.
+
+        '''
+
+        dest = tempfile.mkdtemp(dir=self.tmpdir)
+        for name, content in files.items():
+            path = os.path.join(dest, name)
+            with io.open(path, 'w', encoding='utf-8') as fp:
+                fp.write(with_kind(content, kind))
+
+        return dest
+
+    def load(self, mode, kind, options, files, root, parse_fn=None):
+        typ = 'test-%s' % (mode, )
+        self._types.append(typ)
+
+        for name in self.endpoints:
+            router_hub.endpoint(typ, name)(ENDPOINTS[name])
+
+        registry.request('weiyu.router')['options'][typ] = dict(options)
+        path = os.path.join(self.write_urlfiles(files, kind), root)
+        return router_hub.init_router_from_config(typ, path, parse_fn)
+
+    def check_modes(self, files, root):
+        reference = self.load('reference', 'regex', {}, files, root)
+
+        for mode, kind, options in MODES:
+            router = self.load(mode, kind, options, files, root)
+
+            # let the adaptive order kick in
+            for _ in range(3):
+                for querystr in self.queries:
+                    for host in HOSTS:
+                        router.try_dispatch(querystr, host)
+
+            mismatches = []
+            for querystr in self.queries:
+                for host in HOSTS:
+                    expected = reference_lookup(reference, querystr, host)
+                    for _ in range(2):
+                        # the second one may come from the caches
+                        actual = normalize(
+                                router.try_dispatch(querystr, host),
+                                )
+                        if actual != normalize(expected or DISPATCH_MISS):
+                            mismatches.append((querystr, host, actual, ))
+
+            self.assertEqual(mismatches, [], 'mode %s' % (mode, ))
+
+
+class RouterModesTest(_RouterModesTestBase):
+    queries = ROUTES_QUERIES
+    endpoints = ROUTES_ENDPOINTS
+
+    def check(self, mode, querystr, host, endpoint, args=(), kwargs=None):
+        router = self.routers[mode]
+        result = router.try_dispatch(querystr, host)
+        if endpoint is None:
+            self.assertIs(result, DISPATCH_MISS)
+            return
+
+        self.assertIsNot(result, DISPATCH_MISS, querystr)
+        target, actual_args, actual_kwargs, data = result
+        self.assertEqual(target(None), endpoint, querystr)
+        self.assertEqual(tuple(actual_args), args, querystr)
+        self.assertEqual(actual_kwargs, kwargs or {}, querystr)
+
+    def load_all(self):
+        files = {'root.URLfile': ROUTES_URLFILE, }
+        self.routers = dict(
+                (mode, self.load(mode, kind, options, files, 'root.URLfile'))
+                for mode, kind, options in MODES
+                )
+
+    def test_same_as_reference(self):
+        self.check_modes({'root.URLfile': ROUTES_URLFILE, }, 'root.URLfile')
+
+    def test_first_match_wins(self):
+        self.load_all()
+        for mode in self.routers:
+            self.check(mode, 'static/special', None, 'static', (), {
+                'path': 'special',
+                })
+            self.check(mode, 'calc/8/json/', None, 'even', (), {'v': 8})
+            self.check(mode, 'ex/ab', None, 'e-ab')
+            self.check(mode, 'ex/abc', None, 'e-ab')
+            self.check(mode, 'ex/a', None, 'e-a')
+            self.check(mode, 'ex/c', None, 'ex-rest', (), {'rest': 'c'})
+            self.check(mode, 'bt/aab/', None, 'catchall', (), {
+                'a': 'bt',
+                'b': 'aab',
+                })
+
+    def test_converter_fall_through(self):
+        self.load_all()
+        for mode in self.routers:
+            self.check(mode, 'calc/7/json/', None, 'number', (), {'v': '7'})
+            self.check(mode, 'v/12/4/even/', None, 'nested-even', (), {
+                'n': '12',
+                'm': 4,
+                })
+            self.check(mode, 'v/12/5/even/', None, 'nested-fallback', (), {
+                'n': '12',
+                'm': '5',
+                })
+
+    def test_hosts(self):
+        self.load_all()
+        for mode in self.routers:
+            self.check(mode, 'v/x/', 'example.com', 'host-x')
+            self.check(mode, 'v/x/', 'other.example.com', 'any-x')
+            self.check(mode, 'v/x/', None, 'any-x')
+            self.check(mode, 'v/12/', 'example.com', 'host-n', (), {
+                'n': '12',
+                })
+            self.check(mode, 'v/12/', None, 'nested-n', (), {'n': '12'})
+
+    def test_arguments(self):
+        self.load_all()
+        for mode in self.routers:
+            self.check(mode, 'pos/1/2/', None, 'positional', ('1', '2', ))
+            self.check(mode, 'v/12/3/', None, 'nested-nm', ('3', ), {
+                'n': '12',
+                })
+            self.check(mode, 'api/42/', None, 'item', (), {'id': 42})
+
+    def test_misses(self):
+        self.load_all()
+        for mode in self.routers:
+            for querystr in (
+                    'calc/x/json/',
+                    'api/1x/',
+                    'FOO/bar/',
+                    'v/',
+                    ):
+                self.check(mode, querystr, None, None)
+                # a miss must not be remembered as a hit, or vice versa
+                self.check(mode, querystr, None, None)
+
+            self.check(mode, 'foo/bar/', None, 'catchall', (), {
+                'a': 'foo',
+                'b': 'bar',
+                })
+
+    def test_reverse(self):
+        self.load_all()
+        expected = (
+                ('index', {}, '', ),
+                ('static', {'path': 'a/b.css'}, 'static/a/b.css', ),
+                ('even', {'v': 8}, 'calc/8/json/', ),
+                ('nested-even', {'n': '1', 'm': 2}, 'v/1/2/even/', ),
+                ('e-b-id', {'id': '3'}, 'ex/b/3/', ),
+                ('api:ping', {}, 'api/ping/', ),
+                ('api:item', {'id': 42}, 'api/42/', ),
+                )
+
+        for mode, router in self.routers.items():
+            reverser = Reverser(router)
+            for endpoint, kwargs, url in expected:
+                self.assertEqual(reverser.reverse(endpoint, **kwargs), url)
+
+            # and the URLs lead back to the endpoints
+            self.check(mode, 'api/42/', None, 'item', (), {'id': 42})
+            self.check(mode, 'ex/b/3/', None, 'e-b-id', (), {'id': '3'})
+
+            self.assertRaises(ValueError, reverser.reverse, 'no-such-one')
+            self.assertRaises(ValueError, reverser.reverse, 'even')
+
+
+class ExampleURLfilesTest(_RouterModesTestBase):
+    queries = EXAMPLE_QUERIES
+    endpoints = EXAMPLE_ENDPOINTS
+
+    def test_examples(self):
+        roots = sorted(glob.glob(
+                os.path.join(EXAMPLES_DIR, '*', 'Rain.d', 'root.URLfile'),
+                ))
+        self.assertTrue(roots)
+
+        for root in roots:
+            files = {}
+            for path in glob.glob(os.path.join(os.path.dirname(root), '*')):
+                if path.endswith('.URLfile'):
+                    with io.open(path, encoding='utf-8') as fp:
+                        files[os.path.basename(path)] = fp.read()
+
+            self.check_modes(files, 'root.URLfile')
+
+
+METHODS_URLFILES = {
+        'root.URLfile': r'''--regex
+--default-type=regex
+--renderer=json
+
+^api/ '{"methods": ["post"]}':
+    --include=api
+^get/ '{"methods": "GET,HEAD"}':
+    ^a/$ index
+    ^b/$ number json '{"methods": ["PUT"]}'
+^any/$ index
+''',
+        'api.URLfile': r'''--regex
+--default-type=regex
+
+^a/$ index
+''',
+        }
+
+
+class AllowedMethodsTest(_RouterModesTestBase):
+    endpoints = ROUTES_ENDPOINTS
+
+    def allowed(self, router, querystr):
+        result = router.try_dispatch(querystr, None)
+        self.assertIsNot(result, DISPATCH_MISS, querystr)
+        return result[-1].get('allowed_methods')
+
+    def check(self, router):
+        self.assertEqual(self.allowed(router, 'api/a/'), {'POST', })
+        self.assertEqual(self.allowed(router, 'get/a/'), {'GET', 'HEAD', })
+        self.assertEqual(self.allowed(router, 'get/b/'), {'PUT', })
+        self.assertIsNone(self.allowed(router, 'any/'))
+
+    def test_allowed_methods(self):
+        self.check(self.load(
+                'methods',
+                'regex',
+                {},
+                METHODS_URLFILES,
+                'root.URLfile',
+                ))
+
+    def test_shared_rule_trees(self):
+        # parsed rule trees may be cached and built from again
+        trees = {}
+
+        def parse_fn(path):
+            if path not in trees:
+                trees[path] = router_hub.parse_router_config(typ, path)
+            return trees[path]
+
+        typ = 'test-shared'
+        first = self.load(
+                'shared',
+                'regex',
+                {},
+                METHODS_URLFILES,
+                'root.URLfile',
+                parse_fn,
+                )
+        snapshot = repr(sorted(trees.items()))
+
+        for path in trees:
+            router = router_hub.init_router_from_config(typ, path, parse_fn)
+            if path.endswith('root.URLfile'):
+                second = router
+
+        self.assertEqual(repr(sorted(trees.items())), snapshot)
+        self.check(first)
+        self.check(second)
+
+
+class FirstDispatchHookTest(_RouterModesTestBase):
+    endpoints = ENDPOINTS
+
+    def setUp(self):
+        super(FirstDispatchHookTest, self).setUp()
+        self.calls = []
+        router_hub.on_first_dispatch(self.hook)
+
+    def tearDown(self):
+        router_hub._first_dispatch_hooks.remove(self.hook)
+        for typ in self._types:
+            router_hub._routers.pop(typ, None)
+
+        super(FirstDispatchHookTest, self).tearDown()
+
+    def hook(self):
+        self.calls.append(os.getpid())
+
+    def test_once_per_process(self):
+        files = {'root.URLfile': ROUTES_URLFILE, }
+        router = self.load('hooks', 'regex', {}, files, 'root.URLfile')
+        router_hub.register_router(router)
+        self.assertEqual(self.calls, [])
+
+        for querystr in ('', 'nothing/here/', ):
+            router_hub.try_dispatch('test-hooks', querystr, None)
+        self.assertEqual(self.calls, [os.getpid(), ])
+
+        # as seen from a forked child
+        router_hub._hooks_pid = -1
+        router_hub.try_dispatch('test-hooks', '', None)
+        self.assertEqual(self.calls, [os.getpid(), os.getpid(), ])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
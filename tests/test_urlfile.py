@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / tests / URLfile parsing
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+URLfile lexer and parse cache tests
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+'''
+
+from __future__ import unicode_literals, division
+
+import io
+import os
+import glob
+import shutil
+import tempfile
+import unittest
+
+from weiyu.router.config.cache import (
+        cache_key,
+        cache_path,
+        load_cached,
+        store_cached,
+        )
+from weiyu.router.config.parser import parse_config
+from weiyu.router.config.wrlex import WRLexer
+
+EXAMPLES_DIR = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'examples',
+        )
+
+SIMPLE_URLFILE = '''--regex
+
+# comment
+^a/$ e
+^b/:
+    --exact
+    c f json
+'''
+
+
+def token_stream(content, lex_first=False):
+    lexer = WRLexer()
+    lexer.input(content)
+    if lex_first:
+        lexer.lex()
+
+    result = []
+    while True:
+        tok = lexer.token()
+        if tok is None:
+            return result
+        result.append((tok.type, tok.value, tok.line, ))
+
+
+class LexerTest(unittest.TestCase):
+    def test_token_stream(self):
+        self.assertEqual(token_stream(SIMPLE_URLFILE), [
+                ('ATTRIB', '--regex', 1, ),
+                ('NEWLINE', '\n\n\n', 1, ),
+                ('LITERAL', '^a/$', 4, ),
+                ('LITERAL', 'e', 4, ),
+                ('NEWLINE', '\n', 4, ),
+                ('LITERAL', '^b/', 5, ),
+                ('COLON', ':\n', 5, ),
+                ('INDENT', '    ', 6, ),
+                ('ATTRIB', '--exact', 6, ),
+                ('NEWLINE', '\n', 6, ),
+                ('LITERAL', 'c', 7, ),
+                ('LITERAL', 'f', 7, ),
+                ('LITERAL', 'json', 7, ),
+                ('NEWLINE', '\n', 7, ),
+                ('DEDENT', '', 8, ),
+                ])
+
+    def test_lex_then_token(self):
+        for content in (SIMPLE_URLFILE, 'a b:\n\tc d\n\ne f\n', ):
+            self.assertEqual(
+                    token_stream(content, lex_first=True),
+                    token_stream(content),
+                    )
+
+    def test_nested_blocks(self):
+        types = [
+                tok[0]
+                for tok in token_stream('a:\n    b:\n        c d\n    e f\n')
+                ]
+        self.assertEqual(types, [
+                'LITERAL', 'COLON',
+                'INDENT', 'LITERAL', 'COLON',
+                'INDENT', 'LITERAL', 'LITERAL', 'NEWLINE',
+                'DEDENT', 'LITERAL', 'LITERAL', 'NEWLINE',
+                'DEDENT',
+                ])
+
+    def test_quoted_literals(self):
+        self.assertEqual(
+                [tok[:2] for tok in token_stream('"" \'a b\' "c#d" e#f\n')],
+                [
+                    ('LITERAL', '', ),
+                    ('LITERAL', 'a b', ),
+                    ('LITERAL', 'c#d', ),
+                    ('LITERAL', 'e', ),
+                    ],
+                )
+
+    def test_tab_width(self):
+        # a tab counts up to the next multiple of 8 columns
+        types = [
+                tok[0]
+                for tok in token_stream('a:\n\tb c\n        d e\n')
+                ]
+        self.assertEqual(types.count('INDENT'), 1)
+        self.assertNotIn('INDENT', types[types.index('INDENT') + 1:-1])
+
+    def test_inconsistent_dedent(self):
+        self.assertRaises(
+                IndentationError,
+                token_stream,
+                'a:\n    b:\n        c d\n  e f\n',
+                )
+
+    def test_examples(self):
+        paths = glob.glob(
+                os.path.join(EXAMPLES_DIR, '*', 'Rain.d', '*.URLfile'),
+                )
+        self.assertTrue(paths)
+
+        for path in paths:
+            with io.open(path, encoding='utf-8') as fp:
+                content = fp.read()
+
+            self.assertEqual(
+                    token_stream(content, lex_first=True),
+                    token_stream(content),
+                    )
+            self.assertIsNotNone(parse_config(path), path)
+
+
+class ParseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='weiyu-test-')
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.path = os.path.join(self.tmpdir, 'root.URLfile')
+        self.write(SIMPLE_URLFILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def write(self, content, mtime=None):
+        with io.open(self.path, 'w', encoding='utf-8') as fp:
+            fp.write(content)
+
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime, ))
+
+    def parse(self):
+        return parse_config(self.path, cache_dir=self.cache_dir)
+
+    def test_round_trip(self):
+        expected = parse_config(self.path)
+
+        self.assertEqual(self.parse(), expected)
+        self.assertTrue(os.path.exists(cache_path(self.cache_dir, self.path)))
+        self.assertEqual(
+                load_cached(
+                    self.cache_dir,
+                    self.path,
+                    cache_key(self.path, 'utf-8'),
+                    ),
+                expected,
+                )
+
+        # served from the cache the second time
+        self.assertEqual(self.parse(), expected)
+
+    def test_fresh_cache_is_used(self):
+        # a tree stored under the current key is returned as is, without
+        # parsing the file
+        fake = ['exact', ['x', 'y', None, ], ]
+        key = cache_key(self.path, 'utf-8')
+        self.assertTrue(store_cached(self.cache_dir, self.path, key, fake))
+        self.assertEqual(self.parse(), fake)
+
+    def test_invalidated_by_content(self):
+        self.write(SIMPLE_URLFILE, 1000000000)
+        self.parse()
+
+        content = SIMPLE_URLFILE.replace('^a/$ e', '^aa/$ e')
+        self.write(content, 1000000000)
+        self.assertEqual(self.parse(), parse_config(self.path))
+        self.assertIn('^aa/$', repr(self.parse()))
+
+    def test_invalidated_by_mtime(self):
+        self.write(SIMPLE_URLFILE, 1000000000)
+        self.parse()
+
+        # same size, different content and mtime
+        content = SIMPLE_URLFILE.replace('^a/$ e', '^z/$ e')
+        self.write(content, 1000000100)
+        self.assertIn('^z/$', repr(self.parse()))
+
+    def test_key_mismatch(self):
+        key = cache_key(self.path, 'utf-8')
+        store_cached(self.cache_dir, self.path, key, ['regex', ])
+
+        self.assertIsNone(load_cached(
+                self.cache_dir,
+                self.path,
+                key[:-1] + (key[-1] + 1, ),
+                ))
+        self.assertIsNone(load_cached(
+                self.cache_dir,
+                self.path,
+                cache_key(self.path, 'latin-1'),
+                ))
+
+    def test_corrupt_cache(self):
+        expected = self.parse()
+        with open(cache_path(self.cache_dir, self.path), 'wb') as fp:
+            fp.write(b'\x00garbage')
+
+        self.assertEqual(self.parse(), expected)
+
+        # and the broken file got replaced
+        self.assertEqual(
+                load_cached(
+                    self.cache_dir,
+                    self.path,
+                    cache_key(self.path, 'utf-8'),
+                    ),
+                expected,
+                )
+
+    def test_missing_file(self):
+        os.unlink(self.path)
+        self.assertRaises(IOError, self.parse)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
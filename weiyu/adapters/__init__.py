@@ -37,6 +37,7 @@ PROBER = ModProber(
         {
             'wsgi': 'http.wsgi',
             'tornado': 'http.tornado_',
+            'asyncio': 'http.asyncio_',
             },
         )
 
@@ -0,0 +1,584 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / adapter / http / asyncio
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+asyncio HTTP adapter
+~~~~~~~~~~~~~~~~~~~~
+
+A self-contained HTTP/1.1 server on top of :func:`asyncio.start_server`,
+requiring Python 3.7 or later. Connections are kept alive and pipelined
+requests are answered in order. Views may be ``async def`` functions,
+whose coroutines are awaited in the event loop; plain views are called in
+a thread pool so they cannot block it, unless ``threaded_views`` is turned
+off.
+
+Options are read from the ``asyncio`` key of the ``weiyu.adapter``
+registry::
+
+    weiyu.adapter:
+      asyncio:
+        # seconds to wait for the next request on an idle connection
+        keepalive_timeout: 15
+        # seconds to wait for each piece of a request body, null to wait
+        # forever; a 408 is answered when it expires
+        body_timeout: 60
+        # longest accepted request line plus headers, in bytes
+        max_head_size: 65536
+        # run views in a thread pool, of this many threads if given;
+        # false calls them right in the event loop, which is only safe
+        # if no plain view ever blocks
+        threaded_views: true
+        threads: null
+
+Request bodies are checked against the size limits of the HTTP helper
+(``http`` → ``request`` in the same registry) before being read, and
+larger ones than its ``spool_limit`` are kept in temporary files.
+
+Requests are presented to the rest of the framework with a WSGI-like
+``env``, so everything working with the WSGI adapter works here too.
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+            'WeiyuAsyncioAdapter',
+            'parse_request_head',
+            ]
+
+import asyncio
+import tempfile
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import unquote_to_bytes
+
+from multipart import parse_options_header
+
+from .. import adapter_hub
+
+from ... import registry
+from ...helpers.misc import isawaitable
+from ...stats import timer
+
+from .util import gen_http_headers, status_to_str, BODYLESS_STATUSES
+from .util import dummy_file_wrapper, send_content_iter
+from .util import chunked_encoding_iter, close_content, RequestBodyError
+from .wsgi import WSGIRequest, WSGIReflex
+
+KEEPALIVE_TIMEOUT = 15
+BODY_TIMEOUT = 60
+MAX_HEAD_SIZE = 65536
+
+HEAD_END = b'\r\n\r\n'
+
+# size of blocks the body is copied in
+BODY_BLOCK_SIZE = 65536
+
+_DEC_DIGITS = frozenset(b'0123456789')
+_HEX_DIGITS = frozenset(b'0123456789abcdefABCDEF')
+
+
+def parse_request_head(head):
+    '''Parses the request line and headers in ``head``, the bytes up to
+    and including the empty line.
+
+    Returns ``(method, target, version, headers, )``, where ``target`` is
+    the raw request target as bytes, and ``headers`` is a list of
+    ``(name, value, )`` with the names in lower case. Raises
+    :exc:`ValueError` on malformed input.
+
+    '''
+
+    lines = head[:-len(HEAD_END)].split(b'\r\n')
+
+    parts = lines[0].split(b' ')
+    if len(parts) != 3 or not parts[2].startswith(b'HTTP/1.'):
+        raise ValueError('malformed request line')
+
+    method, target, version = parts
+    headers = []
+    for line in lines[1:]:
+        name, sep, value = line.partition(b':')
+        if not sep or not name or name != name.strip():
+            # also rejects obsolete line folding
+            raise ValueError('malformed header line')
+
+        headers.append((
+                name.decode('latin-1').lower(),
+                value.strip().decode('latin-1'),
+                ))
+
+    return method.decode('ascii'), target, version.decode('ascii'), headers
+
+
+def _parse_length(digits, base=10):
+    # int() alone would accept signs, whitespace and underscores
+    valid = _DEC_DIGITS if base == 10 else _HEX_DIGITS
+    if not digits or not valid.issuperset(digits):
+        raise ValueError('invalid length %r' % (digits, ))
+
+    return int(digits, base)
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class _BodyTimeout(Exception):
+    pass
+
+
+async def _timed(awaitable, timeout):
+    # a read of the body, under the per-read timeout if any
+    if timeout is None:
+        return await awaitable
+
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise _BodyTimeout
+
+
+async def _copy_body(reader, size, body_file, timeout):
+    while size > 0:
+        # take whatever has arrived, so the timeout is about the client
+        # stalling, not about the body as a whole
+        block = await _timed(
+                reader.read(min(size, BODY_BLOCK_SIZE)),
+                timeout,
+                )
+        if not block:
+            raise asyncio.IncompleteReadError(b'', size)
+
+        body_file.write(block)
+        size -= len(block)
+
+
+async def _read_chunked_body(reader, body_file, limit, timeout):
+    # returns the length of the body
+    length = 0
+    while True:
+        line = await _timed(reader.readuntil(b'\r\n'), timeout)
+        size = _parse_length(line[:-2].split(b';', 1)[0].strip(), 16)
+        if size == 0:
+            break
+
+        length += size
+        if limit is not None and length > limit:
+            raise _BodyTooLarge
+
+        await _copy_body(reader, size, body_file, timeout)
+        if await _timed(reader.readexactly(2), timeout) != b'\r\n':
+            raise ValueError('malformed chunk')
+
+    # skip the trailers
+    while await _timed(reader.readuntil(b'\r\n'), timeout) != b'\r\n':
+        pass
+
+    return length
+
+
+def build_environ(
+        method,
+        target,
+        version,
+        headers,
+        body,
+        body_length,
+        peer,
+        sockname,
+        ):
+    '''Builds a WSGI-like ``env`` for the request, ``body`` being a file
+    object holding the ``body_length`` bytes of the body.
+
+    '''
+
+    path, _, query = target.partition(b'?')
+    if not path.startswith(b'/'):
+        # absolute-form, as sent to proxies
+        scheme_end = path.find(b'://')
+        slash = path.find(b'/', scheme_end + 3) if scheme_end >= 0 else -1
+        path = path[slash:] if slash >= 0 else b'/'
+
+    env = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            # the routers want text, so unlike WSGI, decode as UTF-8
+            'PATH_INFO': unquote_to_bytes(path).decode('utf-8', 'replace'),
+            'QUERY_STRING': query.decode('latin-1'),
+            'SERVER_PROTOCOL': version,
+            'SERVER_NAME': sockname[0] if sockname else '',
+            'SERVER_PORT': str(sockname[1]) if sockname else '',
+            'REMOTE_ADDR': peer[0] if peer else '',
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': body,
+            }
+
+    for name, value in headers:
+        if name == 'content-type':
+            env['CONTENT_TYPE'] = value
+        elif name in ('content-length', 'transfer-encoding', ):
+            # the body is already read in full
+            continue
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            env[key] = env[key] + ',' + value if key in env else value
+
+    env['CONTENT_LENGTH'] = str(body_length)
+    return env
+
+
+def _error_response(status):
+    return (
+            'HTTP/1.1 %d %s\r\n'
+            'Content-Length: 0\r\n'
+            'Connection: close\r\n\r\n' % (status, status_to_str(status), )
+            ).encode('latin-1')
+
+
+class AsyncioRequest(WSGIRequest):
+    def __init__(self, env, site_conf, keep_alive, helper=None):
+        super(AsyncioRequest, self).__init__(env, None, site_conf, helper)
+
+        self.keep_alive = keep_alive
+
+
+class AsyncioReflex(WSGIReflex):
+    def __init__(self):
+        super(AsyncioReflex, self).__init__()
+
+        adapter_reg = registry.request('weiyu.adapter')
+        config = adapter_reg.get('asyncio', {})
+
+        self._executor = None
+        if config.get('threaded_views', True):
+            self._executor = ThreadPoolExecutor(config.get('threads', None))
+
+    def _do_accept_request(self, env, keep_alive):
+        return AsyncioRequest(
+                env,
+                self.SITE_CONF,
+                keep_alive,
+                self._helper,
+                )
+
+    async def _generate_response_async(self, request):
+        if request.short_circuit is not None:
+            return request.short_circuit
+
+        # CORS
+        if request.cors_preflight and request.cors_response is not None:
+            # preflight, ignore view
+            return self._finish_response(request.cors_response, False)
+
+        try:
+            response = await self._call_view_async(request)
+        except RequestBodyError as exc:
+            return self._short_circuit_response(request, exc.status)
+
+        return self._finish_response(response)
+
+    async def _call_view_async(self, request):
+        if self._executor is None:
+            response = self._call_view(request)
+        else:
+            response = await asyncio.get_running_loop().run_in_executor(
+                    self._executor,
+                    self._call_view,
+                    request,
+                    )
+
+        if isawaitable(response):
+            if self._route_stats is None:
+                response = await response
+            else:
+                start = timer()
+                response = await response
+                request.stats_times[1] += timer() - start
+
+        return response
+
+    def _do_deliver_response(self, response):
+        '''Returns ``(chunks, keep_alive, )``, ``chunks`` being an iterable
+        of the bytes to send, starting with the response head.
+
+        '''
+
+        request = response.request
+        status = response.status
+        keep_alive = request.keep_alive
+
+        status_line, headers = gen_http_headers(response)
+        names = set(k.lower() for k, v in headers)
+
+        streamed = response.is_raw_file or response.is_streaming
+        if response.is_raw_file:
+            body = dummy_file_wrapper(response.raw_fp, response.raw_blksz)
+        else:
+            body = send_content_iter(response.content, response.encoding)
+
+        if 'content-length' in names or status in BODYLESS_STATUSES:
+            pass
+        elif not streamed:
+            headers.append(('Content-Length', str(len(response.content))))
+        elif request.env['SERVER_PROTOCOL'] == 'HTTP/1.1':
+            headers.append(('Transfer-Encoding', 'chunked', ))
+            body = chunked_encoding_iter(body)
+        else:
+            # the end of body can only be told by closing
+            keep_alive = False
+
+        if 'connection' in names:
+            keep_alive = keep_alive and not any(
+                    v.lower() == 'close'
+                    for k, v in headers
+                    if k.lower() == 'connection'
+                    )
+        else:
+            headers.append((
+                    'Connection',
+                    'keep-alive' if keep_alive else 'close',
+                    ))
+
+        head = ''.join([
+                'HTTP/1.1 %s\r\n' % (status_line, ),
+                ''.join('%s: %s\r\n' % hdr for hdr in headers),
+                '\r\n',
+                ]).encode('latin-1')
+
+        if request.method == 'HEAD' or status in BODYLESS_STATUSES:
+            if response.is_raw_file:
+                response.raw_fp.close()
+            elif response.is_streaming:
+                close_content(response.content)
+
+            return [head], keep_alive
+
+        if not streamed:
+            # small enough to go out in one write
+            return [head + b''.join(body)], keep_alive
+
+        return _prepend(head, body), keep_alive
+
+    async def stimulate_async(self, env, keep_alive):
+        '''The asynchronous counterpart of :meth:`stimulate`.'''
+
+        raw_request = self._do_accept_request(env, keep_alive)
+        request = self._do_translate_request(raw_request)
+        raw_response = await self._generate_response_async(request)
+        response = self._do_postprocess(raw_response)
+        return self._do_deliver_response(response)
+
+
+def _prepend(first, chunks):
+    yield first
+    for chunk in chunks:
+        yield chunk
+
+
+class WeiyuAsyncioAdapter(object):
+    def __init__(self):
+        self.reflex = AsyncioReflex()
+
+        adapter_reg = registry.request('weiyu.adapter')
+        config = adapter_reg.get('asyncio', {})
+        self.keepalive_timeout = config.get(
+                'keepalive_timeout',
+                KEEPALIVE_TIMEOUT,
+                )
+        self.max_head_size = config.get('max_head_size', MAX_HEAD_SIZE)
+        self.body_timeout = config.get('body_timeout', BODY_TIMEOUT)
+
+    async def _read_request(self, reader, writer):
+        # returns (env, keep_alive, ), or None on a clean EOF
+        head = b''
+        while not head:
+            try:
+                # only an idle connection is subject to the keep-alive
+                # timeout; the body has a timeout of its own
+                head = await asyncio.wait_for(
+                        reader.readuntil(HEAD_END),
+                        self.keepalive_timeout,
+                        )
+            except asyncio.IncompleteReadError as exc:
+                if exc.partial.strip():
+                    raise ValueError('truncated request')
+                return None
+            except asyncio.TimeoutError:
+                return None
+
+            # empty lines before the request line are to be ignored
+            head = head.lstrip(b'\r\n')
+
+        method, target, version, headers = parse_request_head(head)
+        fields = dict(headers)
+
+        connection = fields.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = 'close' not in connection
+        else:
+            keep_alive = 'keep-alive' in connection
+
+        chunked = 'transfer-encoding' in fields
+        length = fields.get('content-length', None)
+        if chunked and length is not None:
+            # ambiguous framing
+            raise ValueError('both Transfer-Encoding and Content-Length')
+
+        if chunked and fields['transfer-encoding'].lower() != 'chunked':
+            raise ValueError('unsupported transfer coding')
+
+        if length is not None:
+            length = _parse_length(length.encode('latin-1'))
+
+        # refuse oversized bodies before reading, or asking for, them
+        helper = self.reflex._helper
+        c_type, _ = parse_options_header(fields.get('content-type', ''))
+        limit = helper.body_limit(c_type)
+        if limit is not None and length is not None and length > limit:
+            raise _BodyTooLarge
+
+        has_body = chunked or bool(length)
+        if (has_body
+                and version == 'HTTP/1.1'
+                and fields.get('expect', '').lower() == '100-continue'):
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+        if has_body:
+            body = tempfile.SpooledTemporaryFile(helper.spool_limit)
+            if chunked:
+                length = await _read_chunked_body(
+                        reader,
+                        body,
+                        limit,
+                        self.body_timeout,
+                        )
+            else:
+                await _copy_body(reader, length, body, self.body_timeout)
+            body.seek(0)
+        else:
+            body, length = BytesIO(), 0
+
+        env = build_environ(
+                method,
+                target,
+                version,
+                headers,
+                body,
+                length,
+                writer.get_extra_info('peername'),
+                writer.get_extra_info('sockname'),
+                )
+        return env, keep_alive
+
+    async def handle_connection(self, reader, writer):
+        '''Serves the requests coming in on a connection, in order.'''
+
+        try:
+            while True:
+                try:
+                    parsed = await self._read_request(reader, writer)
+                except asyncio.LimitOverrunError:
+                    writer.write(_error_response(431))
+                    break
+                except _BodyTooLarge:
+                    # the rest of the body is left unread
+                    writer.write(_error_response(413))
+                    break
+                except _BodyTimeout:
+                    writer.write(_error_response(408))
+                    break
+                except (ValueError, asyncio.IncompleteReadError, ):
+                    writer.write(_error_response(400))
+                    break
+
+                if parsed is None:
+                    break
+
+                env, keep_alive = parsed
+                try:
+                    chunks, keep_alive = await self.reflex.stimulate_async(
+                            env,
+                            keep_alive,
+                            )
+                except Exception:
+                    traceback.print_exc()
+                    writer.write(_error_response(500))
+                    break
+
+                try:
+                    for chunk in chunks:
+                        writer.write(chunk)
+                        await writer.drain()
+                except ConnectionError:
+                    raise
+                except Exception:
+                    # a streamed body failed half way; too late for a 500,
+                    # all we can do is cutting the response short
+                    traceback.print_exc()
+                    break
+
+                if not keep_alive:
+                    break
+
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def start_server(self, host=None, port=None, **kwargs):
+        '''Returns a coroutine starting to serve on ``host`` and ``port``,
+        see :func:`asyncio.start_server`.
+
+        '''
+
+        return asyncio.start_server(
+                self.handle_connection,
+                host,
+                port,
+                limit=self.max_head_size,
+                **kwargs
+                )
+
+    def serve_forever(self, host=None, port=None, **kwargs):
+        '''Runs an event loop serving on ``host`` and ``port`` until
+        interrupted.
+
+        '''
+
+        async def _serve():
+            server = await self.start_server(host, port, **kwargs)
+            async with server:
+                await server.serve_forever()
+
+        asyncio.run(_serve())
+
+
+@adapter_hub.register_handler('asyncio')
+def asyncio_adapter_factory(hub):
+    return WeiyuAsyncioAdapter()
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
@@ -20,29 +20,52 @@
 from __future__ import unicode_literals, division
 
 __all__ = [
+            'BaseHTTPRequest',
             'BaseHTTPReflex',
             ]
 
-from ...helpers.misc import smartbytes
+import six
+from multipart import parse_options_header
+
+from ...helpers.misc import smartbytes, isawaitable
+from ...helpers.metaprogramming import cachedproperty
 
 from ... import registry
 from ...utils import httpdate
 
-from ...reflex.classes import BaseReflex
+from ...reflex.classes import BaseReflex, ReflexRequest, ReflexResponse
 from ...router import router_hub
+from ...router.base import DISPATCH_MISS
 from ...session import session_hub
 from ...signals import signal_hub
 from ...rendering import render_hub
+from ...stats import stats_hub, timer
 
 from .. import adapter_hub
 
 from .util import canonicalize_http_headers, get_server_header, HTTPHelper
+from .util import status_to_str, parse_qs_compacted
+from .util import parse_conditional_headers, parse_cookies, BodyStream
+from .util import RequestBodyError
 
 # Status codes that cannot have response body
 # Used to prevent rendering code from being invoked
 # TODO: add more of them
 NO_RESP_BODY_STATUSES = {204, 304, 405, }
 
+# allowed method set -> Allow header value
+_ALLOW_HEADERS = {}
+
+
+def _allow_header(methods):
+    try:
+        return _ALLOW_HEADERS[methods]
+    except KeyError:
+        pass
+
+    result = _ALLOW_HEADERS[methods] = ', '.join(sorted(methods))
+    return result
+
 
 @adapter_hub.declare_middleware('session')
 class HTTPSessionMiddleware(object):
@@ -64,15 +87,115 @@ class HTTPSessionMiddleware(object):
         self._backend.postprocess(response)
 
 
+class BaseHTTPRequest(ReflexRequest):
+    '''Base class of HTTP requests.
+
+    Subclasses provide :meth:`get_header`, :attr:`query_string`,
+    :attr:`content_length` and :attr:`input_stream`. The parsed parts of
+    the request, namely :attr:`query`, :attr:`form`, :attr:`files`,
+    :attr:`conditional` and :attr:`cookies`, are computed from these on
+    first access, so requests not looking at them don't pay for parsing.
+
+    Views wanting to consume the body incrementally, e.g. large uploads,
+    can read :attr:`body_stream` instead of :attr:`form` and
+    :attr:`files`. As both read from the same stream, only one of them
+    should be used.
+
+    '''
+
+    def __init__(self, env, helper=None, *args, **kwargs):
+        super(BaseHTTPRequest, self).__init__(env, *args, **kwargs)
+
+        # the HTTPHelper of the reflex, for parsing the payload
+        self._helper = helper
+
+    def get_header(self, name, default=None):
+        '''Returns the value of the request header ``name``, or
+        ``default`` if it is absent.
+
+        '''
+
+        raise NotImplementedError
+
+    @cachedproperty
+    def query(self):
+        '''Parsed query string.'''
+
+        qs = self.query_string
+        return parse_qs_compacted(qs) if qs else {}
+
+    @cachedproperty
+    def content_type(self):
+        '''``(mimetype, options, )`` parsed from the ``Content-Type``
+        header.
+
+        '''
+
+        return parse_options_header(self.get_header('Content-Type', ''))
+
+    @cachedproperty
+    def body_limit(self):
+        '''Size limit of the body in bytes, or ``None`` if unlimited.'''
+
+        if self._helper is None:
+            return None
+
+        return self._helper.body_limit(self.content_type[0])
+
+    @cachedproperty
+    def body_stream(self):
+        '''The body as a :class:`~weiyu.adapters.http.util.BodyStream`,
+        enforcing :attr:`body_limit` while being read.
+
+        '''
+
+        return BodyStream(
+                self.input_stream,
+                self.content_length,
+                self.body_limit,
+                )
+
+    @cachedproperty
+    def _payload(self):
+        if self._helper is None:
+            return None, None
+
+        return self._helper.parse_payload(self)
+
+    @cachedproperty
+    def form(self):
+        '''Form fields parsed from the body of ``POST`` and ``PUT``
+        requests, ``None`` otherwise.
+
+        '''
+
+        return self._payload[0]
+
+    @cachedproperty
+    def files(self):
+        '''Uploaded files of multipart ``POST`` and ``PUT`` requests,
+        ``None`` otherwise.
+
+        '''
+
+        return self._payload[1]
+
+    @cachedproperty
+    def conditional(self):
+        '''Parsed conditional request headers.'''
+
+        return parse_conditional_headers(self)
+
+    @cachedproperty
+    def cookies(self):
+        '''Cookie values sent with the request.'''
+
+        return parse_cookies(self.get_header('Cookie'))
+
+
 class BaseHTTPReflex(BaseReflex):
     def __init__(self):
         self.SITE_CONF = registry.request('site')
-        # no more repeated lookups for handler
-        # NOTE: Remember this can lead to stale value when handler got
-        # dynamically updated. This is (admittedly) a VERY rare and
-        # dangerous case that's simply NOT going to work, but the expected
-        # behavior is documented here anyway.
-        self._do_routing = router_hub.get_handler('http')
 
         self.send_server_hdr = self.SITE_CONF.get('send_server_header', False)
 
@@ -80,6 +203,97 @@ class BaseHTTPReflex(BaseReflex):
         http_config = adapter_reg.get('http', {})
         self._helper = HTTPHelper(http_config)
 
+        # per-route statistics, if enabled
+        self._route_stats = None
+        if stats_hub.enabled:
+            self._route_stats = stats_hub.route_stats
+
+    def _route_request(self, request, path, host):
+        '''Routes ``request`` by its ``path`` and ``host``, filling in the
+        callback information.
+
+        Returns ``False`` if there is nowhere to route, or the route does
+        not accept ``request.method``; in that case a plain 404 or 405
+        response is prepared in ``request.short_circuit``, and the rest of
+        request processing should be skipped. ``OPTIONS`` requests are
+        always let through, for CORS preflight to work.
+
+        '''
+
+        # Note that we don't pass in "request" at this moment. The object
+        # can be replaced by potential hooks, and we certainly don't want
+        # a reference to be frozen in the request.
+        # Return value is of format (fn, args, kwargs, route_data, )
+        timed = self._route_stats is not None
+        if timed:
+            start = timer()
+
+        route_result = router_hub.try_dispatch('http', path, host)
+
+        if timed:
+            request.stats_times = [timer() - start, 0, 0, ]
+
+        if route_result is DISPATCH_MISS:
+            request.short_circuit = self._short_circuit_response(
+                    request,
+                    404,
+                    )
+            return False
+
+        route_data = route_result[-1]
+        allowed = route_data.get('allowed_methods') if route_data else None
+        if (allowed is not None
+                and request.method not in allowed
+                and request.method != 'OPTIONS'):
+            request.short_circuit = self._short_circuit_response(
+                    request,
+                    405,
+                    {'allowed_methods': _allow_header(allowed), },
+                    )
+            return False
+
+        request.short_circuit = None
+        request.callback_info = route_result[:-1]
+        request.route_data = route_data
+        return True
+
+    def _check_body_size(self, request):
+        '''Rejects ``request`` early if its ``Content-Length`` is over the
+        body size limit of its content type, without reading the body.
+
+        Returns ``False`` in that case, with a 413 response prepared in
+        ``request.short_circuit``. Bodies without a ``Content-Length`` are
+        checked while being read instead; a :exc:`RequestBodyError` raised
+        by then is answered with its status in place of the view response.
+
+        '''
+
+        limit = request.body_limit
+        if limit is not None and request.content_length > limit:
+            request.short_circuit = self._short_circuit_response(
+                    request,
+                    413,
+                    )
+            return False
+
+        return True
+
+    def _short_circuit_response(self, request, status, context=None):
+        # A bare response that skips the view, middlewares and rendering.
+        ctx = {
+                'prerendered': True,
+                'mimetype': 'text/plain',
+                }
+        if context is not None:
+            ctx.update(context)
+
+        return ReflexResponse(
+                status,
+                status_to_str(status),
+                ctx,
+                request,
+                )
+
     def _do_translate_request(self, request):
         # CORS check
         is_cors, cors_response = self._helper.cors_helper.handle_cors(request)
@@ -96,17 +310,49 @@ class BaseHTTPReflex(BaseReflex):
         return request
 
     def _do_generate_response(self, request):
+        if request.short_circuit is not None:
+            return request.short_circuit
+
         # CORS
         if request.cors_preflight and request.cors_response is not None:
             # preflight, ignore view
-            response = request.cors_response
-        else:
-            fn, args, kwargs = request.callback_info
-            response = fn(request, *args, **kwargs)
+            return self._finish_response(request.cors_response, False)
+
+        try:
+            response = self._call_view(request)
+        except RequestBodyError as exc:
+            # the body turned out unacceptable while being parsed
+            return self._short_circuit_response(request, exc.status)
+
+        if isawaitable(response):
+            raise TypeError(
+                    'asynchronous views are only supported by the asyncio '
+                    'adapter'
+                    )
+
+        return self._finish_response(response)
+
+    def _call_view(self, request):
+        '''Invokes the view ``request`` is routed to, and returns what it
+        returns, which may be an awaitable for ``async def`` views.
+
+        '''
+
+        fn, args, kwargs = request.callback_info
+        if self._route_stats is None:
+            return fn(request, *args, **kwargs)
 
+        start = timer()
+        response = fn(request, *args, **kwargs)
+        request.stats_times[1] = timer() - start
+        return response
+
+    def _finish_response(self, response, from_view=True):
+        if from_view:
             # Middleware
             signal_hub.fire_nullok('http-middleware-post', response)
 
+        # CORS
         self._helper.cors_helper.cors_postprocess(response)
 
         # STS
@@ -136,6 +382,7 @@ class BaseHTTPReflex(BaseReflex):
 
         # is this a raw file push request?
         response.is_raw_file = ctx.get('is_raw_file', False)
+        response.is_streaming = False
         if response.is_raw_file and 'sendfile_fp' in response.content:
             # request to send raw file valid, suppress rendering
             dont_render = True
@@ -154,6 +401,11 @@ class BaseHTTPReflex(BaseReflex):
         if dont_render:
             # literally don't render anything
             response.content = b''
+        elif ctx.get('prerendered', False):
+            # content is ready to be sent as is, e.g. short-circuited error
+            # responses
+            mime = ctx.get('mimetype', 'text/plain')
+            response.content = smartbytes(response.content, enc, 'replace')
         else:
             render_in, cont = None, b''
 
@@ -168,6 +420,10 @@ class BaseHTTPReflex(BaseReflex):
                         )
 
             # rendering is not suppressed, do it now
+            timed = self._route_stats is not None
+            if timed:
+                start = timer()
+
             cont, extras = render_hub.render_view(
                     request.callback_info[0],
                     response.content,
@@ -175,6 +431,9 @@ class BaseHTTPReflex(BaseReflex):
                     render_in,
                     )
 
+            if timed:
+                request.stats_times[2] = timer() - start
+
             if 'mimetype' in extras:
                 # Allow renderers to override mimetype
                 mime = extras['mimetype']
@@ -182,8 +441,14 @@ class BaseHTTPReflex(BaseReflex):
                 if mime is None:
                     mime = ctx.get('mimetype', 'text/html')
 
-            # encode content, if it's a Unicode thing
-            response.content = smartbytes(cont, enc, 'replace')
+            if isinstance(cont, (six.text_type, six.binary_type, )):
+                # encode content, if it's a Unicode thing
+                response.content = smartbytes(cont, enc, 'replace')
+            else:
+                # an iterable of chunks, to be encoded and sent one by one
+                # as they are produced
+                response.content = cont
+                response.is_streaming = True
 
         # Prepare headers.
         # Process any headers directly specified in response objects.
@@ -240,6 +505,17 @@ class BaseHTTPReflex(BaseReflex):
         response.http_headers.extend(hdrs)
         response._dont_render = dont_render
 
+        # account the request to its endpoint
+        if self._route_stats is not None and request.short_circuit is None:
+            route_data = request.route_data or {}
+            self._route_stats.record(
+                    (
+                        route_data.get('scope', ''),
+                        route_data.get('target_spec', None),
+                        ),
+                    *request.stats_times
+                    )
+
         return response
 
 
@@ -23,41 +23,123 @@ __all__ = [
             'WeiyuTornadoAdapter',
             ]
 
+import sys
+import traceback
+from functools import partial
+from io import BytesIO
+
+import six
+
 try:
-    from tornado.wsgi import WSGIContainer
+    from tornado import httputil
     from tornado.httpserver import HTTPServer
+
+    # Tornado 4.0+ frames response bodies itself, given the start line
+    ResponseStartLine = getattr(httputil, 'ResponseStartLine', None)
 except ImportError:
     # later used to check if Tornado is actually installed,
     # raising exception if it isn't the case.
     HTTPServer = object
+    ResponseStartLine = None
 
 from .. import adapter_hub
 
+from ... import registry
 from ...helpers.misc import smartstr
-from ...reflex.classes import ReflexRequest
 
-from .base import BaseHTTPReflex
-from .util import parse_qs_compacted
-from .util import parse_conditional_headers_into
+from .base import BaseHTTPRequest, BaseHTTPReflex
 from .util import dummy_file_wrapper, send_content_iter, gen_http_headers
-
-
-class TornadoRequest(ReflexRequest):
-    def __init__(self, tornado_req, site_conf):
-        super(TornadoRequest, self).__init__(
-                WSGIContainer.environ(tornado_req)
-                )
+from .util import chunked_encoding_iter, close_content, BODYLESS_STATUSES
+from .util import native_str
+
+unquote_to_bytes = six.moves.urllib.parse.unquote_to_bytes
+
+
+def _build_environ(t_req):
+    # same as what tornado.wsgi.WSGIContainer produces, but without
+    # touching the headers of t_req
+    host, _, port = t_req.host.partition(':')
+    if not port:
+        port = '443' if t_req.protocol == 'https' else '80'
+
+    env = {
+            'REQUEST_METHOD': t_req.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': native_str(unquote_to_bytes(t_req.path)),
+            'QUERY_STRING': t_req.query,
+            'REMOTE_ADDR': t_req.remote_ip,
+            'SERVER_NAME': host,
+            'SERVER_PORT': port,
+            'SERVER_PROTOCOL': t_req.version,
+            'wsgi.version': (1, 0, ),
+            'wsgi.url_scheme': t_req.protocol,
+            'wsgi.input': BytesIO(t_req.body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            }
+
+    for name, value in t_req.headers.items():
+        key = name.upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH', ):
+            key = 'HTTP_' + key
+        env[key] = value
+
+    return env
+
+
+class TornadoRequest(BaseHTTPRequest):
+    def __init__(self, tornado_req, site_conf, helper=None):
+        super(TornadoRequest, self).__init__(None, helper)
         self._native_request = tornado_req
 
         self.site = site_conf
 
+    @property
+    def env(self):
+        '''WSGI environ of the request, built on first access.
+
+        The adapter itself reads everything from the native request, so
+        only views and session backends needing an environ pay for it.
+
+        '''
+
+        env = self._env
+        if env is None:
+            env = self._env = _build_environ(self._native_request)
+        return env
+
+    @env.setter
+    def env(self, value):
+        self._env = value
+
+    def get_header(self, name, default=None):
+        return self._native_request.headers.get(name, default)
+
+    @property
+    def query_string(self):
+        return self._native_request.query
+
+    @property
+    def content_length(self):
+        '''Length of the request body, which Tornado has read in full.'''
+
+        return len(self._native_request.body)
+
+    @property
+    def input_stream(self):
+        '''File-like object the request body is read from.'''
+
+        return BytesIO(self._native_request.body)
+
 
 class TornadoReflex(BaseHTTPReflex):
     def __init__(self):
         super(TornadoReflex, self).__init__()
 
     def _do_accept_request(self, tornado_req):
-        return TornadoRequest(tornado_req, self.SITE_CONF)
+        return TornadoRequest(tornado_req, self.SITE_CONF, self._helper)
 
     def _do_translate_request(self, request):
         t_req = request._native_request
@@ -65,28 +147,25 @@ class TornadoReflex(BaseHTTPReflex):
         # TODO: improve encoding handling here
         path = request.path = smartstr(t_req.path, 'utf-8', 'replace')
         host = request.host = smartstr(t_req.host, 'utf-8', 'replace')
+        method = request.method = smartstr(t_req.method)
 
         # Move routing (much) earlier so we don't waste time in processing
         # requests impossible to fulfill.
-        # Note that we don't pass in "request" at this moment. The object
-        # can be replaced by potential hooks, and we certainly don't want
-        # a reference to be frozen in the request.
-        # Return value is of format (fn, args, kwargs, route_data, )
-        route_result = self._do_routing(path, host)
-        request.callback_info = route_result[:-1]
-        request.route_data = route_result[-1]
+        if not self._route_request(request, path, host):
+            # nowhere to route, or method not allowed; a 404 or 405 is
+            # already prepared
+            return request
+
+        if not self._check_body_size(request):
+            # body too large; a 413 is already prepared
+            return request
 
         # Rest of request object preparation goes here...
         request.remote_addr = smartstr(t_req.remote_ip)
         request.protocol = smartstr(t_req.protocol)
-        method = request.method = smartstr(t_req.method)
-
-        # parse query string if present
-        qs = t_req.query
-        request.query = parse_qs_compacted(qs) if qs else {}
 
-        # parse request body if applicable
-        self._helper.maybe_parse_payload_into(request)
+        # Query string, request body, conditional headers and cookies are
+        # parsed on first access; see BaseHTTPRequest.
 
         # CORS support
         origin = t_req.headers.get('Origin', None)
@@ -103,77 +182,212 @@ class TornadoReflex(BaseHTTPReflex):
         else:
             request.origin, request.cors_request = None, {}
 
-        # Conditional requests
-        parse_conditional_headers_into(request)
-
         # TODO: add more ubiquitous HTTP request headers
 
         # do session injection in baseclass
         return super(TornadoReflex, self)._do_translate_request(request)
 
     def _start_response(self, response):
-        content = response.content
-        status_code = response.status
-        enc = response.encoding
+        '''Returns ``(status_line, headers, body, )``, ``body`` being an
+        iterable of the bytes to send, not yet framed for the wire.
 
-        t_req = response.request._native_request
+        '''
 
+        t_req = response.request._native_request
         status_line, headers = gen_http_headers(response)
+        names = set(k.lower() for k, v in headers)
 
-        # TODO: keep-alive things
-        close_found = False
-        for k, v in headers:
-            if b'connection' == k.lower():
-                close_found = True
-                break
-        if not close_found:
-            headers.append((b'Connection', b'close', ))
-
-        header_str = b'\r\n'.join(b'%s: %s' % hdr for hdr in headers)
+        if t_req.method == 'HEAD' or response.status in BODYLESS_STATUSES:
+            if response.is_raw_file:
+                response.raw_fp.close()
+            elif response.is_streaming:
+                close_content(response.content)
 
-        # Initiate the actual conversation
-        t_req.write(b'HTTP/%s %s\r\n%s\r\n\r\n' % (
-                b'1.1' if t_req.supports_http_1_1() else b'1.0',
-                status_line, header_str,
-                ))
+            return status_line, headers, []
 
         if response.is_raw_file:
-            # push raw file
-            return dummy_file_wrapper(response.raw_fp, response.raw_blksz)
+            body = dummy_file_wrapper(response.raw_fp, response.raw_blksz)
         else:
-            return send_content_iter(content, enc)
+            body = send_content_iter(response.content, response.encoding)
+
+        if 'content-length' in names:
+            pass
+        elif not (response.is_raw_file or response.is_streaming):
+            headers.append((
+                    'Content-Length',
+                    str(len(response.content)),
+                    ))
+        elif t_req.version != 'HTTP/1.1':
+            # Length unknown beforehand, and HTTP/1.0 has no chunked
+            # encoding; the length has to be known for the connection to
+            # stay usable.
+            body = [b''.join(body)]
+            headers.append(('Content-Length', str(len(body[0])), ))
+
+        return status_line, headers, body
 
     def _do_deliver_response(self, response):
         if response._vanished:
             return
 
-        req = response.request._native_request
-        writer = req.write
-        iterable = self._start_response(response)
-        for chunk in iterable:
-            writer(chunk)
-        req.finish()
+        t_req = response.request._native_request
+        status_line, headers, body = self._start_response(response)
+        if ResponseStartLine is not None:
+            _deliver(t_req, status_line, headers, body)
+        else:
+            _deliver_legacy(t_req, status_line, headers, body)
+
+
+def _deliver(t_req, status_line, headers, body):
+    # Tornado 4.0+: the connection uses Content-Length if given, and chunked
+    # encoding otherwise, then decides whether to keep itself alive
+    code, reason = status_line.split(' ', 1)
+    t_headers = httputil.HTTPHeaders()
+    for k, v in headers:
+        t_headers.add(k, v)
+
+    conn = t_req.connection
+    conn.write_headers(
+            ResponseStartLine('HTTP/1.1', int(code), reason),
+            t_headers,
+            )
+    _write_body(conn, iter(body))
+
+
+def _close_body(chunks):
+    close = getattr(chunks, 'close', None)
+    if close is not None:
+        close()
+
+
+def _write_body(conn, chunks, flushed=None):
+    # write() returns a future resolved once the chunk is flushed, and the
+    # next chunk is only produced then, so a large streamed body is never
+    # buffered in memory as a whole
+    while flushed is None or flushed.done():
+        if flushed is not None and flushed.exception() is not None:
+            # the connection is gone, and so is any use of the rest
+            _close_body(chunks)
+            return
+
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            conn.finish()
+            return
+        except Exception:
+            # a streamed body failed half way; too late for a 500, all we
+            # can do is cutting the response short
+            traceback.print_exc()
+            conn.close()
+            return
+
+        flushed = conn.write(chunk)
+
+    flushed.add_done_callback(partial(_write_body, conn, chunks))
+
+
+def _client_keeps_alive(t_req):
+    # mirrors the decision of the pre-4.0 HTTPConnection after finish()
+    if getattr(t_req.connection, 'no_keep_alive', False):
+        return False
+
+    connection = t_req.headers.get('Connection', '').lower()
+    if t_req.version == 'HTTP/1.1':
+        return connection != 'close'
+
+    return connection == 'keep-alive' and (
+            'Content-Length' in t_req.headers
+            or t_req.method in ('HEAD', 'GET', )
+            )
+
+
+def _deliver_legacy(t_req, status_line, headers, body):
+    # Tornado before 4.0 leaves the whole response to us
+    http11 = t_req.version == 'HTTP/1.1'
+    names = set(k.lower() for k, v in headers)
+
+    if 'content-length' not in names and body:
+        # only streamed bodies get here, on HTTP/1.1
+        headers.append(('Transfer-Encoding', 'chunked', ))
+        body = chunked_encoding_iter(body)
+
+    if 'connection' not in names:
+        if not _client_keeps_alive(t_req):
+            headers.append(('Connection', 'close', ))
+        elif not http11:
+            headers.append(('Connection', 'keep-alive', ))
+
+    t_req.write(''.join([
+            'HTTP/%s %s\r\n' % ('1.1' if http11 else '1.0', status_line, ),
+            ''.join('%s: %s\r\n' % hdr for hdr in headers),
+            '\r\n',
+            ]).encode('latin-1'))
+
+    _write_body_legacy(t_req, iter(body))
+
+
+def _write_body_legacy(t_req, chunks):
+    # no futures before 4.0, but write() takes a callback run once the
+    # chunk is flushed; it is never run if the connection is closed
+    try:
+        chunk = next(chunks)
+    except StopIteration:
+        t_req.finish()
+        return
+    except Exception:
+        traceback.print_exc()
+        t_req.connection.stream.close()
+        return
+
+    t_req.write(chunk, partial(_write_body_legacy, t_req, chunks))
+
+
+def _default_callback(request_callback):
+    if request_callback is None:
+        # the stimulate method is the callback
+        request_callback = TornadoReflex().stimulate
+
+    return request_callback
 
 
 class WeiyuTornadoAdapter(HTTPServer):
-    def __init__(self):
+    '''Tornado HTTP server handing requests to a fresh
+    :class:`TornadoReflex`, unless another ``request_callback`` is given.
+    Other keyword arguments are those of
+    :class:`tornado.httpserver.HTTPServer`.
+
+    '''
+
+    def __init__(self, request_callback=None, **kwargs):
         if HTTPServer is object:
             # Well... the real HTTPServer is not there.
             raise RuntimeError('tornado.httpserver.HTTPServer not found')
 
-        self.__reflex = TornadoReflex()
-
-        # the stimulate method is the callback
-        # TODO: keep-alive, chunked encoding, and so on
-        super(WeiyuTornadoAdapter, self).__init__(
-                self.__reflex.stimulate,
-                no_keep_alive=True,
+        if ResponseStartLine is None:
+            # before Tornado 4.0, initialization is all done here
+            super(WeiyuTornadoAdapter, self).__init__(
+                    _default_callback(request_callback),
+                    **kwargs
+                    )
+
+    def initialize(self, request_callback=None, **kwargs):
+        # Tornado 4.0+ calls this with the arguments of the constructor,
+        # and ignores them in __init__
+        super(WeiyuTornadoAdapter, self).initialize(
+                _default_callback(request_callback),
+                **kwargs
                 )
 
 
 @adapter_hub.register_handler('tornado')
 def tornado_adapter_factory(hub):
-    return WeiyuTornadoAdapter()
+    adapter_reg = registry.request('weiyu.adapter')
+    config = adapter_reg.get('tornado', {})
+
+    return WeiyuTornadoAdapter(
+            no_keep_alive=not config.get('keep_alive', True),
+            )
 
 
 # vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
@@ -20,20 +20,29 @@
 from __future__ import unicode_literals, division
 
 __all__ = [
+            'native_str',
             'status_to_str',
             'build_host_str',
             'dummy_file_wrapper',
+            'raw_file_length',
             'send_content_iter',
+            'chunked_encoding_iter',
+            'close_content',
+            'BodyStream',
+            'RequestBodyError',
             'parse_qs_compacted',
+            'parse_conditional_headers',
             'parse_conditional_headers_into',
+            'parse_cookies',
             'canonicalize_http_headers',
             'gen_http_headers',
             'get_server_header',
             'HTTPHelper',
             ]
 
+import os
+import stat
 from functools import partial
-from io import BytesIO
 
 try:
     import ujson as json
@@ -47,15 +56,54 @@ from ...helpers.misc import smartstr, smartbytes
 from ...utils.httpdate import parse_http_date
 
 parse_qs = six.moves.urllib.parse.parse_qs
+SimpleCookie = six.moves.http_cookies.SimpleCookie
+CookieError = six.moves.http_cookies.CookieError
 
 from .cors import CORSReflexHelper
 
 # See http://www.w3.org/Protocols/rfc2616/rfc2616-sec10.html
 STATUS_CODES_MAP = six.moves.http_client.responses
 
+# Statuses whose responses never carry a body, not even a zero-length one
+BODYLESS_STATUSES = {204, 304, }
+
 # Content types that can be parsed into a form
 _FORM_CONTENT_HANDLERS = {}
 
+# Default size limits of request bodies in bytes, by content type; bodies of
+# other types are not limited unless configured so
+DEFAULT_BODY_LIMITS = {
+        'application/x-www-form-urlencoded': 2 ** 20,  # 1 MiB
+        'application/json': 2 ** 20,
+        'multipart/form-data': 2 ** 30,  # 1 GiB
+        }
+
+# Multipart parts larger than this are spooled to temporary files
+DEFAULT_SPOOL_LIMIT = 2 ** 18  # 256 KiB
+
+# Total size of the multipart parts kept in memory
+DEFAULT_MULTIPART_MEM_LIMIT = 2 ** 20
+
+
+# multipart 1.0+ has a distinct exception for the limits, older versions only
+# tell them apart in the message
+_MultipartLimitReached = getattr(multipart, 'ParserLimitReached', None)
+
+
+class RequestBodyError(ValueError):
+    '''Raised when a request body cannot be accepted, with the HTTP
+    ``status`` to answer: 413 if it is over a size limit, 400 if it is
+    malformed.
+
+    '''
+
+    def __init__(self, status, message=None):
+        if message is None:
+            message = STATUS_CODES_MAP[status]
+
+        super(RequestBodyError, self).__init__(message)
+        self.status = status
+
 
 def _form_content_handler(content_type):
     def _decorator_(fn):
@@ -71,6 +119,15 @@ def _form_content_handler(content_type):
     return _decorator_
 
 
+# Converts bytes to a PEP 3333 "native string", as found in WSGI environs and
+# header lists: the bytes themselves on Python 2, decoded as Latin-1 on 3
+if six.PY2:
+    native_str = str
+else:
+    def native_str(b):
+        return b.decode('latin-1')
+
+
 def status_to_str(status):
     '''Converts status code to its description.
 
@@ -108,32 +165,112 @@ def dummy_file_wrapper(fp, blk_sz=None):
     fp.close()
 
 
+def raw_file_length(fp):
+    '''Returns the number of bytes left to read from ``fp``, or ``None``
+    if that can't be known in advance, i.e. ``fp`` is not a regular file.
+
+    '''
+
+    try:
+        st = os.fstat(fp.fileno())
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return st.st_size - fp.tell()
+    except (AttributeError, EnvironmentError, ValueError):
+        # no fileno() or tell(), or io.UnsupportedOperation
+        return None
+
+
 def send_content_iter(content, enc):
     if isinstance(content, six.string_types):
         yield smartbytes(content, enc, 'replace')
     elif isinstance(content, six.binary_type):
         yield content
     else:
-        for chunk in content:
-            # encode and send the chunk using response.encoding
-            yield smartbytes(chunk, enc, 'replace')
+        try:
+            for chunk in content:
+                # encode and send the chunk using response.encoding
+                yield smartbytes(chunk, enc, 'replace')
+        finally:
+            close_content(content)
 
 
-def read_request_payload_in_mem(stream, length, options):
-    # Mimicking multipart's strategy here.
-    # TODO: make the two options configurable
-    mem_limit = 2 ** 20  # 1 MiB
-    charset = options.get('charset', 'utf-8')
+def close_content(content):
+    '''Closes a streamed response body that won't be sent, so generators
+    run their cleanup.
+
+    '''
 
-    if length > mem_limit:
-        raise ValueError('Content-Length exceeded configured limit')
+    close = getattr(content, 'close', None)
+    if close is not None:
+        close()
 
-    data = stream.read(mem_limit).decode(charset)
 
-    if stream.read(1):
-        raise ValueError('Request too big')
+def chunked_encoding_iter(chunks):
+    '''Frames the bytes in ``chunks`` with the HTTP/1.1 chunked
+    transfer-coding, ending with the last-chunk.
+
+    '''
+
+    for chunk in chunks:
+        # an empty chunk would end the body prematurely
+        if chunk:
+            yield b'%x\r\n' % (len(chunk), ) + chunk + b'\r\n'
 
-    return data
+    yield b'0\r\n\r\n'
+
+
+class BodyStream(object):
+    '''Read-only file-like object over a request body.
+
+    Never reads past the ``length`` of the body if it is known (i.e. not
+    negative), and raises a 413 :exc:`RequestBodyError` if more than
+    ``limit`` bytes are read, unless ``limit`` is ``None``. Iterating over
+    the stream yields the body in blocks of at most ``blksz`` bytes.
+
+    '''
+
+    def __init__(self, stream, length=-1, limit=None, blksz=65536):
+        self._stream = stream
+        self._remaining = length if length >= 0 else None
+        self._limit = limit
+        self._consumed = 0
+        self.blksz = blksz
+
+    def read(self, size=-1):
+        remaining = self._remaining
+        if remaining is not None:
+            if size < 0 or size > remaining:
+                size = remaining
+        elif size < 0 and self._limit is not None:
+            # one byte past the limit is enough to tell
+            size = self._limit - self._consumed + 1
+
+        if size == 0:
+            return b''
+
+        data = self._stream.read(size) if size > 0 else self._stream.read()
+        self._consumed += len(data)
+        if remaining is not None:
+            self._remaining = remaining - len(data)
+
+        if self._limit is not None and self._consumed > self._limit:
+            raise RequestBodyError(413, 'Request too big')
+
+        return data
+
+    def __iter__(self):
+        read, blksz = self.read, self.blksz
+        chunk = read(blksz)
+        while chunk:
+            yield chunk
+            chunk = read(blksz)
+
+
+def read_request_payload_in_mem(stream, length, options):
+    # the size limit is enforced by the BodyStream
+    charset = options.get('charset', 'utf-8')
+    return stream.read().decode(charset)
 
 
 def compact_multidict_inplace(dct):
@@ -149,36 +286,59 @@ def parse_qs_compacted(qs):
     return result
 
 
-def parse_conditional_headers_into(request):
-    env = request.env
+def parse_conditional_headers(request):
+    get_header = request.get_header
 
     result = {}
 
-    if 'HTTP_IF_MODIFIED_SINCE' in env:
-        try:
-            ts = parse_http_date(env['HTTP_IF_MODIFIED_SINCE'])
-            result['If-Modified-Since'] = ts
-        except ValueError:
-            pass
-
-    if 'HTTP_IF_UNMODIFIED_SINCE' in env:
-        try:
-            ts = parse_http_date(env['HTTP_IF_UNMODIFIED_SINCE'])
-            result['If-Unmodified-Since'] = ts
-        except ValueError:
-            pass
+    for name in ('If-Modified-Since', 'If-Unmodified-Since', ):
+        value = get_header(name)
+        if value is not None:
+            try:
+                result[name] = parse_http_date(value)
+            except ValueError:
+                pass
 
     # TODO: support ETag-based headers (If-None-Match and friends)
 
-    request.conditional = result
+    return result
+
+
+def parse_conditional_headers_into(request):
+    request.conditional = parse_conditional_headers(request)
+
+
+def parse_cookies(cookie_hdr):
+    '''Parses a ``Cookie`` request header into a ``dict`` of cookie values.
+    A malformed header yields an empty ``dict``.
+
+    '''
+
+    if not cookie_hdr:
+        return {}
+
+    cookie = SimpleCookie()
+    try:
+        cookie.load(cookie_hdr)
+    except CookieError:
+        return {}
+
+    return dict((k, morsel.value) for k, morsel in six.iteritems(cookie))
+
+
+def _multipart_error_status(exc):
+    if _MultipartLimitReached is not None:
+        return 413 if isinstance(exc, _MultipartLimitReached) else 400
+
+    return 413 if 'limit' in str(exc).lower() else 400
 
 
 @_form_content_handler('application/x-www-form-urlencoded')
 def _parse_urlencoded_form(stream, length, options):
     try:
         content = read_request_payload_in_mem(stream, length, options)
-    except ValueError:
-        return None, None
+    except UnicodeDecodeError:
+        raise RequestBodyError(400, 'Undecodable form')
 
     return parse_qs_compacted(content), None
 
@@ -187,21 +347,33 @@ def _parse_urlencoded_form(stream, length, options):
 def _parse_json_form(stream, length, options):
     try:
         content = read_request_payload_in_mem(stream, length, options)
+        form = json.loads(content)
+    except RequestBodyError:
+        raise
     except ValueError:
-        return None, None
+        raise RequestBodyError(400, 'Malformed JSON')
 
-    return json.loads(content), None
+    return form, None
 
 
 @_form_content_handler('multipart/form-data')
-def _parse_multipart_form(stream, length, options):
+def _parse_multipart_form(stream, length, options, **kwargs):
     boundary = options.get('boundary', None)
     if boundary is None:
-        return None, None
+        raise RequestBodyError(400, 'Missing multipart boundary')
 
-    parser = multipart.MultipartParser(stream, boundary, length)
     form, files = {}, {}
-    for part in parser:
+    try:
+        # file parts larger than memfile_limit are spooled to disk
+        parser = multipart.MultipartParser(stream, boundary, length, **kwargs)
+        parts = list(parser)
+    except RequestBodyError:
+        raise
+    except (multipart.MultipartError, ValueError) as exc:
+        # malformed, or over one of the limits of the parser
+        raise RequestBodyError(_multipart_error_status(exc), str(exc))
+
+    for part in parts:
         part_name = part.name
 
         if part.filename or not part.is_buffered():
@@ -249,18 +421,23 @@ def gen_http_headers(response, __Content_Length=str('Content-Length')):
     # ensure all header contents are bytes
     headers = []
 
-    # insert a Content-Length along if response is not raw file and contains
-    # a body
-    if not response.is_raw_file and not response._dont_render:
-        headers.append((
-                __Content_Length,
-                str(len(response.content)),
-                ))
+    # insert a Content-Length along if the body length is known: either the
+    # response is rendered in full, or it's a raw file we can stat
+    if response.is_raw_file:
+        length = None
+        if status_code not in BODYLESS_STATUSES:
+            length = raw_file_length(response.raw_fp)
+    elif not response._dont_render and not response.is_streaming:
+        length = len(response.content)
+    else:
+        length = None
+
+    if length is not None:
+        headers.append((__Content_Length, str(length), ))
 
     for k, v in response.http_headers:
         k_bytes, v_bytes = smartbytes(k, enc), smartbytes(v, enc)
-        k_str, v_str = str(k_bytes), str(v_bytes)
-        headers.append((k_str, v_str, ))
+        headers.append((native_str(k_bytes), native_str(v_bytes), ))
 
     return status_line, headers
 
@@ -305,6 +482,33 @@ class HTTPHelper(object):
         acceptable_mimes = whitelisted_mimes.difference(blacklisted_mimes)
         self._acceptable_post_mimes = frozenset(acceptable_mimes)
 
+        # Body size limits, ``None`` meaning unlimited
+        self._body_limits = dict(DEFAULT_BODY_LIMITS)
+        self._body_limits.update(request_config.get('body_limits', {}))
+        self._default_body_limit = request_config.get('body_limit', None)
+
+        # Bodies, or multipart parts, larger than this are kept on disk
+        self.spool_limit = request_config.get(
+                'spool_limit',
+                DEFAULT_SPOOL_LIMIT,
+                )
+
+        # Extra arguments to the form content handlers
+        self._handler_kwargs = {
+                'multipart/form-data': {
+                    'memfile_limit': self.spool_limit,
+                    'mem_limit': request_config.get(
+                        'multipart_mem_limit',
+                        DEFAULT_MULTIPART_MEM_LIMIT,
+                        ),
+                    },
+                }
+        multipart_limit = self.body_limit('multipart/form-data')
+        if multipart_limit is not None:
+            self._handler_kwargs['multipart/form-data']['disk_limit'] = (
+                    multipart_limit
+                    )
+
         # CORS
         self.cors_helper = CORSReflexHelper(config.get('cors', {}))
 
@@ -315,31 +519,45 @@ class HTTPHelper(object):
         # Strict-Transport-Security
         self._init_sts(response_config.get('sts', {}))
 
-    def _do_parse_payload(self, request):
-        env = request.env
+    def body_limit(self, c_type):
+        '''Returns the size limit in bytes of request bodies of MIME type
+        ``c_type``, or ``None`` if they are not limited.
 
-        # Parse Content-Type header
-        c_type_hdr = env.get('CONTENT_TYPE', '')
-        c_type, options = multipart.parse_options_header(c_type_hdr)
+        '''
 
-        # Content-Length
-        c_len = int(env.get('CONTENT_LENGTH', '-1'))
+        return self._body_limits.get(c_type, self._default_body_limit)
 
-        # wsgi.input
-        # Using ``or`` here prevents unnecessary instantiations if the get
-        # operation is to succeed, which is almost always the case.
-        stream = env.get('wsgi.input', None) or BytesIO()
+    def _do_parse_payload(self, request):
+        c_type, options = request.content_type
 
         # Check mimetype of payload against configuration.
         if c_type in self._acceptable_post_mimes:
-            return _FORM_CONTENT_HANDLERS[c_type](stream, c_len, options)
+            return _FORM_CONTENT_HANDLERS[c_type](
+                    request.body_stream,
+                    request.content_length,
+                    options,
+                    **self._handler_kwargs.get(c_type, {})
+                    )
 
         return None, None
 
-    def maybe_parse_payload_into(self, request):
+    def parse_payload(self, request):
+        '''Returns ``(form, files, )`` parsed from the body of ``request``,
+        or ``(None, None, )`` if there is nothing to parse.
+
+        Raises :exc:`RequestBodyError` if the body is over its size limit
+        or cannot be parsed.
+
+        '''
+
         # TODO: allow setting custom verbs?
         if request.method in {'POST', 'PUT', }:
-            request.form, request.files = self._do_parse_payload(request)
+            return self._do_parse_payload(request)
+
+        return None, None
+
+    def maybe_parse_payload_into(self, request):
+        request.form, request.files = self.parse_payload(request)
 
     def _init_sts(self, config):
         if not config.get('enabled', True):
@@ -23,32 +23,58 @@ __all__ = [
             'WeiyuWSGIAdapter',
             ]
 
+from io import BytesIO
+
 from .. import adapter_hub
 
 from ...helpers.misc import smartstr
-from ...reflex.classes import ReflexRequest
 
-from .base import BaseHTTPReflex
-from .util import parse_qs_compacted
-from .util import parse_conditional_headers_into
+from .base import BaseHTTPRequest, BaseHTTPReflex
 from .util import dummy_file_wrapper, send_content_iter
 from .util import build_host_str, gen_http_headers
 
 
-class WSGIRequest(ReflexRequest):
-    def __init__(self, env, start_response, site_conf):
-        super(WSGIRequest, self).__init__(env)
+class WSGIRequest(BaseHTTPRequest):
+    def __init__(self, env, start_response, site_conf, helper=None):
+        super(WSGIRequest, self).__init__(env, helper)
 
         self.start_response = start_response
         self.site = site_conf
 
+    def get_header(self, name, default=None):
+        key = name.upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH', ):
+            key = 'HTTP_' + key
+        return self.env.get(key, default)
+
+    @property
+    def query_string(self):
+        return self.env.get('QUERY_STRING', None)
+
+    @property
+    def content_length(self):
+        '''Length of the request body, or -1 if unknown.'''
+
+        try:
+            return int(self.env.get('CONTENT_LENGTH') or -1)
+        except ValueError:
+            return -1
+
+    @property
+    def input_stream(self):
+        '''File-like object the request body is read from.'''
+
+        # Using ``or`` here prevents unnecessary instantiations if the get
+        # operation is to succeed, which is almost always the case.
+        return self.env.get('wsgi.input', None) or BytesIO()
+
 
 class WSGIReflex(BaseHTTPReflex):
     def __init__(self):
         super(WSGIReflex, self).__init__()
 
     def _do_accept_request(self, env, start_response):
-        return WSGIRequest(env, start_response, self.SITE_CONF)
+        return WSGIRequest(env, start_response, self.SITE_CONF, self._helper)
 
     def _do_translate_request(self, request):
         # populate some useful fields using WSGI env
@@ -57,28 +83,25 @@ class WSGIReflex(BaseHTTPReflex):
         # TODO: improve encoding handling here
         path = request.path = smartstr(env['PATH_INFO'], 'utf-8', 'replace')
         host = request.host = build_host_str(env)
+        method = request.method = smartstr(env['REQUEST_METHOD'])
 
         # Move routing (much) earlier so we don't waste time in processing
         # requests impossible to fulfill.
-        # Note that we don't pass in "request" at this moment. The object
-        # can be replaced by potential hooks, and we certainly don't want
-        # a reference to be frozen in the request.
-        # Return value is of format (fn, args, kwargs, route_data, )
-        route_result = self._do_routing(path, host)
-        request.callback_info = route_result[:-1]
-        request.route_data = route_result[-1]
+        if not self._route_request(request, path, host):
+            # nowhere to route, or method not allowed; a 404 or 405 is
+            # already prepared
+            return request
+
+        if not self._check_body_size(request):
+            # body too large; a 413 is already prepared
+            return request
 
         # Rest of request object preparation goes here...
         request.remote_addr = smartstr(env['REMOTE_ADDR'])
         request.protocol = smartstr(env['wsgi.url_scheme'])
-        method = request.method = smartstr(env['REQUEST_METHOD'])
-
-        # parse query string if present
-        qs = env.get('QUERY_STRING', None)
-        request.query = parse_qs_compacted(qs) if qs is not None else {}
 
-        # parse request body if applicable
-        self._helper.maybe_parse_payload_into(request)
+        # Query string, request body, conditional headers and cookies are
+        # parsed on first access; see BaseHTTPRequest.
 
         # CORS support
         origin = env.get('HTTP_ORIGIN', None)
@@ -97,9 +120,6 @@ class WSGIReflex(BaseHTTPReflex):
         else:
             request.origin, request.cors_request = None, {}
 
-        # Conditional requests
-        parse_conditional_headers_into(request)
-
         # TODO: add more ubiquitous HTTP request headers
 
         # do session injection in baseclass
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / bench / package
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Router micro-benchmarks
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Generates synthetic URLfiles of configurable shape, and measures the cost
+of routing with them. Run ``python -m weiyu.bench --help`` for the
+command line interface, which prints the results as JSON.
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'URLfileShape',
+        'generate_urlfile',
+        'run_benchmark',
+        ]
+
+from .urlfile import URLfileShape, generate_urlfile
+from .runner import run_benchmark
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
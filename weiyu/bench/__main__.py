@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / bench / command line interface
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals, division
+
+import sys
+import json
+import argparse
+
+import yaml
+
+from .urlfile import URLFILE_KINDS, URLfileShape, generate_urlfile
+from .runner import run_benchmark
+
+parser = argparse.ArgumentParser(
+        description='Router micro-benchmarks for weiyu.',
+        )
+parser.add_argument('-n', '--routes', type=int, default=100)
+parser.add_argument('-d', '--depth', type=int, default=1)
+parser.add_argument('-f', '--fanout', type=int, default=4)
+parser.add_argument(
+        '-k',
+        '--kind',
+        choices=sorted(URLFILE_KINDS),
+        default='regex',
+        )
+parser.add_argument(
+        '-H',
+        '--hosts',
+        type=int,
+        default=0,
+        help='number of virtual host blocks',
+        )
+parser.add_argument(
+        '-o',
+        '--option',
+        action='append',
+        default=[],
+        metavar='KEY=VALUE',
+        help='router option to set, value is parsed as YAML',
+        )
+parser.add_argument('--number', type=int, default=10000)
+parser.add_argument('--repeat', type=int, default=5)
+parser.add_argument(
+        '--dump-urlfile',
+        action='store_true',
+        help='print the generated URLfile instead of benchmarking',
+        )
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    shape = URLfileShape(
+            routes=args.routes,
+            depth=args.depth,
+            fanout=args.fanout,
+            kind=args.kind,
+            hosts=args.hosts,
+            )
+
+    if args.dump_urlfile:
+        content, _ = generate_urlfile(shape)
+        sys.stdout.write(content)
+        return 0
+
+    options = {}
+    for opt in args.option:
+        if '=' not in opt:
+            parser.error('malformed router option \'%s\'' % (opt, ))
+
+        k, v = opt.split('=', 1)
+        options[k] = yaml.safe_load(v)
+
+    result = run_benchmark(shape, options, args.number, args.repeat)
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
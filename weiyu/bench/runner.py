@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / bench / router benchmark runner
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Router benchmark runner
+~~~~~~~~~~~~~~~~~~~~~~~
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'BENCH_ROUTER_TYPE',
+        'run_benchmark',
+        ]
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+
+from six.moves import range
+
+from .. import registry
+from ..__version__ import VERSION_STR
+from ..router import router_hub
+from ..router.base import DISPATCH_MISS
+from ..router.reverser import Reverser
+
+from .urlfile import generate_urlfile
+
+# the router type the generated routes are registered under
+BENCH_ROUTER_TYPE = 'bench'
+
+# a query string no generated route matches
+MISS_PATH = 'zz/no/such/route/'
+
+
+def _bench_endpoint(request, *args, **kwargs):
+    pass
+
+
+def _ns_per_call(fn, args, number, repeat):
+    # best of repeat runs, to be less sensitive to noise
+    timer = timeit.default_timer
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        for _ in range(number):
+            fn(*args)
+        elapsed = timer() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best / number * 1e9
+
+
+def _load_router(content, routes, options):
+    for route in routes:
+        router_hub.endpoint(BENCH_ROUTER_TYPE, route.endpoint)(
+                _bench_endpoint,
+                )
+
+    reg = registry.request('weiyu.router')
+    reg['options'][BENCH_ROUTER_TYPE] = dict(options or {})
+
+    tmpdir = tempfile.mkdtemp(prefix='weiyu-bench-')
+    try:
+        path = os.path.join(tmpdir, 'bench.URLfile')
+        with io.open(path, 'w', encoding='utf-8') as fp:
+            fp.write(content)
+
+        router = router_hub.init_router_from_config(BENCH_ROUTER_TYPE, path)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    router_hub.register_router(router)
+    return router
+
+
+def run_benchmark(shape, options=None, number=10000, repeat=5):
+    '''Generates a URLfile of the given
+    :class:`~weiyu.bench.urlfile.URLfileShape`, loads it through
+    :meth:`~weiyu.router.RouterHub.init_router_from_config` and measures the
+    cost of dispatching to the routes at the head, middle and tail of the
+    table, of a miss, and of reversing the middle route.
+
+    ``options`` are router options to apply, e.g. ``{'flatten': True}``.
+
+    Returns a JSON-serializable ``dict``, with timings in nanoseconds per
+    call. Every timing is the best of ``repeat`` runs of ``number`` calls.
+
+    '''
+
+    content, routes = generate_urlfile(shape)
+    router = _load_router(content, routes, options)
+
+    head, middle, tail = routes[0], routes[len(routes) // 2], routes[-1]
+    miss_host = head.host
+
+    # sanity check, so we are not timing something broken
+    for route in (head, middle, tail, ):
+        result = router.try_dispatch(route.path, route.host)
+        if result is DISPATCH_MISS or result[0] is not _bench_endpoint:
+            raise RuntimeError(
+                    'generated route \'%s\' not reachable' % (route.path, ),
+                    )
+
+    if router.try_dispatch(MISS_PATH, miss_host) is not DISPATCH_MISS:
+        raise RuntimeError('miss path unexpectedly dispatched')
+
+    dispatch = router.try_dispatch
+    results = {}
+    for name, route in (
+            ('hit_head', head, ),
+            ('hit_middle', middle, ),
+            ('hit_tail', tail, ),
+            ):
+        results[name] = _ns_per_call(
+                dispatch,
+                (route.path, route.host, ),
+                number,
+                repeat,
+                )
+
+    results['miss'] = _ns_per_call(
+            dispatch,
+            (MISS_PATH, miss_host, ),
+            number,
+            repeat,
+            )
+
+    # a fresh reverser, as reverser_for caches by router name
+    reverser = Reverser(getattr(router, 'tree', router))
+
+    def reverse():
+        return reverser.reverse(middle.endpoint, **middle.kwargs)
+
+    results['reverse'] = _ns_per_call(reverse, (), number, repeat)
+
+    return {
+            'weiyu_version': VERSION_STR,
+            'python_version': sys.version.split()[0],
+            'shape': shape.as_dict(),
+            'options': dict(options or {}),
+            'number': number,
+            'repeat': repeat,
+            'unit': 'ns',
+            'results': results,
+            }
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
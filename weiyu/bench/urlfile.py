@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / bench / synthetic URLfile generator
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Synthetic URLfile generator
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'URLFILE_KINDS',
+        'URLfileShape',
+        'BenchRoute',
+        'generate_urlfile',
+        ]
+
+import collections
+
+from six.moves import range
+
+# router class for the generated routers -> whether it has regex semantics
+URLFILE_KINDS = {
+        'regex': True,
+        'exact': False,
+        'compiled': True,
+        }
+
+INDENT = '    '
+
+
+class URLfileShape(object):
+    '''Parameters of a generated URLfile.
+
+    :param routes: number of endpoints;
+    :param depth: number of router levels every endpoint is nested in,
+      1 meaning a single flat router;
+    :param fanout: number of sub-routers at every level above the leaves;
+    :param kind: router class to use, one of :data:`URLFILE_KINDS`;
+    :param hosts: number of virtual host blocks to spread the routes
+      across, 0 for not using hosts at all.
+
+    '''
+
+    def __init__(self, routes=100, depth=1, fanout=4, kind='regex', hosts=0):
+        if routes <= 0:
+            raise ValueError('number of routes must be positive')
+
+        if depth <= 0:
+            raise ValueError('depth must be positive')
+
+        if fanout <= 0:
+            raise ValueError('fanout must be positive')
+
+        if kind not in URLFILE_KINDS:
+            raise ValueError('unknown router kind \'%s\'' % (kind, ))
+
+        if hosts < 0:
+            raise ValueError('number of hosts must not be negative')
+
+        self.routes, self.depth, self.fanout = routes, depth, fanout
+        self.kind, self.hosts = kind, hosts
+
+    def as_dict(self):
+        return {
+                'routes': self.routes,
+                'depth': self.depth,
+                'fanout': self.fanout,
+                'kind': self.kind,
+                'hosts': self.hosts,
+                }
+
+
+# one generated endpoint, with a query string and host reaching it, and the
+# keyword arguments for reversing
+BenchRoute = collections.namedtuple(
+        'BenchRoute',
+        ['endpoint', 'path', 'host', 'kwargs', ],
+        )
+
+
+def _chunks(items, count):
+    # split items into count contiguous, non-empty chunks
+    count = min(count, len(items))
+    size, extra = divmod(len(items), count)
+    result, start = [], 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        result.append(items[start:end])
+        start = end
+
+    return result
+
+
+class _Generator(object):
+    def __init__(self, shape):
+        self.shape = shape
+        self.is_regex = URLFILE_KINDS[shape.kind]
+        self.lines = []
+        self.routes = []
+
+    def emit(self, level, line):
+        self.lines.append(INDENT * level + line)
+
+    def section_pattern(self, name):
+        return '^%s/' % (name, ) if self.is_regex else '%s/' % (name, )
+
+    def gen_leaves(self, level, indices, prefix, host):
+        for idx in indices:
+            endpoint = 'bench-%d' % (idx, )
+            if self.is_regex:
+                self.emit(level, '^r%d/(?P<id>\\d+)/$ %s' % (idx, endpoint, ))
+                path, kwargs = 'r%d/42/' % (idx, ), {'id': '42', }
+            else:
+                self.emit(level, 'r%d/ %s' % (idx, endpoint, ))
+                path, kwargs = 'r%d/' % (idx, ), {}
+
+            self.routes.append(
+                    BenchRoute(endpoint, prefix + path, host, kwargs),
+                    )
+
+    def gen_level(self, level, indices, depth_left, prefix, host):
+        if depth_left <= 1:
+            self.gen_leaves(level, indices, prefix, host)
+            return
+
+        for i, chunk in enumerate(_chunks(indices, self.shape.fanout)):
+            name = 'n%d' % (i, )
+            self.emit(level, '%s:' % (self.section_pattern(name), ))
+            self.gen_level(
+                    level + 1,
+                    chunk,
+                    depth_left - 1,
+                    prefix + name + '/',
+                    host,
+                    )
+
+    def generate(self):
+        shape = self.shape
+        self.emit(0, '--%s' % (shape.kind, ))
+        self.emit(0, '--default-type=%s' % (shape.kind, ))
+        self.emit(0, '--renderer=json')
+        self.emit(0, '')
+
+        indices = list(range(shape.routes))
+        if not shape.hosts:
+            self.gen_level(0, indices, shape.depth, '', None)
+        else:
+            for i, chunk in enumerate(_chunks(indices, shape.hosts)):
+                host = 'h%d.example.com' % (i, )
+                self.emit(0, '"":')
+                self.emit(1, '--host=%s' % (host, ))
+                self.gen_level(1, chunk, shape.depth, '', host)
+
+        self.emit(0, '')
+        return '\n'.join(self.lines), self.routes
+
+
+def generate_urlfile(shape):
+    '''Generates a URLfile of the given :class:`URLfileShape`.
+
+    Returns ``(content, routes, )``, where ``routes`` is a list of
+    :class:`BenchRoute` in declaration order.
+
+    '''
+
+    return _Generator(shape).generate()
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / cli / routes command
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals, division, print_function
+
+import six
+
+from ...router import router_hub
+from ...router.analysis import analyze_routes
+
+from .. import discover
+
+HEADINGS = ('COST', 'PATTERN', 'ENDPOINT', 'HOST', 'RENDERER', 'NOTES', )
+
+
+def _endpoint_name(scope, endpoint):
+    endpoint = six.text_type(endpoint)
+    return '%s:%s' % (scope, endpoint, ) if scope else endpoint
+
+
+def _format_row(info):
+    notes = []
+    if not info.reachable:
+        notes.append('unreachable')
+    if info.shadowed_by is not None:
+        notes.append('shadowed by %s' % (
+            _endpoint_name(*info.shadowed_by),
+            ))
+
+    return (
+            '-' if info.cost is None else six.text_type(info.cost),
+            info.pattern or '""',
+            _endpoint_name(info.scope, info.endpoint),
+            info.host or '*',
+            six.text_type(info.renderer or '-'),
+            ', '.join(notes),
+            )
+
+
+def rain_routes(args):
+    discover.init_or_die(args)
+
+    routes = analyze_routes(router_hub.get_router(args.router_type))
+    if args.sort == 'cost':
+        routes.sort(key=lambda x: (x.cost is None, x.cost, ))
+
+    rows = [HEADINGS]
+    rows.extend(_format_row(info) for info in routes)
+    widths = [max(len(row[col]) for row in rows) for col in range(5)]
+
+    for row in rows:
+        cells = [cell.ljust(width) for cell, width in zip(row, widths)]
+        cells.append(row[5])
+        print('  '.join(cells).rstrip())
+
+    # summary
+    costs = [info.cost for info in routes if info.cost is not None]
+    shadowed = sum(1 for info in routes if info.shadowed_by is not None)
+    unreachable = len(routes) - len(costs)
+    print()
+    print('%d routes, %d shadowed, %d unreachable' % (
+        len(routes),
+        shadowed,
+        unreachable,
+        ))
+    if costs:
+        print('matchers per route: mean %.1f, max %d' % (
+            sum(costs) / len(costs),
+            max(costs),
+            ))
+
+    return 0
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
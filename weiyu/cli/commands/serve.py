@@ -25,10 +25,21 @@ from ...utils import server
 from .. import discover
 
 
+# flavors serving their own adapters instead of WSGI applications
+NATIVE_ADAPTERS = {
+        'tornado': 'tornado',
+        'asyncio': 'asyncio',
+        }
+
+
 def rain_serve(args):
     discover.init_or_die(args)
 
-    application = adapter_hub.make_app(args.adapter_type)
+    adapter_type = args.adapter_type
+    if adapter_type is None:
+        adapter_type = NATIVE_ADAPTERS.get(args.server_flavor, 'wsgi')
+
+    application = adapter_hub.make_app(adapter_type)
     server.cli_server(
             args.server_flavor,
             managed=True,
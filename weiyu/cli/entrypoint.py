@@ -25,6 +25,7 @@ import argparse
 
 from .commands import shell
 from .commands import serve
+from .commands import routes
 
 # Argument parser setup
 parser = argparse.ArgumentParser(
@@ -65,8 +66,9 @@ parser_serve.add_argument(
 parser_serve.add_argument(
         '-t',
         '--adapter-type',
-        help='type of adapter to use',
-        default='wsgi',
+        help='type of adapter to use (default: the one native to the '
+        'server flavor, or wsgi)',
+        default=None,
         )
 parser_serve.add_argument(
         '-p',
@@ -77,6 +79,26 @@ parser_serve.add_argument(
         )
 parser_serve.set_defaults(func=serve.rain_serve)
 
+# rain routes
+parser_routes = subparsers.add_parser(
+        'routes',
+        help='Show the route table with dispatch costs',
+        )
+parser_routes.add_argument(
+        '-t',
+        '--router-type',
+        help='type of router to show',
+        default='http',
+        )
+parser_routes.add_argument(
+        '-s',
+        '--sort',
+        help='order of routes',
+        choices=('declared', 'cost', ),
+        default='declared',
+        )
+parser_routes.set_defaults(func=routes.rain_routes)
+
 
 def main():
     # Fix up sys.path to include the current directory, similar to what a
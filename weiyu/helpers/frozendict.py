@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / helpers / immutable dict
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Immutable dict
+~~~~~~~~~~~~~~
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'FrozenDict',
+        ]
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError('%s is immutable' % (self.__class__.__name__, ))
+
+
+class FrozenDict(dict):
+    '''A ``dict`` that refuses modification after construction, so a single
+    instance can be safely shared by many owners.
+
+    Being a real ``dict`` subclass, it can be passed anywhere a ``dict`` is
+    expected for reading. :meth:`copy` returns an ordinary, mutable
+    ``dict``.
+
+    '''
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def copy(self):
+        return dict(self)
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self), ), )
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, dict.__repr__(self), )
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
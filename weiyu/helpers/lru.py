@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / helpers / bounded LRU cache
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Bounded LRU cache
+~~~~~~~~~~~~~~~~~
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'LRUCache',
+        ]
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    '''A size-bounded mapping that evicts the least recently used item when
+    full. Hits, misses and evictions are counted.
+
+    If ``ttl`` is given, items also expire that many seconds after being
+    put, and are treated as absent afterwards.
+
+    All operations are serialized by a lock, so an instance can be shared
+    between threads.
+
+    '''
+
+    def __init__(self, maxsize, ttl=None, timer=time.time):
+        if maxsize <= 0:
+            raise ValueError('cache size must be positive')
+
+        if ttl is not None and ttl <= 0:
+            raise ValueError('cache TTL must be positive')
+
+        self.maxsize, self.ttl = maxsize, ttl
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.expirations = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._timer = timer
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        '''Returns the value cached for ``key``, marking it as recently used,
+        or ``default`` if the key is absent.
+
+        '''
+
+        with self._lock:
+            try:
+                # OrderedDict.move_to_end is not available on Python 2.x
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if self.ttl is not None:
+                value, expires_at = value
+                if self._timer() >= expires_at:
+                    # stale, leave it dropped
+                    self.expirations += 1
+                    self.misses += 1
+                    return default
+
+                self._data[key] = (value, expires_at, )
+            else:
+                self._data[key] = value
+
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        '''Caches ``value`` for ``key``, evicting the least recently used
+        item if the cache is full.
+
+        '''
+
+        if self.ttl is not None:
+            value = (value, self._timer() + self.ttl, )
+
+        data = self._data
+        with self._lock:
+            if key in data:
+                del data[key]
+            elif len(data) >= self.maxsize:
+                data.popitem(last=False)
+                self.evictions += 1
+
+            data[key] = value
+
+    def clear(self):
+        '''Drops all cached items. The counters are kept.'''
+
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        '''Returns a ``dict`` describing the cache usage.'''
+
+        return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                }
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
@@ -7,6 +7,7 @@ from __future__ import unicode_literals, division
 __all__ = [
         'classproperty',
         'classinstancemethod',
+        'cachedproperty',
         ]
 
 
@@ -22,6 +23,28 @@ class classproperty(object):
         return self.getter(owner)
 
 
+class cachedproperty(object):
+    '''Read-only property computed on first access only.
+
+    The value is stored in the ``__dict__`` of the instance under the same
+    name, where it shadows the descriptor from then on; so it can also be
+    set or overridden like any plain attribute.
+
+    '''
+
+    def __init__(self, getter):
+        self.getter = getter
+        self.name = getter.__name__
+        self.__doc__ = getter.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        value = instance.__dict__[self.name] = self.getter(instance)
+        return value
+
+
 # The following code is part of the formencode library, which is licensed under
 # the PSF license.
 # START OF formencode CODE
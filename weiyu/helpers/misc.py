@@ -22,10 +22,18 @@ from __future__ import unicode_literals, division
 __all__ = [
         'smartstr',
         'smartbytes',
+        'isawaitable',
         ]
 
 import six
 
+try:
+    from inspect import isawaitable
+except ImportError:
+    # Python < 3.5, nothing can be awaited
+    def isawaitable(obj):
+        return False
+
 
 def smartstr(s, encoding='utf-8', *args, **kwargs):
     if not isinstance(s, six.text_type):
@@ -39,6 +39,7 @@ should be good enough for a large class of URLS, however.
 
 from __future__ import unicode_literals
 
+import six
 from six.moves import zip
 from six.moves import xrange as range
 
@@ -352,7 +353,7 @@ def flatten_result(source):
     result_args = [[]]
     pos = last = 0
     for pos, elt in enumerate(source):
-        if isinstance(elt, (basestring, )):
+        if isinstance(elt, six.string_types):
             continue
         piece = ''.join(source[last:pos])
         if isinstance(elt, Group):
@@ -36,6 +36,7 @@ from .. import registry
 from ..adapters import adapter_hub
 from ..db import db_hub
 from ..router import router_hub
+from ..router.reloader import RouterReloader
 from ..registry.loader import BaseConfig
 from .viewloader import ViewLoader
 
@@ -46,6 +47,7 @@ del base
 CONFIG_LOADED = False
 VIEW_LOADED = False
 ROUTER_LOADED = False
+ROUTER_RELOADER = None
 IN_BOOTING = False
 BOOTED = False
 
@@ -59,12 +61,23 @@ def _ensure_site_registry():
 
 
 def _do_load_router(typ, filename):
-    global ROUTER_LOADED
+    global ROUTER_LOADED, ROUTER_RELOADER
     if ROUTER_LOADED:
         return
 
-    router = router_hub.init_router_from_config(typ, filename)
-    ret = router_hub.register_router(router)
+    autoreload = router_hub.router_options(typ).get('autoreload', False)
+    if autoreload:
+        # true means the default polling interval
+        interval = 1.0 if autoreload is True else autoreload
+        reloader = RouterReloader(typ, filename, interval)
+        reloader.load()
+        # not started right away, as pre-forking servers load the
+        # application in a master process
+        router_hub.on_first_dispatch(reloader.start)
+        ROUTER_RELOADER, ret = reloader, None
+    else:
+        router = router_hub.init_router_from_config(typ, filename)
+        ret = router_hub.register_router(router)
 
     ROUTER_LOADED = True
     return ret
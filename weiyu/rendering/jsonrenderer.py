@@ -21,9 +21,16 @@
 JSON renderer
 -------------
 
+Renders the result ``dict`` of a view as a JSON object.
+
+Values of the result that are iterators, e.g. generators, are rendered as
+JSON arrays, but without collecting them first: the output is then an
+iterable of chunks of about :data:`STREAM_CHUNK_SIZE` characters, sent out
+while the iterators are being consumed. The other members come first.
+
 .. todo::
 
-    This part of documentation is yet to be written.
+    The rest of documentation is yet to be written.
 
 '''
 
@@ -43,6 +50,13 @@ except ImportError:
     from functools import partial
     dumps = partial(dumps, separators=(',', ':', ))
 
+try:
+    from collections.abc import Iterator
+except ImportError:
+    from collections import Iterator
+
+import six
+
 from . import render_hub
 from .base import Renderable
 
@@ -52,11 +66,55 @@ JSON_COMMON_EXTRAS = {
         'mimetype': 'application/json',
         }
 
+# approximate size of chunks of streamed output, in characters
+STREAM_CHUNK_SIZE = 8192
+
+
+def _stream_json(result, lazy_keys):
+    static = dict(
+            (k, v)
+            for k, v in six.iteritems(result)
+            if k not in lazy_keys
+            )
+
+    # the opening brace and static members
+    parts = [dumps(static)[:-1]]
+    size, sep = len(parts[0]), ',' if static else ''
+
+    for key in lazy_keys:
+        parts.append('%s%s:[' % (sep, dumps(key), ))
+        sep, item_sep = ',', ''
+        for item in result[key]:
+            encoded = dumps(item)
+            parts.append(item_sep)
+            parts.append(encoded)
+            item_sep = ','
+
+            size += len(encoded) + 1
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(parts)
+                parts, size = [], 0
+
+        parts.append(']')
+
+    parts.append('}')
+    yield ''.join(parts)
+
 
 class JSONRenderable(Renderable):
     def _do_render(self, result, context):
         # only expose the desired result object
-        return dumps(dict(result)), JSON_COMMON_EXTRAS
+        result = dict(result)
+
+        lazy_keys = [
+                k
+                for k, v in six.iteritems(result)
+                if isinstance(v, Iterator)
+                ]
+        if lazy_keys:
+            return _stream_json(result, lazy_keys), JSON_COMMON_EXTRAS
+
+        return dumps(result), JSON_COMMON_EXTRAS
 
 
 @render_hub.register_handler('json')
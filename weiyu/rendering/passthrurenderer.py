@@ -22,7 +22,8 @@ Pass-through renderer
 ---------------------
 
 This renderer just passes the input bytestring through. Useful if the view
-takes care of the rendering details itself.
+takes care of the rendering details itself. Any other iterable is passed
+through as is too, and streamed chunk by chunk.
 
 '''
 
@@ -30,6 +31,8 @@ from __future__ import unicode_literals, division
 
 __all__ = ['PassthruRenderable', ]
 
+import six
+
 from ..helpers.misc import smartbytes
 from . import render_hub
 from .base import Renderable
@@ -37,7 +40,10 @@ from .base import Renderable
 
 class PassthruRenderable(Renderable):
     def _do_render(self, result, context):
-        return smartbytes(result), {}
+        if isinstance(result, six.string_types):
+            return smartbytes(result), {}
+
+        return result, {}
 
 
 @render_hub.register_handler('passthru')
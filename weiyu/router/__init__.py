@@ -24,23 +24,36 @@ __all__ = [
         ]
 
 import os
+import sys
 import errno
 import re
+import threading
 
 import six
 
+from ..helpers.annotation import is_annotated, get_annotation
 from ..helpers.hub import BaseHub
+from ..helpers.lru import LRUCache
 from ..helpers.modprober import ModProber
 
 # this does not cause circular import
 from .config.parser import parse_config
 
-from .reverser import reverser_for_router
+from .reverser import reverser_for_router, drop_reverser
 
 PROBER = ModProber('weiyu.router', '%srouter')
 VAR_INTERPOLATOR = re.compile(r'\$\{([^}]+)\}')
 
 
+def _methods_set(methods):
+    # 'GET,POST' or ['GET', 'POST'] -> frozenset(['GET', 'POST'])
+    if isinstance(methods, six.string_types):
+        methods = methods.split(',')
+
+    methods = (six.text_type(method).strip().upper() for method in methods)
+    return frozenset(method for method in methods if method)
+
+
 class RouterHub(BaseHub):
     registry_name = 'weiyu.router'
     handlers_key = 'handlers'
@@ -60,10 +73,48 @@ class RouterHub(BaseHub):
         if 'variables' not in self._reg:
             self._reg['variables'] = {}
 
+        if 'options' not in self._reg:
+            self._reg['options'] = {}
+
+        if 'converters' not in self._reg:
+            self._reg['converters'] = {}
+
         # cache the references
         self._routers = self._reg['routers']
         self._endpoints = self._reg['endpoints']
         self._classes = self._reg['classes']
+        self._converters = self._reg['converters']
+
+        # run before the first dispatch in each process, see
+        # on_first_dispatch
+        self._first_dispatch_hooks = []
+        self._hooks_pid = None
+        self._hooks_lock = threading.Lock()
+
+    def on_first_dispatch(self, fn):
+        '''Registers ``fn`` to be called without arguments right before the
+        first dispatch in every process, including the ones forked later.
+
+        This is where to start things that don't survive ``fork()``, such
+        as threads: pre-forking servers load the application in the master
+        process, which never dispatches anything itself.
+
+        '''
+
+        with self._hooks_lock:
+            self._first_dispatch_hooks.append(fn)
+            self._hooks_pid = None
+
+    def _run_first_dispatch_hooks(self):
+        with self._hooks_lock:
+            pid = os.getpid()
+            if self._hooks_pid == pid:
+                return
+
+            for fn in self._first_dispatch_hooks:
+                fn()
+
+            self._hooks_pid = pid
 
     def endpoint(self, typ, name):
         '''decorator for registering routing end points.'''
@@ -95,6 +146,79 @@ class RouterHub(BaseHub):
             return cls
         return _decorator_
 
+    def register_converter(self, name):
+        '''Decorator to make a path converter class available as ``name``
+        in ``<arg:name>`` placeholders of regex patterns. See
+        :mod:`weiyu.router.converters`.
+
+        '''
+
+        def _decorator_(cls):
+            if name in self._converters:
+                raise ValueError(
+                        'duplicate converter register name: \'%s\'' % (
+                            name,
+                            ),
+                        )
+
+            converter = cls()
+            if re.compile(converter.regex).groups:
+                raise ValueError(
+                        'converter regex must not contain capturing groups'
+                        )
+
+            self._converters[name] = converter
+            return cls
+        return _decorator_
+
+    def get_converter(self, name):
+        try:
+            return self._converters[name]
+        except KeyError:
+            raise ValueError('unknown path converter \'%s\'' % (name, ))
+
+    def router_options(self, typ):
+        '''Returns the options configured for routers of type ``typ``.
+
+        Options live in the ``'options'`` key of the ``weiyu.router``
+        registry, one ``dict`` per router type::
+
+            weiyu.router:
+              options:
+                http:
+                  # memoize dispatch results of up to 4096 (path, host)
+                  # combinations
+                  dispatch_cache: 4096
+                  # remember up to 8192 misses, for 60 seconds each
+                  negative_cache: 8192
+                  negative_cache_ttl: 60
+                  # flatten the nested routers into a single table
+                  flatten: true
+                  # write the source generated by --compiled routers to
+                  # this file (or stderr if true), for debugging
+                  dump_compiled_source: /tmp/compiled-http.py
+                  # keep parsed URLfiles in this directory, so unchanged
+                  # ones need not be parsed again at the next start
+                  config_cache: /var/cache/myapp/urlfiles
+                  # watch the URLfiles, and swap in a new router when any
+                  # of them changes; true polls every second, a number
+                  # sets the interval in seconds
+                  autoreload: true
+                  # memoize up to 1024 URLs reversed with arguments; URLs
+                  # without arguments are always remembered
+                  reverse_cache: 1024
+                  # count the hits of the routes in one of every 16
+                  # lookups, and move the hot ones to the front every
+                  # 100000 lookups, where it provably makes no difference
+                  # to the results; has no effect on flattened routers
+                  adaptive_order: 100000
+                  adaptive_order_sample: 16
+
+        '''
+
+        # Like variables, the options are only available after config load.
+        return self._reg['options'].get(typ, {})
+
     def register_router(self, router):
         # keep a reference to the router
         typ = router.name
@@ -103,8 +227,35 @@ class RouterHub(BaseHub):
                     'only named routers can be registered this way'
                     )
 
+        options = self.router_options(typ)
+        cache_size = options.get('dispatch_cache', 0)
+        if cache_size:
+            router.dispatch_cache = LRUCache(cache_size)
+
+        negative_cache_size = options.get('negative_cache', 0)
+        if negative_cache_size:
+            router.negative_cache = LRUCache(
+                    negative_cache_size,
+                    options.get('negative_cache_ttl', 60),
+                    )
+
+        # The new router is complete at this point, so swap it in. This is
+        # a single assignment; requests already holding the old router
+        # simply finish with it.
+        old_router = self._routers.get(typ, None)
         self._routers[typ] = router
 
+        # cached results of a replaced router must not be served any more
+        if old_router is not None:
+            for cache in (
+                    old_router.dispatch_cache,
+                    old_router.negative_cache,
+                    ):
+                if cache is not None:
+                    cache.clear()
+
+            drop_reverser(typ)
+
         # also reserve a slot in endpoints dict, if one is not already
         # set up
         if typ not in self._endpoints:
@@ -117,13 +268,69 @@ class RouterHub(BaseHub):
         def _routing_shim_(hub, *args, **kwargs):
             return router.dry_dispatch(*args, **kwargs)
 
+    def get_router(self, typ):
+        '''Returns the router currently registered for ``typ``.'''
+
+        return self._routers[typ]
+
     def dry_dispatch(self, typ, querystr, *args):
         # typically used with args=(request, ) inside the framework
         # TODO: is it really useful to allow passing kwargs also?
+        if self._first_dispatch_hooks and self._hooks_pid != os.getpid():
+            self._run_first_dispatch_hooks()
+
         return self.do_handling(typ, querystr, *args)
 
+    def try_dispatch(self, typ, querystr, *args):
+        '''Like :meth:`dry_dispatch`, but returns
+        :data:`~weiyu.router.base.DISPATCH_MISS` instead of raising if
+        there is nowhere to dispatch.
+
+        The router is looked up on every call, so this always reflects the
+        currently registered router.
+
+        '''
+
+        if self._first_dispatch_hooks and self._hooks_pid != os.getpid():
+            self._run_first_dispatch_hooks()
+
+        return self._routers[typ].try_dispatch(querystr, *args)
+
+    def dispatch_cache_stats(self, typ):
+        '''Returns usage statistics of the dispatch cache of the router
+        registered for ``typ``, or ``None`` if the cache is not enabled.
+
+        '''
+
+        cache = self._routers[typ].dispatch_cache
+        return cache.stats() if cache is not None else None
+
+    def negative_cache_stats(self, typ):
+        '''Returns usage statistics of the negative cache of the router
+        registered for ``typ``, or ``None`` if the cache is not enabled.
+
+        '''
+
+        cache = self._routers[typ].negative_cache
+        return cache.stats() if cache is not None else None
+
+    def memory_report(self, typ):
+        '''Returns an approximation of the memory taken by the route tables
+        of the router registered for ``typ``. See
+        :meth:`~weiyu.router.base.RouterBase.memory_report` for the format.
+
+        '''
+
+        router = self._routers[typ]
+
+        # look through boot-time wrappers like FlatRouter
+        return getattr(router, 'tree', router).memory_report()
+
     def reverser_for(self, router_name):
-        return reverser_for_router(self._routers[router_name])
+        return reverser_for_router(
+                self._routers[router_name],
+                self.router_options(router_name).get('reverse_cache', None),
+                )
 
     def _probe_router_class(self, cls_name):
         try:
@@ -178,6 +385,8 @@ class RouterHub(BaseHub):
                 parent_info['scope'],
                 parent_info['host'],
                 )
+        parse_fn = parent_info.get('parse_fn', None)
+        inherited_methods = parent_info.get('inherited_methods', None)
         include_path, cls_name = None, None
 
         if not isinstance(attrib_list, _list_types):
@@ -213,6 +422,9 @@ class RouterHub(BaseHub):
             elif k == 'scope':
                 # case: scope=xxx
                 scope = v
+            elif k == 'methods':
+                # case: methods=GET,POST
+                inherited_methods = _methods_set(v)
             elif k == 'default-type':
                 # case: default-type=xxx
                 inherited_klass = v
@@ -264,13 +476,23 @@ class RouterHub(BaseHub):
 
                 # Try the suffixed version first...
                 try:
-                    return self.init_router_from_config(typ, suffixed_path)
+                    return self._do_init_router_from_config(
+                            typ,
+                            suffixed_path,
+                            parse_fn,
+                            inherited_methods,
+                            )
                 except IOError as e:
                     # Only ignore ENOENT here.
                     if e.errno != errno.ENOENT:
                         raise
 
-            return self.init_router_from_config(typ, include_path_resolved)
+            return self._do_init_router_from_config(
+                    typ,
+                    include_path_resolved,
+                    parse_fn,
+                    inherited_methods,
+                    )
 
         # Load the requested (built-in) router class.
         #
@@ -287,6 +509,16 @@ class RouterHub(BaseHub):
         # Process rules.
         result_rules = []
         for pattern, target_spec, extra_data in routing_rules[1:]:
+            # The rule tree may be shared, e.g. by the parse cache, so the
+            # extra data is only changed in a copy.
+            if extra_data is not None:
+                extra_data = dict(extra_data)
+
+            # per-rule method constraint, as in {"methods": ["GET"]}
+            methods = inherited_methods
+            if extra_data is not None and 'methods' in extra_data:
+                methods = _methods_set(extra_data.pop('methods'))
+
             if isinstance(target_spec, _list_types):
                 # this is a router... recursively construct a router out
                 # of it
@@ -294,8 +526,10 @@ class RouterHub(BaseHub):
                         '__file__': this_file,
                         'inherited_klass': inherited_klass,
                         'inherited_renderer': inherited_renderer,
+                        'inherited_methods': methods,
                         'scope': scope,
                         'host': host,
+                        'parse_fn': parse_fn,
                         }
                 tgt = self._do_init_router(typ, target_spec, lvl + 1, my_info)
             elif isinstance(target_spec, six.string_types):
@@ -317,8 +551,27 @@ class RouterHub(BaseHub):
             else:
                 extra_data = {}
 
-            # remember the target spec for the URL reverser
-            extra_data['target_spec'] = target_spec
+            # remember the target spec for the URL reverser, which only
+            # cares about endpoints; keeping the rules of sub-routers would
+            # just waste memory
+            if not isinstance(target_spec, _list_types):
+                extra_data['target_spec'] = target_spec
+                # (scope, target_spec) identifies the endpoint, e.g. for
+                # accounting requests to it
+                extra_data['scope'] = scope
+
+                # methods the endpoint accepts, so the adapter can reject
+                # the others before doing any work; fall back to the ones
+                # declared with @only_methods
+                if (methods is None
+                        and hasattr(tgt, '__dict__')
+                        and is_annotated(tgt)):
+                    annotated = get_annotation(tgt).get('allowed_methods')
+                    if annotated is not None:
+                        methods = _methods_set(annotated)
+
+                if methods is not None:
+                    extra_data['allowed_methods'] = methods
 
             # add a rule
             result_rules.append((pattern, tgt, extra_data, ))
@@ -332,8 +585,107 @@ class RouterHub(BaseHub):
                 host=host,
                 )
 
-    def init_router(self, typ, routing_rules, filename=None):
+    def parse_router_config(self, typ, filename):
+        '''Parses the URLfile ``filename`` for a router of type ``typ``,
+        honoring the ``config_cache`` option.
+
+        '''
+
+        return parse_config(
+                filename,
+                cache_dir=self.router_options(typ).get('config_cache', None),
+                )
+
+    def _do_init_router_from_config(
+            self,
+            typ,
+            filename,
+            parse_fn=None,
+            inherited_methods=None,
+            ):
+        # parse_fn(filename) is called instead of parse_router_config for
+        # this file and every file included, if given; inherited_methods
+        # are the methods of the rule including the file, if any
+        if parse_fn is not None:
+            config = parse_fn(filename)
+        else:
+            config = self.parse_router_config(typ, filename)
+
         return self._do_init_router(
+                typ,
+                config,
+                0,
+                {
+                    '__file__': filename,
+                    'inherited_klass': None,
+                    'inherited_renderer': None,
+                    'inherited_methods': inherited_methods,
+                    'scope': '',
+                    'host': None,
+                    'parse_fn': parse_fn,
+                    },
+                )
+
+    def _dump_compiled_source(self, router, dest):
+        sources = []
+        pending = [router]
+        while pending:
+            rtr = pending.pop(0)
+            source = getattr(rtr, 'source', None)
+            if source is not None:
+                sources.append('# scope %r, host %r\n%s' % (
+                    rtr.scope,
+                    rtr.host,
+                    source,
+                    ))
+
+            pending.extend(
+                    entry.target
+                    for entry in rtr.route_table
+                    if entry.target_is_router
+                    )
+
+        text = '\n\n'.join(sources)
+        if dest is True:
+            sys.stderr.write(text)
+        else:
+            with open(dest, 'w') as fp:
+                fp.write(text)
+
+    def _finalize_router(self, typ, router):
+        # Boot-time transformations of the whole router tree.
+        options = self.router_options(typ)
+        dump_dest = options.get('dump_compiled_source', None)
+        if dump_dest:
+            self._dump_compiled_source(router, dump_dest)
+
+        if options.get('flatten', False):
+            from .flat import FlatRouter
+            router = FlatRouter(router)
+        elif options.get('adaptive_order', 0):
+            # the flattened table is never reordered, so this is only done
+            # for plain trees
+            self._enable_adaptive_order(
+                    router,
+                    options['adaptive_order'],
+                    options.get('adaptive_order_sample', 16),
+                    )
+
+        return router
+
+    def _enable_adaptive_order(self, router, interval, sample):
+        pending = [router]
+        while pending:
+            rtr = pending.pop()
+            rtr.enable_adaptive_order(interval, sample)
+            pending.extend(
+                    entry.target
+                    for entry in rtr.route_table
+                    if entry.target_is_router
+                    )
+
+    def init_router(self, typ, routing_rules, filename=None):
+        router = self._do_init_router(
                 typ,
                 routing_rules,
                 0,
@@ -345,10 +697,20 @@ class RouterHub(BaseHub):
                     'host': None,
                     },
                 )
+        return self._finalize_router(typ, router)
+
+    def init_router_from_config(self, typ, filename, parse_fn=None):
+        '''Constructs a router of type ``typ`` out of the URLfile
+        ``filename``.
+
+        If given, ``parse_fn(path)`` is used to get the rule tree of the
+        URLfile and every file it includes, instead of
+        :meth:`parse_router_config`.
+
+        '''
 
-    def init_router_from_config(self, typ, filename):
-        config = parse_config(filename)
-        return self.init_router(typ, config, filename)
+        router = self._do_init_router_from_config(typ, filename, parse_fn)
+        return self._finalize_router(typ, router)
 
 
 router_hub = RouterHub()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / router / route table analysis
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Route table analysis
+~~~~~~~~~~~~~~~~~~~~
+
+:func:`analyze_routes` lists every endpoint of a router tree in declared
+order, together with the number of matchers a request has to go through
+before reaching it, as computed by
+:meth:`~weiyu.router.base.RouterBase.dispatch_cost` of every router along
+the way.
+
+Shadowed routes are found by probing: a path reaching the endpoint is
+built from its reverse pattern, and dispatched through the whole tree. If
+it ends up at another endpoint, the route is reported as shadowed by that
+one. This is exact for routes without arguments; for the others, a sample
+argument value is used, so only routes shadowed for that value are found.
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'RouteInfo',
+        'analyze_routes',
+        ]
+
+import re
+import collections
+
+from .base import STATUS_NOROUTE, STATUS_REACHED
+
+RouteInfo = collections.namedtuple(
+        'RouteInfo',
+        [
+            'pattern',
+            'endpoint',
+            'scope',
+            'host',
+            'renderer',
+            'cost',
+            'reachable',
+            'shadowed_by',
+            ],
+        )
+
+# argument values tried when building probe paths, in order
+PROBE_VALUES = (
+        '1',
+        'x',
+        '00000000-0000-0000-0000-000000000000',
+        'x-1',
+        'X',
+        )
+
+_TEMPLATE_RE = re.compile(r'%\(([^)]*)\)s|%%')
+
+
+def _display_pattern(pat_str):
+    # 'user/%(id)s/' -> 'user/<id>/'
+    def _replace(match):
+        name = match.group(1)
+        return '%' if name is None else '<%s>' % (name, )
+
+    return _TEMPLATE_RE.sub(_replace, pat_str)
+
+
+def _raw_pattern(chain):
+    result = []
+    for router, entry in chain:
+        pattern = getattr(entry, 'pattern', '')
+        result.append(getattr(pattern, 'pattern', pattern))
+
+    return ' '.join(result)
+
+
+def _accepts(chain, querystr, host):
+    # whether the chain of targets, looked at in isolation, takes querystr
+    # all the way to its leaf
+    args, kwargs, status = [], {}, STATUS_NOROUTE
+    for router, entry in chain:
+        if router.host is not None and router.host != host:
+            return False
+
+        status, args, kwargs, new_qs = entry.check(querystr, args, kwargs)
+        if status == STATUS_NOROUTE:
+            return False
+
+        if entry.target_is_router:
+            querystr = new_qs
+
+    return status == STATUS_REACHED
+
+
+def _probe(root, chain, entry, host):
+    # returns (probe path, endpoint data the path reaches, ), or
+    # (None, None, ) if no path could be built
+    try:
+        pat_str, pat_vars = entry.reverse_pattern
+    except Exception:
+        # the pattern can't be reversed
+        return None, None
+
+    for value in PROBE_VALUES:
+        try:
+            querystr = pat_str % dict((name, value) for name in pat_vars)
+        except (KeyError, TypeError, ValueError):
+            return None, None
+
+        if _accepts(chain, querystr, host):
+            break
+    else:
+        return None, None
+
+    result = root.lookup(querystr, host)
+    return querystr, (result[4] if result[0] else None)
+
+
+def _endpoint_of(data):
+    return (data.get('scope', ''), data.get('target_spec', None), )
+
+
+def _walk(router, chain, hosts, result):
+    if router.host is not None:
+        hosts = hosts | set([router.host])
+
+    for entry in router.route_table:
+        new_chain = chain + ((router, entry, ), )
+        if entry.target_is_router:
+            _walk(entry.target, new_chain, hosts, result)
+        else:
+            result.append((new_chain, hosts, ))
+
+
+def _describe(root, chain, hosts):
+    router, entry = chain[-1]
+    data = entry.data or {}
+    scope = data.get('scope', router.scope)
+    endpoint = data.get('target_spec')
+
+    # a route nested in blocks of different hosts can never be reached
+    reachable = len(hosts) <= 1
+    host = next(iter(hosts)) if hosts else None
+
+    cost = 0
+    if reachable:
+        for level_router, level_entry in chain:
+            level_cost = level_router.dispatch_cost(level_entry, host)
+            if level_cost is None:
+                reachable = False
+                break
+
+            cost += level_cost
+
+    try:
+        pattern = _display_pattern(entry.reverse_pattern[0])
+    except Exception:
+        pattern = _raw_pattern(chain)
+
+    shadowed_by = None
+    if reachable:
+        querystr, reached = _probe(root, chain, entry, host)
+        if (querystr is not None
+                and reached is not None
+                and reached is not data
+                and _endpoint_of(reached) != (scope, endpoint, )):
+            shadowed_by = _endpoint_of(reached)
+
+    return RouteInfo(
+            pattern,
+            endpoint,
+            scope,
+            host,
+            data.get('render_in'),
+            cost if reachable else None,
+            reachable,
+            shadowed_by,
+            )
+
+
+def analyze_routes(router):
+    '''Analyzes the tree of routers rooted at ``router``.
+
+    Returns a list of :class:`RouteInfo`\\ s, one for each endpoint, in
+    declared order. ``cost`` is the number of matchers checked before
+    reaching the endpoint, assuming earlier sub-routers reject the request
+    at their own patterns, or ``None`` if the endpoint can't be reached at
+    all; ``shadowed_by`` is the ``(scope, endpoint, )`` the probe path of a
+    shadowed route is dispatched to instead, ``None`` otherwise.
+
+    '''
+
+    # look through boot-time wrappers like FlatRouter
+    root = getattr(router, 'tree', router)
+
+    leaves = []
+    _walk(root, (), set(), leaves)
+    return [_describe(root, chain, hosts) for chain, hosts in leaves]
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
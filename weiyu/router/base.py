@@ -25,28 +25,175 @@ __all__ = [
             'STATUS_REACHED',
             'STATUS_FORWARD',
             'STATUS_NOROUTE',
+            'LOOKUP_MISS',
+            'DISPATCH_MISS',
+            'DispatchError',
+            'position_cost',
             ]
 
+import sys
+import bisect
+import heapq
+import weakref
+import threading
 from collections import OrderedDict
 
 import six
 
+from ..helpers.frozendict import FrozenDict
 from ..helpers.misc import smartstr
 
 STATUS_REACHED, STATUS_FORWARD, STATUS_NOROUTE = range(3)
 
+# the lookup result representing a miss
+LOOKUP_MISS = (False, None, None, None, None, )
+
+
+class _DispatchMiss(object):
+    __slots__ = []
+
+    def __repr__(self):
+        return 'DISPATCH_MISS'
+
+
+# returned by try_dispatch when there is nowhere to dispatch
+DISPATCH_MISS = _DispatchMiss()
+
+
+# Identical extra data is shared between targets. Weak references are
+# used, so the entries go away together with the route tables.
+_DATA_POOL = weakref.WeakValueDictionary()
+
 
 def is_router(tgt):
     return isinstance(tgt, (RouterBase, ))
 
 
+def shared_data(data):
+    '''Returns an immutable copy of the extra data ``data``, shared with
+    all other targets having the same extra data if possible.
+
+    '''
+
+    if data is None:
+        return None
+
+    try:
+        key = frozenset(six.iteritems(data))
+        hash(key)
+    except TypeError:
+        # unhashable values, can't be looked up in the pool
+        return data if isinstance(data, FrozenDict) else FrozenDict(data)
+
+    try:
+        return _DATA_POOL[key]
+    except KeyError:
+        pass
+
+    result = data if isinstance(data, FrozenDict) else FrozenDict(data)
+    _DATA_POOL[key] = result
+    return result
+
+
 class DispatchError(Exception):
     pass
 
 
+def _order_constraints(table):
+    # Two entries of a route table can only trade places if no query
+    # string reaches both of them, i.e. their literal prefixes diverge,
+    # or they forward to sub-routers bound to different hosts. Everything
+    # else keeps its relative order. Returns the partial order as
+    # (successors, predecessor counts, ).
+    count = len(table)
+    prefixes = [entry.dispatch_prefix() for entry in table]
+    hosts = [
+            entry.target.host if entry.target_is_router else None
+            for entry in table
+            ]
+
+    succs, npreds = [[] for _ in range(count)], [0] * count
+
+    # the prefixes extending a given one are contiguous when sorted
+    by_prefix = sorted(range(count), key=prefixes.__getitem__)
+    sorted_prefixes = [prefixes[i] for i in by_prefix]
+    for i, prefix in enumerate(prefixes):
+        k = bisect.bisect_left(sorted_prefixes, prefix)
+        while k < count and sorted_prefixes[k].startswith(prefix):
+            j = by_prefix[k]
+            k += 1
+
+            # equal prefixes are seen from both sides, only record once
+            if j == i or (prefixes[j] == prefix and j < i):
+                continue
+
+            if (hosts[i] is not None
+                    and hosts[j] is not None
+                    and hosts[i] != hosts[j]):
+                continue
+
+            lo, hi = (i, j, ) if i < j else (j, i, )
+            succs[lo].append(hi)
+            npreds[hi] += 1
+
+    return succs, npreds
+
+
+def _hot_first_order(succs, npreds, counts):
+    # Topological order of the partial order, taking the entry with the
+    # most hits whenever there is a choice, and the earlier declared one
+    # among equally hot ones.
+    npreds = list(npreds)
+    ready = [(-counts[i], i, ) for i, n in enumerate(npreds) if not n]
+    heapq.heapify(ready)
+
+    order = []
+    while ready:
+        _, i = heapq.heappop(ready)
+        order.append(i)
+        for j in succs[i]:
+            npreds[j] -= 1
+            if not npreds[j]:
+                heapq.heappush(ready, (-counts[j], j, ))
+
+    return order
+
+
 # XXX Make up clearer names for all those "target"s!
 
+def position_cost(entries, entry):
+    '''Returns the 1-based position of ``entry`` in ``entries``, compared
+    by identity, or ``None`` if it's not there.
+
+    '''
+
+    for idx, candidate in enumerate(entries):
+        if candidate is entry:
+            return idx + 1
+
+    return None
+
+
 class RouterBase(object):
+    # Optional memoization of dispatch results, an LRUCache or None.
+    # This is set up by the hub according to configuration.
+    dispatch_cache = None
+
+    # Optional memoization of dispatch misses, an LRUCache (usually with a
+    # TTL) or None. Also set up by the hub.
+    negative_cache = None
+
+    # Whether the router's lookup is the plain first-match-wins walk of the
+    # route table, so the router can be merged into a flattened table.
+    # Subclasses changing the semantics of lookup must set this to False.
+    flattenable = True
+
+    # Whether the entries may be looked up in an order other than the
+    # declared one, see enable_adaptive_order. Routers whose lookup cost
+    # does not depend on the order, or which do not dispatch through the
+    # plans, should set this to False.
+    reorderable = True
+
     def __init__(
             self,
             target_initializers,
@@ -67,11 +214,181 @@ class RouterBase(object):
             if tgt.target_is_router:
                 tgt.target.parent = tgt
 
+        self._build_host_index()
+
+    def _build_host_index(self, table=None):
+        # Entries forwarding to host-scoped sub-routers can only ever match
+        # requests for that very host, so prepare a separate lookup plan for
+        # each of the hosts, leaving out the branches of all other hosts.
+        # Requests for any other host only need to consider the entries
+        # not bound to a host. Relative order of entries is kept in every
+        # plan.
+        #
+        # table is the dispatch order of the entries, if not the declared
+        # one.
+        table = self.route_table if table is None else table
+        entry_hosts = [
+                tgt.target.host if tgt.target_is_router else None
+                for tgt in table
+                ]
+
+        host_plans = {}
+        for host in entry_hosts:
+            if host is None or host in host_plans:
+                continue
+
+            host_plans[host] = self._build_plan([
+                    tgt
+                    for tgt, tgt_host in zip(table, entry_hosts)
+                    if tgt_host is None or tgt_host == host
+                    ])
+
+        if host_plans:
+            default_plan = self._build_plan([
+                    tgt
+                    for tgt, tgt_host in zip(table, entry_hosts)
+                    if tgt_host is None
+                    ])
+        else:
+            default_plan = self._build_plan(table)
+
+        # When rebuilding, a concurrent lookup may see one old and one new
+        # plan, which is fine as both orders give the same results.
+        self._host_plans, self._default_plan = host_plans, default_plan
+
+    def enable_adaptive_order(self, interval, sample=16):
+        '''Starts counting the hits of every entry, and every ``interval``
+        lookups, moves the hottest entries towards the front of the
+        dispatch order, as far as this provably doesn't change any lookup
+        result. Only one in ``sample`` lookups is counted, to keep the
+        overhead low.
+
+        Proof of that is based on the literal prefixes of the patterns,
+        so entries without one are never moved. The declared order in
+        :attr:`route_table` is left untouched, and is still used for
+        reverse lookups and flattening.
+
+        Returns ``False`` if the router cannot be reordered.
+
+        '''
+
+        table = self.route_table
+        if not self.reorderable or len(table) < 2:
+            return False
+
+        self._order_succs, self._order_npreds = _order_constraints(table)
+        self._hit_counts = [0] * len(table)
+        self._dispatch_order = list(range(len(table)))
+        self._sample_every = self._sample_countdown = sample
+        self._reorder_every = self._reorder_countdown = interval
+        self._reorder_lock = threading.Lock()
+
+        # shadow the regular lookup with the counting one
+        self._do_lookup = self._adaptive_do_lookup
+        return True
+
+    def _adaptive_do_lookup(self, querystr, host, prev_args, prev_kwargs):
+        # Counters are updated without locking; a lost update only makes
+        # the statistics slightly less accurate.
+        self._sample_countdown -= 1
+        if self._sample_countdown > 0:
+            return self.__class__._do_lookup(
+                    self,
+                    querystr,
+                    host,
+                    prev_args,
+                    prev_kwargs,
+                    )
+
+        self._sample_countdown = self._sample_every
+        self._reorder_countdown -= self._sample_every
+        if self._reorder_countdown <= 0:
+            self._reorder_countdown = self._reorder_every
+            self.reorder()
+
+        # the plain walk, noting which entry is hit
+        table = self.route_table
+        for idx in self._dispatch_order:
+            result = table[idx].lookup(
+                    querystr,
+                    host,
+                    prev_args,
+                    prev_kwargs,
+                    )
+            if result[0]:
+                self._hit_counts[idx] += 1
+                return result
+
+        return LOOKUP_MISS
+
+    def reorder(self):
+        '''Rebuilds the lookup plans with the hottest entries first. Only
+        meaningful after :meth:`enable_adaptive_order`.
+
+        The hit counts are halved afterwards, so the order follows changes
+        in the traffic.
+
+        '''
+
+        if not self._reorder_lock.acquire(False):
+            # someone else is already at it
+            return
+
+        try:
+            counts = self._hit_counts
+            order = _hot_first_order(
+                    self._order_succs,
+                    self._order_npreds,
+                    counts,
+                    )
+            for idx in range(len(counts)):
+                counts[idx] //= 2
+
+            if order != self._dispatch_order:
+                table = self.route_table
+                self._build_host_index([table[idx] for idx in order])
+                self._dispatch_order = order
+        finally:
+            self._reorder_lock.release()
+
+    def _build_plan(self, entries):
+        '''Prepares whatever :meth:`_lookup_plan` needs to look up the
+        given entries. The default plan is just the list of entries.
+
+        Subclasses may override this, together with :meth:`_lookup_plan`, to
+        provide faster lookup strategies, as long as the first-match-wins
+        semantics is preserved.
+
+        '''
+
+        return entries
+
+    def _plan_for(self, host):
+        host_plans = self._host_plans
+        if host_plans:
+            return host_plans.get(host, self._default_plan)
+        return self._default_plan
+
+    def dispatch_cost(self, entry, host=None):
+        '''Returns how many matchers a query string for ``host`` is checked
+        against in this router, up to and including the one of ``entry``,
+        provided none of the entries tried earlier takes it. Returns
+        ``None`` if ``entry`` is never tried for ``host``.
+
+        The default implementation counts the entries up to ``entry`` in
+        the lookup plan, which is right for the sequential lookup;
+        subclasses with other lookup strategies should override this as
+        well.
+
+        '''
+
+        return position_cost(self._plan_for(host), entry)
+
     def lookup(self, querystr, host, prev_args=None, prev_kwargs=None):
         # Host check
         if self.host is not None and host != self.host:
             # Host mismatch, return miss
-            return False, None, None, None, None
+            return LOOKUP_MISS
 
         # XXX is this needed, or am I overly sensitive?
         querystr = smartstr(querystr)
@@ -82,8 +399,20 @@ class RouterBase(object):
         if prev_kwargs is None:
             prev_kwargs = {}
 
+        return self._do_lookup(querystr, host, prev_args, prev_kwargs)
+
+    def _do_lookup(self, querystr, host, prev_args, prev_kwargs):
+        host_plans = self._host_plans
+        plan = (
+                host_plans.get(host, self._default_plan)
+                if host_plans
+                else self._default_plan
+                )
+        return self._lookup_plan(plan, querystr, host, prev_args, prev_kwargs)
+
+    def _lookup_plan(self, plan, querystr, host, prev_args, prev_kwargs):
         # sequentially check our "route table"
-        for entry in self.route_table:
+        for entry in plan:
             # return is of form ``(hit, target, args, kwargs, )``
             result = entry.lookup(
                     querystr,
@@ -97,28 +426,71 @@ class RouterBase(object):
                 return result
 
         # match failure
-        return False, None, None, None, None
+        return LOOKUP_MISS
+
+    def try_dispatch(self, querystr, host, *args):
+        '''Like :meth:`dry_dispatch`, but returns :data:`DISPATCH_MISS`
+        instead of raising :exc:`DispatchError` if there is nowhere to
+        dispatch.
+
+        If :attr:`dispatch_cache` is set, successful lookups are memoized
+        in it, keyed by ``(querystr, host)``. Likewise, if
+        :attr:`negative_cache` is set, misses are remembered there, so
+        repeated requests for the same bogus path don't walk the route
+        tree again.
+
+        '''
+
+        cache, negative_cache = self.dispatch_cache, self.negative_cache
+        if cache is None and negative_cache is None:
+            result = self.lookup(querystr, host)
+        else:
+            key = (querystr, host, )
+            result = cache.get(key) if cache is not None else None
+            if result is None:
+                if (negative_cache is not None
+                        and negative_cache.get(key) is not None):
+                    return DISPATCH_MISS
+
+                result = self.lookup(querystr, host)
+                if result[0]:
+                    if cache is not None:
+                        cache.put(key, result)
+                elif negative_cache is not None:
+                    negative_cache.put(key, True)
+
+            if result[0] and cache is not None:
+                # the cached dict must not be tampered with
+                result = result[:3] + (result[3].copy(), result[4], )
+
+        hit, target, more_args, kwargs, data = result
+        if not hit:
+            return DISPATCH_MISS
+
+        # append resolved positional args to args passed in
+        extended_args = list(args)
+        extended_args.extend(more_args)
+
+        return target, extended_args, kwargs, data
 
     def dry_dispatch(self, querystr, host, *args):
         '''Do all things except actually invoking callback function,
         returns the calculated parameters that can be used to do a real
         dispatch.
 
-        '''
+        Raises :exc:`DispatchError` if there is nowhere to dispatch; see
+        :meth:`try_dispatch` for a non-raising variant.
 
-        hit, target, more_args, kwargs, data = self.lookup(querystr, host)
+        '''
 
-        if not hit:
+        result = self.try_dispatch(querystr, host, *args)
+        if result is DISPATCH_MISS:
             raise DispatchError(
                     "query string %s: nowhere to dispatch" % (
                         repr(querystr),
                         ))
 
-        # append resolved positional args to args passed in
-        extended_args = list(args)
-        extended_args.extend(more_args)
-
-        return target, extended_args, kwargs, data
+        return result
 
     def build_reverse_map(self):
         scope = self.scope
@@ -137,7 +509,9 @@ class RouterBase(object):
                         map_[chld_scope] = chld_scopemap
             else:
                 tgt_spec = entry.data.get('target_spec', None)
-                this_scope[tgt_spec] = entry.reverse_pattern
+                this_scope[tgt_spec] = entry.reverse_pattern + (
+                        entry.reverse_converters,
+                        )
 
         return map_
 
@@ -149,10 +523,81 @@ class RouterBase(object):
             map_ = self._reverse_map = self.build_reverse_map()
             return map_
 
+    def memory_report(self):
+        '''Returns an approximation of the memory taken by the route
+        tables of this router and its sub-routers, in bytes, as measured
+        by :func:`sys.getsizeof`.
+
+        The result is a ``dict`` containing counts of the ``routers``,
+        ``targets``, distinct ``patterns`` and distinct ``data`` objects,
+        and the sizes of each category in ``bytes``. Objects shared by
+        several targets are only counted once.
+
+        '''
+
+        seen = set()
+        counts = {'routers': 0, 'targets': 0, 'patterns': 0, 'data': 0, }
+        sizes = {'routers': 0, 'targets': 0, 'patterns': 0, 'data': 0, }
+
+        def account(category, obj):
+            if obj is None or id(obj) in seen:
+                return 0
+
+            seen.add(id(obj))
+            size = sys.getsizeof(obj)
+            counts[category] += 1
+            sizes[category] += size
+            return size
+
+        pending = [self]
+        while pending:
+            router = pending.pop()
+            account('routers', router)
+            sizes['routers'] += sys.getsizeof(router.route_table)
+
+            for entry in router.route_table:
+                account('targets', entry)
+
+                pattern = getattr(entry, 'pattern', None)
+                if account('patterns', pattern):
+                    # count the source string of compiled patterns too
+                    source = getattr(pattern, 'pattern', None)
+                    if source is not None and id(source) not in seen:
+                        seen.add(id(source))
+                        sizes['patterns'] += sys.getsizeof(source)
+
+                if account('data', entry.data):
+                    for k, v in six.iteritems(entry.data):
+                        for obj in (k, v, ):
+                            if id(obj) not in seen:
+                                seen.add(id(obj))
+                                sizes['data'] += sys.getsizeof(obj)
+
+                if entry.target_is_router:
+                    pending.append(entry.target)
+
+        result = dict(counts)
+        result['bytes'] = sizes
+        result['total_bytes'] = sum(six.itervalues(sizes))
+        return result
+
 
 class RouterTargetBase(object):
+    # Route tables can be huge, so keep the targets small. Subclasses
+    # should declare their own __slots__ as well.
+    __slots__ = [
+            'target',
+            'data',
+            'router',
+            'target_is_router',
+            '_reverse_pattern',
+            ]
+
     def __init__(self, target, extra_data=None, router=None):
-        self.target, self.data, self.router = target, extra_data, router
+        self.target, self.router = target, router
+
+        # Extra data is shared, and can't be modified afterwards.
+        self.data = shared_data(extra_data)
 
         # for nested processing
         self.target_is_router = is_router(target)
@@ -166,19 +611,24 @@ class RouterTargetBase(object):
 
     def lookup(self, querystr, host, prev_args, prev_kwargs):
         # return value is of form (hit, target, args, kwargs, )
-        # result is of form (status, args, kwargs, new_querystr, )
-        status, args, kwargs, new_qs = self.check(
-                querystr,
-                prev_args,
-                prev_kwargs,
+        return self.resolve(
+                self.check(querystr, prev_args, prev_kwargs),
+                host,
                 )
 
+    def resolve(self, check_result, host):
+        # Turns a check result into a lookup result, doing nested routing if
+        # necessary. This is separated from lookup so routers that figured
+        # out the check result by themselves can share the logic.
+        # check_result is of form (status, args, kwargs, new_querystr, )
+        status, args, kwargs, new_qs = check_result
+
         if status == STATUS_REACHED:
             # reached end, make args a tuple
             # XXX Is this necessary?
             return (True, self.target, tuple(args), kwargs, self.data, )
         elif status == STATUS_NOROUTE:
-            return (False, None, None, None, None, )
+            return LOOKUP_MISS
         elif status == STATUS_FORWARD:
             # do nested routing
             return self.target.lookup(new_qs, host, args, kwargs)
@@ -210,5 +660,30 @@ class RouterTargetBase(object):
     def _get_reverse_pattern(self):
         return
 
+    def dispatch_prefix(self):
+        '''Returns a string every query string reaching us starts with,
+        used to prove entries don't overlap. The empty string is always
+        correct, if not very useful.
+
+        '''
+
+        return ''
+
+    @property
+    def reverse_converters(self):
+        '''Converters of the typed arguments in :attr:`reverse_pattern`,
+        by argument name. Only used for building the reverse map, so not
+        cached.
+
+        '''
+
+        parent = self.router.parent
+        result = dict(parent.reverse_converters) if parent is not None else {}
+        result.update(self._get_reverse_converters() or {})
+        return result
+
+    def _get_reverse_converters(self):
+        return None
+
 
 # vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
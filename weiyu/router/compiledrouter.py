@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / router / code-generating router
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Code-generating router
+~~~~~~~~~~~~~~~~~~~~~~
+
+:class:`CompiledRouter` has the same semantics as :class:`RegexRouter`,
+but at construction time it generates the source of a Python function
+doing the dispatch of its whole subtree, and ``exec``\\ s it. In the
+generated code:
+
+* literal patterns become ``startswith`` calls at the current offset;
+* other patterns are precompiled and called with ``.match(qs, pos)``;
+* sub-routers of the regex and exact types are inlined as nested ``if``
+  blocks, so falling through to later entries is just leaving the block;
+* leaves reachable by a literal path are served from a ``dict`` before
+  anything else, if that provably doesn't change the winner.
+
+Targets and routers of other types, as well as targets with typed
+arguments, are still called through their usual ``lookup`` methods. The
+generated source is kept in :attr:`source`, see the
+``dump_compiled_source`` router option for dumping it at boot.
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'CompiledRouter',
+        'generate_dispatcher',
+        ]
+
+import re
+
+import six
+
+from . import router_hub
+from .base import *
+from .exactrouter import ExactRouterTarget
+from .regexrouter import (
+        RegexRouterTarget,
+        literal_of_pattern,
+        offset_matchable_source,
+        )
+
+# stands for a host not mentioned anywhere in the tree
+_OTHER_HOST = object()
+
+
+def _literal_prefix(entry):
+    # the string a target's pattern matches by simple startswith, if any
+    if type(entry) is ExactRouterTarget:
+        return entry.pattern
+
+    if type(entry) is RegexRouterTarget and not entry.pattern.groups:
+        src = entry.pattern.pattern
+        src = src[1:] if src.startswith('^') else src
+        if src.endswith('$'):
+            return None
+        return literal_of_pattern(src + '$')
+
+    return None
+
+
+def _tree_hosts(router, result):
+    for entry in router.route_table:
+        if entry.target_is_router:
+            if entry.target.host is not None:
+                result.add(entry.target.host)
+            _tree_hosts(entry.target, result)
+
+    return result
+
+
+def _reference_lookup(router, querystr, host):
+    # the plain first-match-wins walk, for checks at generation time
+    for entry in router.route_table:
+        result = entry.lookup(querystr, host, [], {})
+        if result[0]:
+            return result
+
+    return LOOKUP_MISS
+
+
+class _Generator(object):
+    def __init__(self, root):
+        self.root = root
+        self.lines = []
+        self.namespace = {'_MISS': LOOKUP_MISS, }
+        self._serial = 0
+
+    def const(self, prefix, obj):
+        name = '_%s%d' % (prefix, self._serial, )
+        self._serial += 1
+        self.namespace[name] = obj
+        return name
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def generate(self):
+        root = self.root
+        self.emit(0, 'def _dispatch_(qs, host, a0, k0):')
+
+        static = self.build_static_table()
+        if static:
+            self.namespace['_static'] = static
+            self.emit(1, 'e = _static.get(qs)')
+            self.emit(1, 'if e is not None and e[2] in (None, host, ):')
+            self.emit(2, 'return (True, e[0], a0, dict(k0), e[1], )')
+
+        self.emit(1, 'p0 = 0')
+        self.gen_router(root, 0, 1, False)
+        self.emit(1, 'return _MISS')
+
+        source = '\n'.join(self.lines) + '\n'
+        code = compile(source, '<compiled router>', 'exec')
+        six.exec_(code, self.namespace)
+        return source, self.namespace['_dispatch_']
+
+    def gen_router(self, router, depth, indent, fresh):
+        # p<depth>, a<depth> and k<depth> hold the offset into the query
+        # string, positional and keyword arguments on entry; fresh tells
+        # whether k<depth> is a copy of our own, safe to hand out.
+        pos, args, kwargs = 'p%d' % depth, 'a%d' % depth, 'k%d' % depth
+        npos, nargs, nkwargs = (
+                'p%d' % (depth + 1),
+                'a%d' % (depth + 1),
+                'k%d' % (depth + 1),
+                )
+
+        for entry in router.route_table:
+            ind = indent
+            target = entry.target
+            if entry.target_is_router and target.host is not None:
+                self.emit(ind, 'if host == %r:' % (target.host, ))
+                ind += 1
+
+            if (type(entry) not in (ExactRouterTarget, RegexRouterTarget, )
+                    or getattr(entry, 'converters', None) is not None):
+                # let the target handle everything itself, including typed
+                # arguments
+                name = self.const('e', entry)
+                self.emit(ind, 'r = %s.lookup(qs[%s:], host, list(%s), %s)' % (
+                    name,
+                    pos,
+                    args,
+                    kwargs,
+                    ))
+                self.emit(ind, 'if r[0]:')
+                self.emit(ind + 1, 'return r')
+                continue
+
+            new_fresh = fresh
+            prefix = _literal_prefix(entry)
+            if prefix is not None:
+                self.emit(ind, 'if qs.startswith(%r, %s):' % (prefix, pos, ))
+                ind += 1
+                self.emit(ind, '%s = %s + %d' % (npos, pos, len(prefix), ))
+                self.emit(ind, '%s, %s = %s, %s' % (
+                    nargs,
+                    nkwargs,
+                    args,
+                    kwargs,
+                    ))
+            else:
+                pattern = entry.pattern
+                src = offset_matchable_source(pattern.pattern)
+                offset_pattern = re.compile(src) if src is not None else None
+                if (offset_pattern is not None
+                        and offset_pattern.groupindex != pattern.groupindex):
+                    offset_pattern = None
+
+                if depth == 0:
+                    # offset is always 0 at the top level
+                    name = self.const('r', pattern)
+                    self.emit(ind, 'm = %s.match(qs)' % (name, ))
+                    end = 'm.end()'
+                elif offset_pattern is not None:
+                    name = self.const('r', offset_pattern)
+                    self.emit(ind, 'm = %s.match(qs, %s)' % (name, pos, ))
+                    end = 'm.end()'
+                else:
+                    name = self.const('r', pattern)
+                    self.emit(ind, 'm = %s.match(qs[%s:])' % (name, pos, ))
+                    end = '%s + m.end()' % (pos, )
+
+                self.emit(ind, 'if m is not None:')
+                ind += 1
+                self.emit(ind, '%s = %s' % (npos, end, ))
+
+                if entry._posidx:
+                    self.emit(ind, '%s = %s + (%s, )' % (
+                        nargs,
+                        args,
+                        ', '.join('m.group(%d)' % i for i in entry._posidx),
+                        ))
+                else:
+                    self.emit(ind, '%s = %s' % (nargs, args, ))
+
+                if entry._nameidx:
+                    self.emit(ind, '%s = dict(%s)' % (nkwargs, kwargs, ))
+                    self.emit(ind, '%s.update(m.groupdict())' % (nkwargs, ))
+                    new_fresh = True
+                else:
+                    self.emit(ind, '%s = %s' % (nkwargs, kwargs, ))
+
+            if not entry.target_is_router:
+                self.emit(ind, 'return (True, %s, %s, %s, %s, )' % (
+                    self.const('t', target),
+                    nargs,
+                    nkwargs if new_fresh else 'dict(%s)' % (nkwargs, ),
+                    self.const('d', entry.data),
+                    ))
+            elif target.flattenable:
+                self.gen_router(target, depth + 1, ind, new_fresh)
+            else:
+                # sub-router of some other kind, call into it
+                self.emit(ind, 'r = %s.lookup(qs[%s:], host, list(%s), %s)' % (
+                    self.const('t', target),
+                    npos,
+                    nargs,
+                    nkwargs,
+                    ))
+                self.emit(ind, 'if r[0]:')
+                self.emit(ind + 1, 'return r')
+
+    def collect_literal_leaves(self, router, prefix, hosts, result):
+        for entry in router.route_table:
+            target = entry.target
+            entry_hosts = hosts
+            if entry.target_is_router:
+                if target.host is not None:
+                    entry_hosts = hosts | set([target.host])
+
+                step = _literal_prefix(entry)
+                if step is not None and target.flattenable:
+                    self.collect_literal_leaves(
+                            target,
+                            prefix + step,
+                            entry_hosts,
+                            result,
+                            )
+                continue
+
+            if type(entry) is RegexRouterTarget and entry.literal is not None:
+                result.append((prefix + entry.literal, entry, entry_hosts, ))
+
+    def build_static_table(self):
+        '''Returns a ``dict`` mapping full query strings to the leaves
+        reached by them, as ``(target, data, host, )``, ``host`` being
+        ``None`` if the leaf is reachable for every host.
+
+        A leaf is only put into the table if the plain lookup is verified
+        to pick it for every relevant host.
+
+        '''
+
+        root = self.root
+        leaves = []
+        self.collect_literal_leaves(root, '', set(), leaves)
+
+        all_hosts = _tree_hosts(root, set([None, _OTHER_HOST]))
+
+        static = {}
+        for querystr, entry, hosts in leaves:
+            if querystr in static or len(hosts) > 1:
+                continue
+
+            host = next(iter(hosts)) if hosts else None
+            for try_host in (all_hosts if host is None else [host]):
+                result = _reference_lookup(root, querystr, try_host)
+                if not (result[0]
+                        and result[1] is entry.target
+                        and result[4] is entry.data):
+                    break
+            else:
+                static[querystr] = (entry.target, entry.data, host, )
+
+        return static
+
+
+def generate_dispatcher(router):
+    '''Generates the dispatch function of ``router`` and its subtree.
+
+    Returns ``(source, fn, )``, where ``fn`` is called like
+    ``fn(querystr, host, prev_args_tuple, prev_kwargs)`` and returns a
+    lookup result. The host of ``router`` itself is not checked.
+
+    '''
+
+    return _Generator(router).generate()
+
+
+@router_hub.register_router_class('compiled')
+class CompiledRouter(RouterBase):
+    '''Router with :class:`RegexRouter` semantics, dispatching through a
+    Python function generated for the whole subtree.
+
+    '''
+
+    target_type = RegexRouterTarget
+
+    # the order is baked into the generated code
+    reorderable = False
+
+    def __init__(self, *args, **kwargs):
+        super(CompiledRouter, self).__init__(*args, **kwargs)
+        self.source, self._dispatch = generate_dispatcher(self)
+
+    def _build_plan(self, entries):
+        # all of the lookup is done in generated code
+        return None
+
+    def _do_lookup(self, querystr, host, prev_args, prev_kwargs):
+        return self._dispatch(querystr, host, tuple(prev_args), prev_kwargs)
+
+    def dispatch_cost(self, entry, host=None):
+        # the generated code tests the entries in declared order, skipping
+        # the branches of other hosts
+        return position_cost(
+                [
+                    tgt
+                    for tgt in self.route_table
+                    if not tgt.target_is_router
+                    or tgt.target.host is None
+                    or tgt.target.host == host
+                    ],
+                entry,
+                )
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
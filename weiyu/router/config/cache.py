@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / routing config / parsed config cache
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Parsed config cache
+~~~~~~~~~~~~~~~~~~~
+
+Rule trees produced by the URLfile parser are plain lists, dicts and
+strings, so they are stored with :mod:`marshal`, one file per URLfile.
+A cached tree is only used if the path, modification time and size of
+the URLfile, the encoding and the weiyu version all match the ones
+recorded when it was written.
+
+Failing to read or write the cache is never an error, the URLfile is
+simply parsed again.
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'CACHE_SUFFIX',
+        'cache_key',
+        'cache_path',
+        'load_cached',
+        'store_cached',
+        ]
+
+import os
+import sys
+import errno
+import hashlib
+import marshal
+import platform
+import tempfile
+
+from ...__version__ import VERSION_STR
+
+CACHE_SUFFIX = '.URLfile.marshal'
+
+
+def cache_key(filename, enc):
+    '''Returns the key a cached rule tree of ``filename`` must match.
+
+    The file is ``stat``\\ ed, so this should be called *before* reading it;
+    a concurrent modification then only causes an extra parse later.
+
+    '''
+
+    st = os.stat(filename)
+    return (
+            os.path.abspath(filename),
+            st.st_mtime,
+            st.st_size,
+            enc,
+            VERSION_STR,
+            # marshal format is not portable across interpreters
+            platform.python_implementation(),
+            tuple(sys.version_info[:2]),
+            marshal.version,
+            )
+
+
+def cache_path(cache_dir, filename):
+    digest = hashlib.sha1(
+            os.path.abspath(filename).encode('utf-8'),
+            ).hexdigest()
+    return os.path.join(cache_dir, digest + CACHE_SUFFIX)
+
+
+def load_cached(cache_dir, filename, key):
+    '''Returns the cached rule tree of ``filename`` if it is fresh with
+    respect to ``key``, or ``None``.
+
+    '''
+
+    try:
+        with open(cache_path(cache_dir, filename), 'rb') as fp:
+            cached_key, config = marshal.load(fp)
+    except (IOError, OSError, EOFError, ValueError, TypeError, ):
+        return None
+
+    return config if tuple(cached_key) == key else None
+
+
+def store_cached(cache_dir, filename, key, config):
+    '''Writes the rule tree of ``filename`` to the cache.
+
+    The file is written under a temporary name and then renamed over the
+    old one, so concurrently booting processes never see a partial file.
+
+    '''
+
+    try:
+        payload = marshal.dumps((key, config, ))
+    except ValueError:
+        # something not marshallable in the tree, don't bother
+        return False
+
+    try:
+        os.makedirs(cache_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            return False
+
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+                suffix='.tmp',
+                prefix='.',
+                dir=cache_dir,
+                )
+    except (IOError, OSError, ):
+        return False
+
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(payload)
+        os.rename(tmp_path, cache_path(cache_dir, filename))
+    except (IOError, OSError, ):
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        return False
+
+    return True
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
@@ -25,15 +25,41 @@ __all__ = [
 
 import ply.lex as lex
 from .wrlex import WRLexer
-from .wryacc import parser
+from .wryacc import get_parser
+from .cache import cache_key, load_cached, store_cached
 
 
-def parse_config(filename, enc='utf-8'):
+def parse_config(filename, enc='utf-8', cache_dir=None):
+    '''Parses the URLfile ``filename`` into a rule tree.
+
+    If ``cache_dir`` is given, a fresh rule tree cached there is returned
+    without even reading the file, and newly parsed trees are cached for
+    later use.
+
+    '''
+
+    if cache_dir is not None:
+        try:
+            key = cache_key(filename, enc)
+        except OSError:
+            # let the open() below report the error as before
+            cache_dir = None
+
+    if cache_dir is not None:
+        config = load_cached(cache_dir, filename, key)
+        if config is not None:
+            return config
+
     with open(filename, 'rb') as fp:
         raw_content = fp.read()
     content = raw_content.decode(enc)
 
-    return parser.parse(lexer=WRLexer(content))
+    config = get_parser().parse(lexer=WRLexer(content))
+
+    if cache_dir is not None and config is not None:
+        store_cached(cache_dir, filename, key, config)
+
+    return config
 
 
 # vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
@@ -42,7 +42,23 @@ class Token(object):
                 )
 
 
+# Master patterns of lexer classes, see Lexer._get_masters.
+_MASTER_CACHE = {}
+
+
 class Lexer(object):
+    '''Rule-based lexer.
+
+    Subclasses list their rules in ``RULES``, an ordered mapping from rule
+    names to regexes; at every position the first rule that matches wins,
+    and the ``t_<name>`` handler of the rule is invoked to produce tokens.
+
+    Instead of trying every rule one by one, the rules are combined into a
+    single alternation, so each token takes only one ``match`` call. The
+    combined patterns are built once per class.
+
+    '''
+
     def __init__(self, s=None):
         self._lex_reset(s)
 
@@ -56,8 +72,7 @@ class Lexer(object):
 
         self._tokens = None
         self._state = 'INITIAL'
-        self._prev = None
-        self._ply_pos = None
+        self._stream = None
 
     def input(self, s):
         self._lex_reset(s)
@@ -69,68 +84,82 @@ class Lexer(object):
     def eof(self):
         return self._pos >= self._length
 
-    def lex(self):
-        cls = self.__class__
+    @classmethod
+    def _get_masters(cls):
+        # masters[i] is (pattern, slots, ) trying the rules from the i-th on
+        # in order, as a handler skipping its match means trying the next
+        # rules at the same position. Every rule is wrapped in a group, the
+        # one closing last in a match; slots maps match.lastindex to the
+        # index of the rule.
+        try:
+            return _MASTER_CACHE[cls]
+        except KeyError:
+            pass
+
+        names = list(six.iterkeys(cls.RULES))
+        rules = [cls.RULES[name] for name in names]
+        masters = []
+        for start in range(len(rules)):
+            srcs, slots = [], [None]
+            for idx in range(start, len(rules)):
+                slots.append(idx)
+                slots.extend([None] * re.compile(rules[idx]).groups)
+                srcs.append('(' + rules[idx] + ')')
+
+            masters.append((re.compile('|'.join(srcs)), slots, ))
+
+        result = _MASTER_CACHE[cls] = (names, masters, )
+        return result
 
-        _rule_cache = OrderedDict(
-                (name, re.compile(rule), )
-                for name, rule in six.iteritems(cls.RULES)
-                )
-        _handlers = {
-                name: getattr(self, 't_%s' % name)
-                for name in six.iterkeys(_rule_cache)
-                }
+    def _generate_tokens(self):
+        names, masters = self._get_masters()
+        handlers = [getattr(self, 't_%s' % name) for name in names]
+        input_ = self._input
 
-        self._tokens = []
+        start, restart_pos = 0, None
         while self._pos <= self._length:
-            matched = False
-            for name, rule in six.iteritems(_rule_cache):
-                #print(
-                #        '[try] %s: %s' % (
-                #            name,
-                #            repr(self._input[self._pos:self._pos + 16]),
-                #            ),
-                #        )
-                match = rule.match(self._input, self._pos)
-                if match is not None:
-                    matched = True
-                    match_span = match.span()
-                    # advance the pointer
-                    self._pos = match_span[1]
-
-                    # generate the token(s)
-                    frag = self._input[match_span[0]:match_span[1]]
-                    #print('[yes] %s: %s' % (name, repr(frag), ))
-                    skip, result = _handlers[name](frag, self, match)
-                    if skip:
-                        continue
-
-                    # print result
-                    self._tokens.extend(result)
-
-                    # update previous token
-                    self._prev = self._tokens[-1].type
-                    break
-
-            if not matched:
+            pattern, slots = masters[start]
+            match = pattern.match(input_, self._pos)
+            if match is None:
+                if start and restart_pos != self._pos:
+                    # The rules after a skipped one didn't match, start
+                    # over. Doing so twice at the same position would
+                    # never end.
+                    start, restart_pos = 0, self._pos
+                    continue
+
                 raise ValueError('could not advance any more')
 
+            # advance the pointer
+            self._pos = match.end()
+
+            # generate the token(s)
+            idx = slots[match.lastindex]
+            skip, result = handlers[idx](match.group(), self, match)
+            if skip:
+                start = idx + 1 if idx + 1 < len(masters) else 0
+                continue
+
+            start = 0
+            for tok in result:
+                yield tok
+
+    def lex(self):
         # Postprocess the token sequence.
-        self._tokens = self.postprocess(self._tokens)
+        self._tokens = list(self.postprocess(self._generate_tokens()))
 
     def token(self):
         # For compatibility with PLY.
-        if self._ply_pos is None:
-            self._ply_pos = 0
-            if self._tokens is None:
-                # lex first
-                self.lex()
-        if self._ply_pos >= len(self._tokens):
-            return None
-
-        pos = self._ply_pos
-        self._ply_pos += 1
-        return self._tokens[pos]
+        # Tokens are produced on demand, unless lex() has been called.
+        stream = self._stream
+        if stream is None:
+            if self._tokens is not None:
+                stream = iter(self._tokens)
+            else:
+                stream = iter(self.postprocess(self._generate_tokens()))
+            self._stream = stream
+
+        return next(stream, None)
 
     def postprocess(self, tokens):
         # No-op
@@ -163,8 +192,7 @@ class WRLexer(Lexer):
         tmp = super(WRLexer, self).postprocess(tokens)
 
         # Coalesce consecutive NEWLINEs generated by multiple lines of
-        # line comments.
-        result = []
+        # line comments. Tokens are streamed through.
         last_tok_type, last_out_tok_type = '', ''
         first_newline_met, merged_tok = None, None
         for tok in tmp:
@@ -174,13 +202,13 @@ class WRLexer(Lexer):
                 if merged_tok is not None:
                     # Don't output NEWLINE immediately after COLON
                     if last_out_tok_type != 'COLON':
-                        result.append(merged_tok)
+                        yield merged_tok
 
                     # Clear reference to pending token.
                     merged_tok = None
 
                 # Pass-through all the non-NEWLINE tokens.
-                result.append(tok)
+                yield tok
                 last_out_tok_type = last_tok_type = tok.type
                 continue
 
@@ -200,8 +228,6 @@ class WRLexer(Lexer):
 
             last_tok_type = tok.type
 
-        return result
-
     # f for fragment, l for lexer instance, m for match object
     # return value: (do_skip_this_rule, token_list_generated, )
     def t_LINECOMMENT(self, f, l, m):
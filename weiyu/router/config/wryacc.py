@@ -20,10 +20,11 @@
 from __future__ import unicode_literals, division, print_function
 
 __all__ = [
-        'parser',
+        'get_parser',
         ]
 
 import re
+import sys
 import json
 from collections import OrderedDict
 
@@ -177,9 +178,28 @@ def p_error(tok):
     print('*** Error: %s' % (repr(tok), ), file=sys.stderr)
 
 
-# don't write parse table, the overhead is negligible when compared to
-# the total uptime of web servers
-parser = yacc.yacc(debug=0, write_tables=0)
+_PARSER = None
+
+
+def get_parser():
+    '''Returns the URLfile parser, building it on first use.
+
+    Building the parse table takes some time, which is saved entirely if
+    every URLfile is served from the parsed config cache.
+
+    '''
+
+    global _PARSER
+    if _PARSER is None:
+        # don't write parse table, the overhead is negligible when compared
+        # to the total uptime of web servers
+        _PARSER = yacc.yacc(
+                debug=0,
+                write_tables=0,
+                module=sys.modules[__name__],
+                )
+
+    return _PARSER
 
 
 # vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / router / typed path converters
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Typed path converters
+~~~~~~~~~~~~~~~~~~~~~
+
+Regex patterns can capture typed arguments with the ``<name:type>``
+syntax, e.g. ``^user/<id:int>/$``. The placeholder is expanded into a
+named group matching what the converter accepts, and the captured string
+is converted by the router before the view is called. If the conversion
+raises :exc:`ValueError`, the target is treated as not matching, so
+routing goes on with the following targets.
+
+The :class:`~weiyu.router.reverser.Reverser` converts the arguments back
+with :meth:`BaseConverter.to_url`.
+
+Custom converters are registered with
+:meth:`~weiyu.router.RouterHub.register_converter`::
+
+    @router_hub.register_converter('slug')
+    class SlugConverter(BaseConverter):
+        regex = r'[-a-z0-9]+'
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'BaseConverter',
+        'expand_converters',
+        ]
+
+import re
+import uuid
+
+import six
+
+from . import router_hub
+
+# <name:type>, but not inside (?P<...>) or after a backslash
+CONVERTER_PLACEHOLDER = re.compile(
+        r'(?<!\(\?P)(?<!\\)'
+        r'<([A-Za-z_][A-Za-z0-9_]*):([A-Za-z_][A-Za-z0-9_]*)>'
+        )
+
+
+class BaseConverter(object):
+    '''Converter between a path segment and a Python value.
+
+    :attr regex: the regular expression matching the accepted segments; it
+      must not contain capturing groups.
+
+    '''
+
+    regex = r'[^/]+'
+
+    def to_python(self, value):
+        return value
+
+    def to_url(self, value):
+        return six.text_type(value)
+
+
+@router_hub.register_converter('str')
+class StringConverter(BaseConverter):
+    pass
+
+
+@router_hub.register_converter('path')
+class PathConverter(BaseConverter):
+    regex = r'.+'
+
+
+@router_hub.register_converter('int')
+class IntConverter(BaseConverter):
+    regex = r'\d+'
+
+    def to_python(self, value):
+        return int(value)
+
+    def to_url(self, value):
+        return '%d' % (int(value), )
+
+
+@router_hub.register_converter('uuid')
+class UUIDConverter(BaseConverter):
+    regex = (
+            r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-'
+            r'[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'
+            )
+
+    def to_python(self, value):
+        return uuid.UUID(value)
+
+    def to_url(self, value):
+        return six.text_type(value)
+
+
+def expand_converters(pattern):
+    '''Expands the ``<name:type>`` placeholders in ``pattern`` into named
+    groups.
+
+    Returns ``(expanded_pattern, converters, )``, ``converters`` being a
+    ``dict`` mapping argument names to converter instances, or ``None`` if
+    there is no placeholder at all.
+
+    '''
+
+    if '<' not in pattern:
+        return pattern, None
+
+    converters = {}
+
+    def _replace(match):
+        name, typ = match.group(1), match.group(2)
+        if name in converters:
+            raise ValueError(
+                    'duplicate argument \'%s\' in pattern %s' % (
+                        name,
+                        repr(pattern),
+                        ))
+
+        converter = converters[name] = router_hub.get_converter(typ)
+        return '(?P<%s>%s)' % (name, converter.regex, )
+
+    expanded = CONVERTER_PLACEHOLDER.sub(_replace, pattern)
+    return expanded, (converters or None)
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
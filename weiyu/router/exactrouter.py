@@ -31,6 +31,11 @@ from . import router_hub
 from .base import *
 
 
+# Pattern strings shared by all targets. Unicode strings can't be interned
+# on Python 2.x, so do it ourselves.
+_PATTERN_POOL = {}
+
+
 class ExactRouterTarget(RouterTargetBase):
     '''
     This target cannot extract any arguments from query strings; useful
@@ -45,10 +50,16 @@ class ExactRouterTarget(RouterTargetBase):
 
     '''
 
+    __slots__ = [
+            'pattern',
+            '_pat_len',
+            ]
+
     def __init__(self, pattern, target, extra_data=None, router=None):
         super(ExactRouterTarget, self).__init__(target, extra_data, router)
 
-        self.pattern = smartstr(pattern)
+        pattern = smartstr(pattern)
+        self.pattern = _PATTERN_POOL.setdefault(pattern, pattern)
         self._pat_len = len(self.pattern)
 
     def check(self, querystr, prev_args, prev_kwargs):
@@ -73,10 +84,141 @@ class ExactRouterTarget(RouterTargetBase):
     def _get_reverse_pattern(self):
         return (self.pattern, set(), )
 
+    def dispatch_prefix(self):
+        return self.pattern
+
+
+class _RadixNode(object):
+    __slots__ = ['children', 'entries', ]
+
+    def __init__(self, entries=None):
+        # first character of edge label -> (label, child node, )
+        self.children = {}
+        # indices of the targets whose pattern ends at this node
+        self.entries = entries if entries is not None else []
+
+
+class PrefixIndex(object):
+    '''Radix tree of the route patterns, answering "which patterns are
+    prefixes of this string" in time proportional to the string length.
+
+    '''
+
+    def __init__(self, patterns=None):
+        self._root = _RadixNode()
+
+        if patterns is not None:
+            for idx, pattern in enumerate(patterns):
+                self.insert(pattern, idx)
+
+    def insert(self, key, value):
+        node, pos, keylen = self._root, 0, len(key)
+        while pos < keylen:
+            ch = key[pos]
+            try:
+                label, child = node.children[ch]
+            except KeyError:
+                # no edge to follow, hang a new leaf here
+                node.children[ch] = (key[pos:], _RadixNode([value]), )
+                return
+
+            # length of the common prefix of label and the rest of key
+            common, limit = 1, min(len(label), keylen - pos)
+            while common < limit and label[common] == key[pos + common]:
+                common += 1
+
+            if common < len(label):
+                # split the edge at the point of divergence
+                mid = _RadixNode()
+                mid.children[label[common]] = (label[common:], child, )
+                node.children[ch] = (label[:common], mid, )
+                child = mid
+
+            node, pos = child, pos + common
+
+        node.entries.append(value)
+
+    def prefixes_of(self, s):
+        '''Returns the values of all keys that are prefixes of ``s``, in
+        ascending order.
+
+        '''
+
+        node, pos = self._root, 0
+        result, sources = node.entries, 0
+        if result:
+            sources = 1
+
+        children = node.children
+        while children:
+            try:
+                label, node = children[s[pos]]
+            except (KeyError, IndexError):
+                break
+
+            if not s.startswith(label, pos):
+                break
+
+            pos += len(label)
+            if node.entries:
+                if sources:
+                    if sources == 1:
+                        # don't clobber the node's own list
+                        result = result[:]
+                    result.extend(node.entries)
+                else:
+                    result = node.entries
+                sources += 1
+            children = node.children
+
+        # Values are inserted in order, so a single node's list is already
+        # sorted.
+        return sorted(result) if sources > 1 else result
+
 
 @router_hub.register_router_class('exact')
 class ExactRouter(RouterBase):
+    '''Router doing ``startswith`` matches.
+
+    A radix tree of the patterns is built at construction time, so only the
+    targets whose pattern is a prefix of the query string are ever checked,
+    still in declaration order.
+
+    '''
+
     target_type = ExactRouterTarget
 
+    # only the matching prefixes are ever checked, whatever the order
+    reorderable = False
+
+    def _build_plan(self, entries):
+        return (entries, PrefixIndex(entry.pattern for entry in entries), )
+
+    def _lookup_plan(self, plan, querystr, host, prev_args, prev_kwargs):
+        entries, index = plan
+        for idx in index.prefixes_of(querystr):
+            result = entries[idx].lookup(
+                    querystr,
+                    host,
+                    prev_args,
+                    prev_kwargs,
+                    )
+            if result[0]:
+                return result
+
+        return LOOKUP_MISS
+
+    def dispatch_cost(self, entry, host=None):
+        # only the entries whose patterns are prefixes of the query string
+        # are tried, shortest first
+        entries, index = self._plan_for(host)
+        cost = 0
+        for idx in index.prefixes_of(entry.pattern):
+            cost += 1
+            if entries[idx] is entry:
+                return cost
+
+        return None
+
 
 # vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
@@ -0,0 +1,674 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / router / flattened router
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Flattened router
+~~~~~~~~~~~~~~~~
+
+Every level of nesting in a URLfile becomes its own router object, and a
+lookup recurses into them one by one, slicing the query string and copying
+the arguments at each level. :class:`FlatRouter` turns such a tree into a
+single table of leaves in depth-first order, each leaf carrying the chain
+of matchers along its path, and dispatches on the table as a whole:
+
+* leaves reachable by a literal path are served from a ``dict`` before
+  anything else, if that provably doesn't change the winner;
+* runs of leaves whose matchers are all literals or regexes are merged
+  into one pattern, shaped like the tree itself: the matcher of a common
+  parent is spelled once, followed by an alternation of its children. A
+  single ``match`` call then walks the whole run in C, skipping a subtree
+  as soon as its parent's matcher fails;
+* everything else is walked leaf by leaf, with matchers working on offsets
+  into the query string, and the results of matchers shared by
+  consecutive leaves reused for the siblings.
+
+The matchers of parents are made atomic in the merged patterns, so the
+regex engine never backtracks into them to make a child match, exactly
+like the recursive lookup which only ever tries the children at the end
+of the parent's first match. Trying the leaves in depth-first order thus
+gives the same result as the recursive lookup, including falling through
+to later entries after a sub-router misses.
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'FlatRouter',
+        'flatten_router',
+        ]
+
+import re
+
+from ..helpers.misc import smartstr
+
+from .base import *
+from .exactrouter import ExactRouterTarget
+from .regexrouter import (
+        RegexRouterTarget,
+        literal_of_pattern,
+        offset_matchable_source,
+        split_leading_literal,
+        strip_group_names,
+        _MAX_COMBINED_GROUPS,
+        )
+
+STEP_EXACT, STEP_REGEX, STEP_GENERIC = range(3)
+
+
+def _has_atomic_groups():
+    # atomic groups are only supported by sre since Python 3.11
+    try:
+        re.compile('(?>a)')
+    except re.error:
+        return False
+    return True
+
+
+_ATOMIC_GROUPS = _has_atomic_groups()
+
+
+class _Step(object):
+    '''A matcher along the path of some leaves.
+
+    One step is created for every target in the original tree, and shared
+    by all the leaves below that target.
+
+    '''
+
+    __slots__ = [
+            'kind',
+            'host',
+            'entry',
+            'pattern',
+            'length',
+            'posidx',
+            'nameidx',
+            'converters',
+            'source',
+            'literal',
+            ]
+
+    def __init__(self, entry, host):
+        self.kind, self.host, self.entry = STEP_GENERIC, host, entry
+        self.pattern, self.length = None, 0
+        self.posidx, self.nameidx = None, None
+        self.converters = None
+
+        # The source of the step for merged patterns, without group names,
+        # and the literal string it matches, if any; source is None if the
+        # step cannot be merged.
+        self.source, self.literal = None, None
+
+        if isinstance(entry, ExactRouterTarget):
+            self.kind = STEP_EXACT
+            self.pattern, self.length = entry.pattern, len(entry.pattern)
+            self.literal = entry.pattern
+            self.source = re.escape(entry.pattern)
+        elif isinstance(entry, RegexRouterTarget):
+            src = offset_matchable_source(entry.pattern.pattern)
+            if src is not None:
+                pattern = re.compile(src)
+                if pattern.groupindex == entry.pattern.groupindex:
+                    self.kind, self.pattern = STEP_REGEX, pattern
+                    self.posidx = tuple(entry._posidx)
+                    self.nameidx = tuple(entry._nameidx)
+                    self.converters = entry.converters
+                    self._init_source(src)
+
+    def _init_source(self, src):
+        if not self.pattern.groups and not src.endswith('$'):
+            self.literal = literal_of_pattern(src + '$')
+            if self.literal is not None:
+                self.source = re.escape(self.literal)
+                return
+
+        stripped = strip_group_names(src)
+        if stripped is None:
+            return
+
+        # verify the rewrite, being conservative
+        try:
+            if re.compile(stripped).groups == self.pattern.groups:
+                self.source = stripped
+        except re.error:
+            pass
+
+    def match(self, querystr, pos, host, args, kwargs):
+        '''Returns ``(end, args, kwargs, )`` if the step matches at offset
+        ``pos``, ``None`` otherwise.
+
+        '''
+
+        if self.host is not None and host != self.host:
+            return None
+
+        kind = self.kind
+        if kind == STEP_EXACT:
+            if not querystr.startswith(self.pattern, pos):
+                return None
+            return pos + self.length, args, kwargs
+
+        if kind == STEP_REGEX:
+            match = self.pattern.match(querystr, pos)
+            if match is None:
+                return None
+
+            if self.nameidx:
+                kwargs = kwargs.copy()
+            args = self.extract(
+                    match,
+                    self.posidx,
+                    self.nameidx,
+                    args,
+                    kwargs,
+                    )
+            if args is None:
+                return None
+            return match.end(), args, kwargs
+
+        # Unknown target type, let the target itself decide on a slice.
+        status, new_args, new_kwargs, new_qs = self.entry.check(
+                querystr[pos:],
+                list(args),
+                kwargs,
+                )
+        if status == STATUS_NOROUTE:
+            return None
+
+        end = len(querystr) - len(new_qs) if new_qs is not None else pos
+        return end, tuple(new_args), new_kwargs
+
+    def extract(self, match, posidx, nameidx, args, kwargs):
+        '''Returns ``args`` extended with the positional arguments captured
+        by the step in ``match``, and puts the named ones into ``kwargs``
+        in place. ``posidx`` and ``nameidx`` are the numbers of the groups
+        of the step in the pattern matched, like :attr:`posidx` and
+        :attr:`nameidx` are for the step's own pattern. Returns ``None`` if
+        a typed argument is malformed.
+
+        '''
+
+        group = match.group
+        if posidx:
+            values = group(*posidx)
+            args = args + (values if len(posidx) > 1 else (values, ))
+        if nameidx:
+            for name, i in nameidx:
+                kwargs[name] = group(i)
+
+            if self.converters is not None:
+                try:
+                    self.entry.convert(kwargs)
+                except ValueError:
+                    return None
+        return args
+
+
+def _do_flatten(router, prefix, table):
+    host = router.host
+    for entry in router.route_table:
+        steps = prefix + (_Step(entry, host), )
+        if entry.target_is_router and entry.target.flattenable:
+            _do_flatten(entry.target, steps, table)
+        else:
+            # either a leaf, or a sub-router we can't see through
+            table.append((steps, entry, ))
+
+
+def _leaf_hosts(steps, entry):
+    hosts = set(step.host for step in steps if step.host is not None)
+    if entry.target_is_router and entry.target.host is not None:
+        hosts.add(entry.target.host)
+    return hosts
+
+
+def _build_table(leaves):
+    # compute the skip indices, backwards
+    table = [None] * len(leaves)
+    next_steps, next_skips = (), ()
+    for idx in range(len(leaves) - 1, -1, -1):
+        steps, entry = leaves[idx]
+        skips = []
+        for depth, step in enumerate(steps):
+            if depth < len(next_steps) and next_steps[depth] is step:
+                # the next leaf shares this step, so does its skip target
+                skips.append(next_skips[depth])
+            else:
+                skips.append(idx + 1)
+
+        skips = tuple(skips)
+        table[idx] = (steps, skips, entry, )
+        next_steps, next_skips = steps, skips
+
+    return table
+
+
+def flatten_router(router):
+    '''Flattens the tree of routers rooted at ``router`` into a list of
+    ``(steps, skips, entry, )`` tuples, in depth-first order.
+
+    ``steps`` is the tuple of matchers along the path to ``entry``, and
+    ``skips[d]`` is the index of the first leaf not sharing ``steps[d]``,
+    i.e. where to continue if that step fails.
+
+    '''
+
+    leaves = []
+    _do_flatten(router, (), leaves)
+    return _build_table(leaves)
+
+
+def _match_leaves(table, start, stop, querystr, host, args, kwargs):
+    # Yields (idx, end, args, kwargs, ) for every leaf in table[start:stop]
+    # whose steps all match, walking the steps one by one.
+    #
+    # results of the matched steps along the current path, as
+    # (step, end, args, kwargs, )
+    stack = []
+    base = (0, args, kwargs, )
+
+    idx = start
+    while idx < stop:
+        steps, skips, entry = table[idx]
+
+        # reuse the results of the steps shared with the previous leaf
+        depth, stack_len = 0, len(stack)
+        while depth < stack_len and stack[depth][0] is steps[depth]:
+            depth += 1
+        del stack[depth:]
+
+        pos, args, kwargs = stack[-1][1:] if depth else base
+
+        for depth in range(depth, len(steps)):
+            step = steps[depth]
+            result = step.match(querystr, pos, host, args, kwargs)
+            if result is None:
+                idx = skips[depth]
+                break
+
+            pos, args, kwargs = result
+            stack.append((step, pos, args, kwargs, ))
+        else:
+            yield idx, pos, args, kwargs
+            idx += 1
+
+
+def _is_mergeable(steps):
+    return all(step.source is not None for step in steps)
+
+
+class _PatternBuilder(object):
+    '''Builds the merged pattern of a run of leaves.'''
+
+    def __init__(self, table):
+        self.table = table
+        self.groups = 0
+        # group number of a leaf's own group -> slot, see build_flat_chunks
+        self.slots = {}
+
+    def build(self, start, stop):
+        return re.compile(self.alternatives(start, stop, 0, ()))
+
+    def alternatives(self, start, stop, depth, fields):
+        # the leaves in table[start:stop] share their first depth steps;
+        # group them by the next one
+        table, result = self.table, []
+        idx = start
+        while idx < stop:
+            step = table[idx][0][depth]
+            end = idx + 1
+            while end < stop and table[end][0][depth] is step:
+                end += 1
+
+            result.append(self.node(idx, end, depth, fields))
+            idx = end
+
+        return '|'.join(result)
+
+    def node(self, start, stop, depth, fields):
+        steps = self.table[start][0]
+        step = steps[depth]
+
+        if depth == len(steps) - 1:
+            # the last step of a leaf, wrapped in a group of its own, which
+            # is always the last one closed if the leaf matches
+            self.groups += 1
+            group = self.groups
+            literal, source, fields = self.step_source(step, fields, False)
+            self.slots[group] = self.slot(start, fields)
+            return literal + '(' + source + ')'
+
+        literal, source, fields = self.step_source(step, fields, True)
+        children = self.alternatives(start, stop, depth + 1, fields)
+        return literal + source + '(?:' + children + ')'
+
+    def step_source(self, step, fields, atomic):
+        if step.literal is not None:
+            return step.source, '', fields
+
+        # Hoist the leading literal out of the groups below, so sre can
+        # tell the alternatives apart by their first character without
+        # entering them.
+        literal, source = split_leading_literal(step.source)
+
+        head = tail = ''
+        if atomic:
+            if _ATOMIC_GROUPS:
+                head, tail = '(?>', ')'
+            else:
+                # emulate an atomic group with a lookahead, the engine
+                # never backtracks into those
+                self.groups += 1
+                head, tail = '(?=(', '))(?:\\%d)' % (self.groups, )
+
+        offset = self.groups
+        self.groups += step.pattern.groups
+        if step.posidx or step.nameidx:
+            fields = fields + ((
+                step,
+                tuple(offset + i for i in step.posidx),
+                tuple((name, offset + i) for name, i in step.nameidx),
+                ), )
+
+        return re.escape(literal), head + source + tail, fields
+
+    def slot(self, idx, fields):
+        posidx, nameidx = (), ()
+        for step, step_posidx, step_nameidx in fields:
+            if step.converters is not None:
+                # the arguments have to be extracted step by step
+                break
+            posidx += step_posidx
+            nameidx += step_nameidx
+        else:
+            fields = None
+
+        return (idx, self.table[idx][2], posidx, nameidx, fields, )
+
+
+def _leaf_groups(steps):
+    # upper bound of the groups a leaf adds to a merged pattern
+    return 1 + sum(
+            step.pattern.groups + 1
+            for step in steps
+            if step.literal is None
+            )
+
+
+def build_flat_chunks(table):
+    '''Splits a table made by :func:`flatten_router` into runs of
+    consecutive leaves, merging every run of mergeable leaves into one
+    pattern.
+
+    Every chunk is a tuple ``(matcher, start, stop, slots, )``, covering
+    ``table[start:stop]``. ``matcher`` is either the merged pattern, or
+    ``None`` for a run of leaves to be walked step by step. ``slots`` maps
+    ``match.lastindex`` of the merged pattern to a tuple
+    ``(idx, entry, posidx, nameidx, fields, )``, ``idx`` being the index of
+    the winning leaf ``entry`` in ``table``. ``fields`` tells where the
+    arguments of the leaf's steps are, as ``(step, posidx, nameidx, )``
+    tuples for :meth:`_Step.extract`, if any of them has typed arguments;
+    otherwise ``fields`` is ``None``, and ``posidx`` and ``nameidx`` tell
+    where all the arguments of the leaf are at once.
+
+    '''
+
+    chunks = []
+
+    def flush(start, stop, mergeable):
+        if start == stop:
+            return
+
+        if not mergeable:
+            chunks.append((None, start, stop, None, ))
+            return
+
+        builder = _PatternBuilder(table)
+        matcher = builder.build(start, stop)
+        chunks.append((matcher, start, stop, builder.slots, ))
+
+    start, mergeable, groups = 0, None, 0
+    for idx, (steps, skips, entry) in enumerate(table):
+        leaf_mergeable = _is_mergeable(steps)
+        leaf_groups = _leaf_groups(steps) if leaf_mergeable else 0
+        if leaf_mergeable != mergeable or (
+                _MAX_COMBINED_GROUPS is not None
+                and groups + leaf_groups >= _MAX_COMBINED_GROUPS
+                ):
+            flush(start, idx, mergeable)
+            start, mergeable, groups = idx, leaf_mergeable, 0
+
+        groups += leaf_groups
+
+    flush(start, len(table), mergeable)
+    return chunks
+
+
+def _leaf_literal(steps, entry):
+    # the only query string reaching the leaf through literals, if any
+    if entry.target_is_router:
+        return None
+
+    parts = [step.literal for step in steps[:-1]]
+    last = steps[-1]
+    if last.kind == STEP_EXACT:
+        parts.append(last.literal)
+    elif last.kind == STEP_REGEX:
+        parts.append(entry.literal)
+    else:
+        return None
+
+    if None in parts:
+        return None
+    return ''.join(parts)
+
+
+def build_flat_static_table(table, host):
+    '''Returns a ``dict`` mapping full query strings to the leaves of
+    ``table`` reached by them through literal matchers only.
+
+    A leaf is only put into the table if walking the table for ``host``
+    is verified to pick it, and not anything before it.
+
+    '''
+
+    static = {}
+    for idx, (steps, skips, entry) in enumerate(table):
+        querystr = _leaf_literal(steps, entry)
+        if querystr is None or querystr in static:
+            continue
+
+        for first in _match_leaves(
+                table, 0, idx + 1, querystr, host, (), {}):
+            if first[0] == idx:
+                static[querystr] = entry
+            break
+
+    return static
+
+
+class FlatRouter(RouterBase):
+    '''Router dispatching with a flattened copy of a router tree.
+
+    The original tree is kept in :attr:`tree`, and is used for reverse
+    URL resolution, so the scopes and reverse maps are unaffected.
+
+    '''
+
+    # the flattened table is always walked in the declared order
+    reorderable = False
+
+    def __init__(self, root):
+        # No route table of our own, so the superclass constructor is not
+        # invoked.
+        self.tree = root
+        self.name, self.scope, self.host = root.name, root.scope, root.host
+        self.parent = None
+        self.route_table = root.route_table
+
+        leaves = []
+        _do_flatten(root, (), leaves)
+
+        # Like RouterBase, keep a separate table for each of the hosts
+        # mentioned in the tree, so leaves bound to other hosts are never
+        # visited. Leaves requiring two different hosts can never match,
+        # and are dropped altogether.
+        leaf_hosts = [_leaf_hosts(steps, entry) for steps, entry in leaves]
+        all_hosts = set()
+        for hosts in leaf_hosts:
+            all_hosts.update(hosts)
+
+        self._host_tables = dict(
+                (
+                    host,
+                    self._build_flat_plan(
+                        [
+                            leaf
+                            for leaf, hosts in zip(leaves, leaf_hosts)
+                            if hosts <= set([host])
+                            ],
+                        host,
+                        ),
+                    )
+                for host in all_hosts
+                )
+        self._default_table = self._build_flat_plan(
+                [
+                    leaf
+                    for leaf, hosts in zip(leaves, leaf_hosts)
+                    if not hosts
+                    ],
+                None,
+                )
+
+    @staticmethod
+    def _build_flat_plan(leaves, host):
+        table = _build_table(leaves)
+        return (
+                table,
+                build_flat_static_table(table, host),
+                build_flat_chunks(table),
+                )
+
+    @property
+    def reverse_map(self):
+        return self.tree.reverse_map
+
+    def lookup(self, querystr, host, prev_args=None, prev_kwargs=None):
+        querystr = smartstr(querystr)
+        base_args = tuple(prev_args) if prev_args is not None else ()
+        base_kwargs = prev_kwargs if prev_kwargs is not None else {}
+
+        host_tables = self._host_tables
+        table, static, chunks = (
+                host_tables.get(host, self._default_table)
+                if host_tables
+                else self._default_table
+                )
+
+        entry = static.get(querystr)
+        if entry is not None:
+            return (
+                    True,
+                    entry.target,
+                    base_args,
+                    base_kwargs.copy(),
+                    entry.data,
+                    )
+
+        for matcher, start, stop, slots in chunks:
+            if matcher is not None:
+                match = matcher.match(querystr)
+                if match is None:
+                    continue
+
+                group = match.lastindex
+                idx, entry, posidx, nameidx, fields = slots[group]
+                args, kwargs = base_args, base_kwargs.copy()
+                if fields is None:
+                    # no typed arguments, so nothing can go wrong
+                    if posidx:
+                        args += match.group(0, *posidx)[1:]
+                    for name, i in nameidx:
+                        kwargs[name] = match.group(i)
+                    fields = ()
+
+                for step, posidx, nameidx in fields:
+                    args = step.extract(match, posidx, nameidx, args, kwargs)
+                    if args is None:
+                        break
+                else:
+                    if not entry.target_is_router:
+                        return (True, entry.target, args, kwargs, entry.data, )
+
+                    # opaque sub-router, let it do the rest
+                    result = entry.target.lookup(
+                            querystr[match.end(group):],
+                            host,
+                            list(args),
+                            kwargs,
+                            )
+                    if result[0]:
+                        return result
+
+                # The winner rejected a typed argument, or forwarded to a
+                # sub-router that missed. Carry on with the rest of the
+                # chunk step by step, like the plain lookup would do.
+                start = idx + 1
+
+            for idx, pos, args, kwargs in _match_leaves(
+                    table,
+                    start,
+                    stop,
+                    querystr,
+                    host,
+                    base_args,
+                    base_kwargs,
+                    ):
+                result = self._reach(
+                        table[idx][2],
+                        querystr,
+                        pos,
+                        host,
+                        args,
+                        kwargs,
+                        )
+                if result[0]:
+                    return result
+
+        return LOOKUP_MISS
+
+    @staticmethod
+    def _reach(entry, querystr, pos, host, args, kwargs):
+        # kwargs may still be the caller's dict, copy it like the targets
+        # do
+        if not entry.target_is_router:
+            return (True, entry.target, args, kwargs.copy(), entry.data, )
+
+        # opaque sub-router, let it do the rest
+        return entry.target.lookup(
+                querystr[pos:],
+                host,
+                list(args),
+                kwargs.copy(),
+                )
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
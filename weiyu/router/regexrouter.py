@@ -25,12 +25,37 @@ __all__ = [
             ]
 
 import re
+import weakref
+
+import six
 
 from ..helpers.misc import smartstr
 from ..helpers.regex_helper import normalize
 
 from . import router_hub
 from .base import *
+from .converters import expand_converters
+
+# Python 2.x's sre cannot handle more than 100 groups in one pattern.
+_MAX_COMBINED_GROUPS = 100 if six.PY2 else None
+
+# compiled patterns shared by all targets, see compile_shared
+_PATTERN_POOL = weakref.WeakValueDictionary()
+
+
+def compile_shared(pattern):
+    '''Compiles ``pattern``, sharing the result (and thus the pattern
+    string) with every other target using the same pattern.
+
+    '''
+
+    try:
+        return _PATTERN_POOL[pattern]
+    except KeyError:
+        pass
+
+    result = _PATTERN_POOL[pattern] = re.compile(pattern)
+    return result
 
 
 def args_from_match(match, named_groups):
@@ -41,15 +66,351 @@ def args_from_match(match, named_groups):
     return (args, kwargs, )
 
 
+def strip_group_names(pattern):
+    """Rewrites the named groups in ``pattern`` into plain capturing groups,
+    leaving the group numbering intact.
+
+    Returns ``None`` if the pattern cannot be safely embedded into a larger
+    pattern, e.g. when it contains backreferences, conditionals or global
+    inline flags.
+
+    """
+
+    result = []
+    pos, length, in_class = 0, len(pattern), False
+    while pos < length:
+        ch = pattern[pos]
+
+        if ch == '\\':
+            nextch = pattern[pos + 1:pos + 2]
+            if nextch.isdigit() and nextch != '0':
+                # numbered backreference
+                return None
+            result.append(pattern[pos:pos + 2])
+            pos += 2
+            continue
+
+        if in_class:
+            if ch == ']':
+                in_class = False
+            result.append(ch)
+            pos += 1
+            continue
+
+        if ch == '[':
+            # a ']' right after '[' or '[^' is literal
+            in_class = True
+            end = pos + 1
+            if pattern[end:end + 1] == '^':
+                end += 1
+            if pattern[end:end + 1] == ']':
+                end += 1
+            result.append(pattern[pos:end])
+            pos = end
+            continue
+
+        if ch == '(' and pattern[pos + 1:pos + 2] == '?':
+            ext = pattern[pos + 2:pos + 3]
+            if ext == 'P':
+                if pattern[pos + 3:pos + 4] != '<':
+                    # named backreference (?P=name)
+                    return None
+                close = pattern.find('>', pos)
+                if close == -1:
+                    return None
+                result.append('(')
+                pos = close + 1
+                continue
+
+            if ext == '(':
+                # conditional, refers to other groups
+                return None
+
+            if ext not in ':=!<#>':
+                # inline flags; the global form is only valid at the very
+                # beginning of a pattern
+                flags_end = pos + 2
+                while flags_end < length and pattern[flags_end].isalpha():
+                    flags_end += 1
+                if pattern[flags_end:flags_end + 1] == ')':
+                    return None
+
+        result.append(ch)
+        pos += 1
+
+    return ''.join(result)
+
+
+def offset_matchable_source(pattern):
+    """Returns the source of ``pattern`` with the leading ``^`` (if any)
+    removed, if matching the result at an offset into a string is the same
+    as matching ``pattern`` against the string sliced at that offset.
+
+    Returns ``None`` if that cannot be guaranteed, which is the case when
+    the pattern looks behind the starting position, e.g. with a non-leading
+    ``^``, ``\\A``, word boundaries or lookbehind assertions.
+
+    """
+
+    src = pattern[1:] if pattern.startswith('^') else pattern
+    pos, length, in_class = 0, len(src), False
+    while pos < length:
+        ch = src[pos]
+
+        if ch == '\\':
+            if src[pos + 1:pos + 2] in ('A', 'b', 'B', ):
+                return None
+            pos += 2
+            continue
+
+        if in_class:
+            if ch == ']':
+                in_class = False
+            pos += 1
+            continue
+
+        if ch == '[':
+            in_class = True
+            pos += 1
+            if src[pos:pos + 1] == '^':
+                pos += 1
+            if src[pos:pos + 1] == ']':
+                pos += 1
+            continue
+
+        if ch == '^':
+            return None
+
+        if ch == '(' and src[pos + 1:pos + 3] == '?<':
+            if src[pos + 3:pos + 4] in ('=', '!', ):
+                return None
+
+        pos += 1
+
+    return src
+
+
+def literal_of_pattern(pattern):
+    """Returns the only string fully matched by ``pattern``, if the pattern
+    is a plain literal anchored at the end, like ``^health/$``. Returns
+    ``None`` otherwise.
+
+    """
+
+    if not pattern.endswith('$') or pattern.endswith('\\$'):
+        return None
+
+    # let normalize do the parsing, then confirm the pattern does not
+    # contain anything normalize would have replaced with a representative
+    try:
+        forms = normalize(pattern)
+    except ValueError:
+        return None
+
+    if len(forms) != 1 or forms[0][1]:
+        return None
+
+    body = pattern[1:-1] if pattern.startswith('^') else pattern[:-1]
+    pos, length = 0, len(body)
+    while pos < length:
+        ch = body[pos]
+        if ch == '\\':
+            # only escaped punctuation stands for itself
+            nextch = body[pos + 1:pos + 2]
+            if not nextch or nextch.isalnum() or nextch == '_':
+                return None
+            pos += 2
+            continue
+
+        if ch in '.^$*+?{}[]|()':
+            return None
+
+        pos += 1
+
+    literal = forms[0][0]
+    match = re.match(pattern, literal)
+    if match is None or match.end() != len(literal):
+        return None
+
+    return literal
+
+
+def leading_literal(pattern):
+    """Returns the literal string every string matched by ``pattern`` starts
+    with, e.g. ``'user/'`` for ``^user/(?P<id>\\d+)/$``, being conservative.
+    Returns the empty string if nothing can be told.
+
+    """
+
+    src = pattern[1:] if pattern.startswith('^') else pattern
+    return split_leading_literal(src)[0]
+
+
+def split_leading_literal(src):
+    """Splits the pattern source ``src`` (without a leading ``^``) into the
+    literal string found by :func:`leading_literal`, and the source of the
+    rest of the pattern, so matching ``re.escape(literal) + rest`` is the
+    same as matching ``src``.
+
+    """
+
+    if '|' in src:
+        # a top-level alternation could start with anything
+        return '', src
+
+    result = []
+    pos, length = 0, len(src)
+    while pos < length:
+        ch = src[pos]
+        if ch == '\\':
+            # only escaped punctuation stands for itself
+            nextch = src[pos + 1:pos + 2]
+            if not nextch or nextch.isalnum() or nextch == '_':
+                break
+            literal, step = nextch, 2
+        elif ch in '.^$*+?{}[]|()':
+            break
+        else:
+            literal, step = ch, 1
+
+        quantifier = src[pos + step:pos + step + 1]
+        if quantifier and quantifier in '*+?{':
+            # the character is optional or repeated
+            break
+
+        result.append(literal)
+        pos += step
+
+    return ''.join(result), src[pos:]
+
+
+def build_static_table(entries):
+    """Collects the leaf targets with literal patterns into a ``dict``
+    mapping the literal to the target.
+
+    A literal is left out if any target before its own in ``entries``
+    also matches it, so looking up the table before anything else never
+    changes which target wins. Query strings not in the table must still
+    go through the regular lookup.
+
+    """
+
+    static = {}
+    for idx, entry in enumerate(entries):
+        literal = entry.literal
+        if literal is None or literal in static:
+            continue
+
+        if any(prev.pattern.match(literal) for prev in entries[:idx]):
+            continue
+
+        static[literal] = entry
+
+    return static
+
+
+def build_dispatch_chunks(entries):
+    """Groups consecutive mergeable regex targets into chunks sharing one
+    combined pattern.
+
+    Every chunk is a tuple ``(matcher, entries, slots, )``. ``matcher`` is
+    either the combined compiled pattern, or ``None`` for a single target
+    whose pattern cannot be merged. ``slots`` maps ``match.lastindex`` of
+    the combined pattern to the index of the winning target in ``entries``.
+
+    Each pattern is wrapped in a capturing group, so the group closing last
+    in a successful match is always the wrapper of the alternative taken;
+    the original groups of that alternative immediately follow it.
+
+    """
+
+    chunks = []
+    pending, pending_srcs, pending_groups = [], [], 0
+
+    def flush():
+        if not pending:
+            return
+
+        if len(pending) == 1:
+            # no point in combining a single pattern
+            chunks.append((None, pending[:], None, ))
+        else:
+            slots = [None]
+            srcs = []
+            for idx, (entry, src) in enumerate(zip(pending, pending_srcs)):
+                slots.append(idx)
+                slots.extend([None] * entry.pattern.groups)
+                srcs.append('(' + src + ')')
+
+            matcher = re.compile('|'.join(srcs))
+            chunks.append((matcher, pending[:], slots, ))
+
+        del pending[:]
+        del pending_srcs[:]
+
+    for entry in entries:
+        src = strip_group_names(entry.pattern.pattern)
+        if src is not None:
+            # verify the rewrite, being conservative
+            try:
+                if re.compile(src).groups != entry.pattern.groups:
+                    src = None
+            except re.error:
+                src = None
+
+        if src is None:
+            flush()
+            pending_groups = 0
+            chunks.append((None, [entry], None, ))
+            continue
+
+        groups = entry.pattern.groups + 1
+        if (_MAX_COMBINED_GROUPS is not None
+                and pending_groups + groups >= _MAX_COMBINED_GROUPS):
+            flush()
+            pending_groups = 0
+
+        pending.append(entry)
+        pending_srcs.append(src)
+        pending_groups += groups
+
+    flush()
+    return chunks
+
+
 class RegexRouterTarget(RouterTargetBase):
-    # __slots__ = ['name', 'pattern', 'target', '_namedgrps', ]
+    __slots__ = [
+            'pattern',
+            '_namedgrps',
+            '_posidx',
+            '_nameidx',
+            'literal',
+            'converters',
+            ]
 
     def __init__(self, pattern, target, extra_data=None, router=None):
         super(RegexRouterTarget, self).__init__(target, extra_data, router)
 
-        self.pattern = re.compile(smartstr(pattern))
+        # typed arguments, see weiyu.router.converters
+        pattern, self.converters = expand_converters(smartstr(pattern))
+        self.pattern = compile_shared(pattern)
         self._namedgrps = [i - 1 for i in self.pattern.groupindex.values()]
 
+        # group numbers for extracting arguments from a combined match
+        self._posidx = [
+                i + 1
+                for i in range(self.pattern.groups)
+                if i not in self._namedgrps
+                ]
+        self._nameidx = list(self.pattern.groupindex.items())
+
+        # the query string reaching us if we are a plain literal
+        self.literal = (
+                literal_of_pattern(self.pattern.pattern)
+                if not self.target_is_router
+                else None
+                )
+
     def check(self, querystr, prev_args, prev_kwargs):
         match = self.pattern.match(smartstr(querystr))
 
@@ -57,6 +418,11 @@ class RegexRouterTarget(RouterTargetBase):
             return (STATUS_NOROUTE, None, None, None, )
 
         curr_args, curr_kwargs = args_from_match(match, self._namedgrps)
+        if self.converters is not None:
+            try:
+                self.convert(curr_kwargs)
+            except ValueError:
+                return (STATUS_NOROUTE, None, None, None, )
 
         # update the previous context
         args = prev_args[:]
@@ -65,6 +431,40 @@ class RegexRouterTarget(RouterTargetBase):
         kwargs = prev_kwargs.copy()
         kwargs.update(curr_kwargs)
 
+        return self._check_result(querystr, match.end(), args, kwargs)
+
+    def check_combined(self, querystr, match, offset, prev_args, prev_kwargs):
+        # match is obtained from a combined pattern, in which our groups
+        # are numbered starting from offset + 1, and group offset spans
+        # exactly what our own pattern would have matched.
+        group = match.group
+
+        args = prev_args[:]
+        args.extend(group(offset + i) for i in self._posidx)
+
+        kwargs = prev_kwargs.copy()
+        for name, i in self._nameidx:
+            kwargs[name] = group(offset + i)
+
+        if self.converters is not None:
+            try:
+                self.convert(kwargs)
+            except ValueError:
+                return (STATUS_NOROUTE, None, None, None, )
+
+        return self._check_result(querystr, match.end(offset), args, kwargs)
+
+    def convert(self, kwargs):
+        '''Converts the typed arguments captured by our pattern in
+        ``kwargs``, in place. Raises :exc:`ValueError` if any of them is
+        malformed.
+
+        '''
+
+        for name, converter in six.iteritems(self.converters):
+            kwargs[name] = converter.to_python(kwargs[name])
+
+    def _check_result(self, querystr, end, args, kwargs):
         # support for nested routing
         if not self.target_is_router:
             return (STATUS_REACHED, args, kwargs, None, )
@@ -73,7 +473,7 @@ class RegexRouterTarget(RouterTargetBase):
         # since the RE matches at the beginning, safely assume its span()
         # starts at 0.
         # now, extract the substring for further routing...
-        new_qs = querystr[match.span()[1]:]
+        new_qs = querystr[end:]
 
         # and indicate this status.
         return (STATUS_FORWARD, args, kwargs, new_qs, )
@@ -85,10 +485,102 @@ class RegexRouterTarget(RouterTargetBase):
         pat_str, pat_vars = pat[0]
         return (pat_str, set(pat_vars), )
 
+    def _get_reverse_converters(self):
+        return self.converters
+
+    def dispatch_prefix(self):
+        return leading_literal(self.pattern.pattern)
+
 
 @router_hub.register_router_class('regex')
 class RegexRouter(RouterBase):
+    """Router matching the query string against regular expressions.
+
+    Targets with literal patterns like ``^health/$`` are also put into a
+    hash table, which is consulted before any regex is tried, as long as
+    no earlier target could match the same string.
+
+    Consecutive patterns are merged into one alternation at construction
+    time, so a single ``match`` call picks the first matching target in
+    declaration order. Patterns that cannot be merged are tried on their
+    own, in the same order.
+
+    """
+
     target_type = RegexRouterTarget
 
+    def _build_plan(self, entries):
+        return build_static_table(entries), build_dispatch_chunks(entries)
+
+    def _lookup_plan(self, plan, querystr, host, prev_args, prev_kwargs):
+        static, chunks = plan
+
+        entry = static.get(querystr)
+        if entry is not None:
+            return (
+                    True,
+                    entry.target,
+                    tuple(prev_args),
+                    prev_kwargs.copy(),
+                    entry.data,
+                    )
+
+        for matcher, entries, slots in chunks:
+            if matcher is None:
+                result = entries[0].lookup(
+                        querystr,
+                        host,
+                        prev_args,
+                        prev_kwargs,
+                        )
+                if result[0]:
+                    return result
+                continue
+
+            match = matcher.match(querystr)
+            if match is None:
+                continue
+
+            offset = match.lastindex
+            idx = slots[offset]
+            entry = entries[idx]
+            result = entry.resolve(
+                    entry.check_combined(
+                        querystr,
+                        match,
+                        offset,
+                        prev_args,
+                        prev_kwargs,
+                        ),
+                    host,
+                    )
+            if result[0]:
+                return result
+
+            # The winner forwarded to a sub-router that missed, or rejected
+            # a typed argument. Carry on with the rest of the chunk one by
+            # one, like the plain lookup would do; this is rare enough to
+            # not deserve a new pattern.
+            for entry in entries[idx + 1:]:
+                result = entry.lookup(querystr, host, prev_args, prev_kwargs)
+                if result[0]:
+                    return result
+
+        return LOOKUP_MISS
+
+    def dispatch_cost(self, entry, host=None):
+        # one probe of the static table, then one match per chunk
+        static, chunks = self._plan_for(host)
+        if entry.literal is not None and static.get(entry.literal) is entry:
+            return 1
+
+        cost = 1 if static else 0
+        for matcher, entries, slots in chunks:
+            cost += 1
+            if position_cost(entries, entry) is not None:
+                return cost
+
+        return None
+
 
 # vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / router / routing config reloader
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Routing config reloader
+~~~~~~~~~~~~~~~~~~~~~~~
+
+:class:`RouterReloader` watches the root URLfile of a router and every
+file it includes, and when any of them changes, builds a new router and
+swaps it into :data:`~weiyu.router.router_hub`.
+
+Only the changed files are parsed again. The router objects are always
+built afresh, though: routers keep references to their parents and
+caches derived from them, so sharing subtrees between the old and new
+trees would change the old one under requests still using it.
+
+The new router is only made visible once it is completely built, by
+:meth:`~weiyu.router.RouterHub.register_router`. If building fails, the
+old router stays in place, and is replaced when the files change again.
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'file_signature',
+        'RouterReloader',
+        ]
+
+import os
+import sys
+import marshal
+import threading
+import traceback
+
+from . import router_hub
+
+
+def file_signature(path):
+    '''Returns what tells different versions of the file at ``path``
+    apart, or ``None`` if there is no such file.
+
+    '''
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    return (st.st_mtime, st.st_size, )
+
+
+class RouterReloader(object):
+    '''Keeps the router of type ``typ`` in sync with the URLfile
+    ``filename``.
+
+    Call :meth:`load` for the initial load, then either :meth:`check`
+    periodically, or :meth:`start` a background thread doing so every
+    ``interval`` seconds. Changes are detected by polling the modification
+    time and size of the files.
+
+    Threads don't survive ``fork()``, so :meth:`start` in a forked child
+    starts a thread of its own; pre-forking servers should leave starting
+    to the workers, e.g. with
+    :meth:`~weiyu.router.RouterHub.on_first_dispatch`.
+
+    '''
+
+    def __init__(self, typ, filename, interval=1.0, hub=None):
+        self.typ, self.filename, self.interval = typ, filename, interval
+        self.hub = hub if hub is not None else router_hub
+
+        # path -> (signature, marshalled rule tree, )
+        self._parsed = {}
+        # path -> signature, of every file read (or tried) by the last build
+        self._watched = {}
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def _parse(self, path):
+        path = os.path.abspath(path)
+        signature = file_signature(path)
+
+        # watch even nonexistent files, such as include paths tried without
+        # the .URLfile suffix, as they change the result when created
+        self._watched[path] = signature
+
+        try:
+            cached_signature, blob = self._parsed[path]
+        except KeyError:
+            pass
+        else:
+            if cached_signature == signature:
+                # Always hand out a fresh copy, so nothing done with the
+                # tree can change the cached one.
+                return marshal.loads(blob)
+
+        config = self.hub.parse_router_config(self.typ, path)
+        self._parsed[path] = (signature, marshal.dumps(config), )
+        return config
+
+    def _build(self):
+        self._watched = {}
+        router = self.hub.init_router_from_config(
+                self.typ,
+                self.filename,
+                self._parse,
+                )
+
+        # forget the files no longer used
+        for path in list(self._parsed):
+            if path not in self._watched:
+                del self._parsed[path]
+
+        return router
+
+    def load(self):
+        '''Builds the router and registers it, replacing any router
+        registered for the type.
+
+        '''
+
+        with self._lock:
+            router = self._build()
+            self.hub.register_router(router)
+            return router
+
+    def changed(self):
+        '''Tells whether any file read by the last build has changed.'''
+
+        return any(
+                file_signature(path) != signature
+                for path, signature in list(self._watched.items())
+                )
+
+    def check(self):
+        '''Reloads the router if any of its files has changed.
+
+        Returns ``True`` if a new router is swapped in. Errors while
+        building the new router are printed, and the old router is kept.
+
+        '''
+
+        with self._lock:
+            if not self.changed():
+                return False
+
+            try:
+                router = self._build()
+            except Exception:
+                sys.stderr.write(
+                        'weiyu: reloading router \'%s\' from %s failed, '
+                        'keeping the old one\n' % (
+                            self.typ,
+                            self.filename,
+                            ))
+                traceback.print_exc()
+                return False
+
+            self.hub.register_router(router)
+            return True
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.check()
+
+    def start(self):
+        '''Starts polling in a daemon thread, unless already polling in
+        this process.
+
+        '''
+
+        pid = os.getpid()
+        if self._thread is not None:
+            if self._pid == pid:
+                return
+
+            # forked from the polling process; the thread is gone, and it
+            # might have been holding the lock
+            self._lock = threading.Lock()
+            self._stop_event = threading.Event()
+
+        self._pid = pid
+        self._stop_event.clear()
+        thread = self._thread = threading.Thread(
+                target=self._run,
+                name='weiyu-router-reloader-%s' % (self.typ, ),
+                )
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        '''Stops the polling thread, if running.'''
+
+        thread = self._thread
+        if thread is None:
+            return
+
+        self._stop_event.set()
+        thread.join()
+        self._thread = None
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
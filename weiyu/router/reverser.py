@@ -21,33 +21,105 @@ from __future__ import unicode_literals, division
 
 __all__ = [
         'reverser_for_router',
+        'drop_reverser',
+        'compile_template',
         'Reverser',
         ]
 
+import re
+
 import six
 
+from ..helpers.lru import LRUCache
+
 _REVERSER_CACHE = {}
 
+# the only conversions appearing in reverse patterns
+_PLACEHOLDER_RE = re.compile(r'%\(([^)]*)\)s|%%')
 
-def reverser_for_router(router):
+
+def reverser_for_router(router, memo_size=None):
     key = router.name
     if key is None:
         raise ValueError('only named routers can have reverser at present')
 
-    try:
-        return _REVERSER_CACHE[key]
-    except KeyError:
-        reverser = Reverser(router)
+    reverser = _REVERSER_CACHE.get(key, None)
+    if reverser is None or reverser.router is not router:
+        # not built yet, or built for a router since replaced
+        reverser = Reverser(router, memo_size)
         _REVERSER_CACHE[key] = reverser
-        return reverser
+
+    return reverser
+
+
+def drop_reverser(name):
+    '''Forgets the cached reverser of the router named ``name``, e.g. when
+    the router is replaced.
+
+    '''
+
+    _REVERSER_CACHE.pop(name, None)
+
+
+def compile_template(pat_str):
+    '''Turns a reverse pattern like ``'user/%(id)s/'`` into a positional
+    template.
+
+    Returns ``(fmt, names, )``, so that ``fmt % tuple(kwargs[name] for
+    name in names)`` gives the same result as ``pat_str % kwargs``.
+
+    '''
+
+    fmt, names, pos = [], [], 0
+    for match in _PLACEHOLDER_RE.finditer(pat_str):
+        fmt.append(pat_str[pos:match.start()].replace('%', '%%'))
+        name = match.group(1)
+        if name is None:
+            # an escaped '%'
+            fmt.append('%%')
+        else:
+            fmt.append('%s')
+            names.append(name)
+        pos = match.end()
+
+    fmt.append(pat_str[pos:].replace('%', '%%'))
+    return ''.join(fmt), tuple(names)
+
+
+def _url_values(names, to_urls, kwargs):
+    if to_urls is None:
+        return tuple([kwargs[name] for name in names])
+
+    return tuple([
+            kwargs[name] if to_url is None else to_url(kwargs[name])
+            for name, to_url in zip(names, to_urls)
+            ])
 
 
 class Reverser(object):
-    def __init__(self, router):
+    '''Constructs URLs out of endpoint names and arguments.
+
+    Reverse patterns are compiled into positional templates on first use,
+    and URLs of endpoints taking no arguments are remembered, so reversing
+    them is a single ``dict`` lookup. Typed arguments are converted with
+    the ``to_url`` methods of their converters.
+
+    If ``memo_size`` is given, URLs built with arguments are also memoized,
+    in a :class:`~weiyu.helpers.lru.LRUCache` of that size.
+
+    '''
+
+    def __init__(self, router, memo_size=None):
         self.router = router
         self.map = router.reverse_map
         self.pat_cache = {}
 
+        # endpoint -> (fmt, names, varset, to_urls, )
+        self._templates = {}
+        # endpoint -> URL, for endpoints taking no arguments
+        self._constants = {}
+        self.memo = LRUCache(memo_size) if memo_size else None
+
     def _resolve_scope(self, endpoint, __cache={}):
         # split the possibly scoped endpoint name into components
         try:
@@ -67,9 +139,12 @@ class Reverser(object):
         return result
 
     def signature(self, endpoint):
+        return self._lookup(endpoint)[:2]
+
+    def _lookup(self, endpoint):
         # look up the endpoint, memoized.
         try:
-            # pat_str, pat_vars
+            # pat_str, pat_vars, converters
             return self.pat_cache[endpoint]
         except KeyError:
             pass
@@ -89,7 +164,7 @@ class Reverser(object):
 
         # get out the pattern signature
         try:
-            pat_str, pat_vars = scope_map[name]
+            result = scope_map[name]
         except KeyError:
             raise ValueError(
                     "No endpoint '%s' exposed in scope '%s' of "
@@ -100,20 +175,98 @@ class Reverser(object):
                         ))
 
         # memoize the result
-        result = self.pat_cache[endpoint] = (pat_str, pat_vars, )
+        self.pat_cache[endpoint] = result
+        return result
+
+    def template(self, endpoint):
+        '''Returns ``(fmt, names, varset, to_urls, )`` for ``endpoint``,
+        ``fmt`` and ``names`` as returned by :func:`compile_template`,
+        ``varset`` the ``frozenset`` of the accepted keyword arguments, and
+        ``to_urls`` the ``to_url`` methods of the converters of ``names``
+        (``None`` for untyped arguments), or ``None`` if no argument is
+        typed.
+
+        '''
+
+        try:
+            return self._templates[endpoint]
+        except KeyError:
+            pass
+
+        pat_str, pat_vars, converters = self._lookup(endpoint)
+        fmt, names = compile_template(pat_str)
+
+        to_urls = None
+        if converters:
+            to_urls = tuple(
+                    converters[name].to_url if name in converters else None
+                    for name in names
+                    )
+
+        result = (fmt, names, frozenset(pat_vars), to_urls, )
+        self._templates[endpoint] = result
+
+        if not pat_vars:
+            self._constants[endpoint] = fmt % ()
+
         return result
 
     def reverse(self, endpoint, **kwargs):
-        pat_str, pat_vars = self.signature(endpoint)
+        if not kwargs:
+            try:
+                return self._constants[endpoint]
+            except KeyError:
+                pass
+
+        fmt, names, varset, to_urls = self.template(endpoint)
 
         # verify the parameters
-        given_vars = set(six.iterkeys(kwargs))
-        if given_vars != pat_vars:
+        if six.viewkeys(kwargs) != varset:
             # parameter mismatch
             raise ValueError('Parameter mismatch')
 
-        # successful match, construct the result
-        return pat_str % kwargs
+        if not names:
+            return fmt % ()
+
+        values = _url_values(names, to_urls, kwargs)
+        memo = self.memo
+        if memo is None:
+            return fmt % values
+
+        # Equal values of different types, like 1, 1.0 and True, format
+        # differently, so the types are part of the key.
+        try:
+            key = (endpoint, tuple([(type(v), v) for v in values]), )
+            result = memo.get(key, None)
+        except TypeError:
+            # unhashable arguments, can't memoize
+            return fmt % values
+
+        if result is None:
+            result = fmt % values
+            memo.put(key, result)
+
+        return result
+
+    def reverse_many(self, endpoint, kwargs_iter):
+        '''Reverses ``endpoint`` with each of the keyword argument
+        ``dict``\\ s in ``kwargs_iter``, returning the URLs in a list.
+
+        The endpoint is only looked up once, so this is cheaper than
+        calling :meth:`reverse` repeatedly, e.g. for rendering lists.
+
+        '''
+
+        fmt, names, varset, to_urls = self.template(endpoint)
+
+        result = []
+        for kwargs in kwargs_iter:
+            if six.viewkeys(kwargs) != varset:
+                raise ValueError('Parameter mismatch')
+
+            result.append(fmt % _url_values(names, to_urls, kwargs))
+
+        return result
 
 
 # vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
@@ -319,7 +319,7 @@ class RedisSession(object):
         request.session = RedisSessionObject(
                 self.sid,
                 None,
-                request.env.get('HTTP_COOKIE', ''),
+                request.get_header('Cookie', ''),
                 self.key,
                 self.secret,
                 self.ttl,
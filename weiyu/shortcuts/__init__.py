@@ -106,4 +106,10 @@ def reverse_http(endpoint, **kwargs):
     return reverser.reverse(endpoint, **kwargs)
 
 
+@expose
+def reverse_http_many(endpoint, kwargs_iter):
+    reverser = router_hub.reverser_for('http')
+    return reverser.reverse_many(endpoint, kwargs_iter)
+
+
 # vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
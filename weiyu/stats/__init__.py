@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / stats / package
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Runtime statistics
+~~~~~~~~~~~~~~~~~~
+
+Statistics collection is off by default. Enable it in the ``weiyu.stats``
+registry::
+
+    weiyu.stats:
+      enabled: true
+
+The HTTP adapters then account every routed request to its endpoint; see
+:mod:`weiyu.stats.routes`. The numbers are available from
+:meth:`StatsHub.route_snapshot`, and optionally over HTTP by loading
+:mod:`weiyu.stats.views` and routing to its ``weiyu-route-stats``
+endpoint, with the JSON renderer.
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'stats_hub',
+        'timer',
+        ]
+
+import time
+from timeit import default_timer
+
+from ..helpers.hub import BaseHub
+
+from .routes import RouteStats
+
+COLLECTORS_KEY, ROUTES_KEY = 'collectors', 'routes'
+
+try:
+    timer = time.perf_counter_ns
+except AttributeError:
+    # Python < 3.7
+    def timer():
+        '''Returns a monotonic time in integer nanoseconds.'''
+
+        return int(default_timer() * 1e9)
+
+
+class StatsHub(BaseHub):
+    registry_name = 'weiyu.stats'
+    handlers_key = COLLECTORS_KEY  # XXX currently unused
+
+    def __init__(self):
+        super(StatsHub, self).__init__()
+
+        if ROUTES_KEY not in self._reg:
+            self._reg[ROUTES_KEY] = RouteStats()
+
+    @property
+    def enabled(self):
+        return bool(self._reg.get('enabled', False))
+
+    @property
+    def route_stats(self):
+        '''The :class:`~weiyu.stats.routes.RouteStats` collecting per-route
+        dispatch statistics.
+
+        '''
+
+        return self._reg[ROUTES_KEY]
+
+    def route_snapshot(self):
+        '''Returns the per-route statistics merged across threads; see
+        :meth:`~weiyu.stats.routes.RouteStats.snapshot`.
+
+        '''
+
+        return self._reg[ROUTES_KEY].snapshot()
+
+    def reset(self):
+        self._reg[ROUTES_KEY].reset()
+
+
+stats_hub = StatsHub()
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
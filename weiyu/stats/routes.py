@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / stats / per-route dispatch statistics
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Per-route dispatch statistics
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Every request is accounted to its route, i.e. the ``(scope, endpoint, )``
+pair it was dispatched to. Three stages are timed: route matching, the
+view, and rendering. For each stage the total time and a base-2
+logarithmic histogram of the durations are kept.
+
+Recording must be cheap, so every thread updates its own table without
+any locking; the tables are only merged when a snapshot is taken. As the
+tables are read while other threads may be updating them, a snapshot is
+consistent to within the requests in flight.
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'STAGES',
+        'RouteStats',
+        'percentile',
+        ]
+
+import threading
+
+import six
+
+STAGES = ('match', 'view', 'render', )
+
+# Bucket i counts durations of i binary digits in nanoseconds, i.e. within
+# [2 ** (i - 1), 2 ** i); 64 buckets are enough for anything shorter than
+# a couple of centuries.
+HISTOGRAM_BUCKETS = 64
+
+# Records are flat lists, to save on indexing: the count, the total
+# nanoseconds of each stage, then the histograms of each stage in turn.
+_COUNT, _TOTALS, _HISTS = 0, 1, 4
+_RECORD_LEN = _HISTS + len(STAGES) * HISTOGRAM_BUCKETS
+_MATCH_HIST = _HISTS
+_VIEW_HIST = _MATCH_HIST + HISTOGRAM_BUCKETS
+_RENDER_HIST = _VIEW_HIST + HISTOGRAM_BUCKETS
+
+
+def _new_record():
+    return [0] * _RECORD_LEN
+
+
+def _merge_into(merged, table):
+    # dict.copy is atomic, unlike iterating over a dict that may be growing
+    # in another thread
+    for key, rec in six.iteritems(table.copy()):
+        acc = merged.get(key)
+        if acc is None:
+            acc = merged[key] = _new_record()
+
+        for idx, value in enumerate(rec):
+            if value:
+                acc[idx] += value
+
+
+def percentile(histogram, q):
+    '''Estimates the ``q``-th quantile (``0 < q <= 1``) of the durations
+    counted in ``histogram``, as the upper bound in nanoseconds of the
+    bucket it falls into. Returns ``0`` for an empty histogram.
+
+    '''
+
+    total = sum(histogram)
+    if not total:
+        return 0
+
+    threshold, seen = q * total, 0
+    for bucket, count in enumerate(histogram):
+        seen += count
+        if seen >= threshold:
+            return 2 ** bucket
+
+    return 2 ** (len(histogram) - 1)
+
+
+def _summarize(rec):
+    count = rec[_COUNT]
+    result = {'count': count, }
+    for idx, stage in enumerate(STAGES):
+        total = rec[_TOTALS + idx]
+        start = _HISTS + idx * HISTOGRAM_BUCKETS
+        hist = rec[start:start + HISTOGRAM_BUCKETS]
+
+        # drop the empty buckets at the end
+        last = HISTOGRAM_BUCKETS
+        while last and not hist[last - 1]:
+            last -= 1
+
+        result[stage] = {
+                'total_ns': total,
+                'mean_ns': total // count if count else 0,
+                'p50_ns': percentile(hist, 0.5),
+                'p99_ns': percentile(hist, 0.99),
+                'histogram': hist[:last],
+                }
+
+    return result
+
+
+class RouteStats(object):
+    '''Collector of per-route dispatch statistics.
+
+    :meth:`record` is meant to be called once per request, from any
+    thread; :meth:`snapshot` merges what all threads have recorded.
+
+    '''
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        # [thread, table, ] of every thread that has recorded something
+        self._tables = []
+        # what threads since exited have recorded, merged
+        self._retired = {}
+
+    def _retire_dead(self):
+        # folds the tables of exited threads into the retired one, so
+        # thread-per-request servers don't grow the list forever; called
+        # with the lock held
+        live = []
+        for pair in self._tables:
+            if pair[0].is_alive():
+                live.append(pair)
+            else:
+                _merge_into(self._retired, pair[1])
+
+        self._tables = live
+
+    def _new_table(self):
+        table = self._local.table = {}
+        with self._lock:
+            self._retire_dead()
+            self._tables.append([threading.current_thread(), table, ])
+
+        return table
+
+    def record(self, key, match_ns, view_ns, render_ns):
+        '''Accounts a request dispatched to ``key`` that spent
+        ``match_ns``, ``view_ns`` and ``render_ns`` nanoseconds in the
+        respective stages. The durations must be ``int``\\ s, as measured
+        with :func:`~weiyu.stats.timer`.
+
+        '''
+
+        try:
+            table = self._local.table
+        except AttributeError:
+            table = self._new_table()
+
+        try:
+            rec = table[key]
+        except KeyError:
+            rec = table[key] = _new_record()
+
+        rec[0] += 1
+        rec[1] += match_ns
+        rec[2] += view_ns
+        rec[3] += render_ns
+        rec[_MATCH_HIST + match_ns.bit_length()] += 1
+        rec[_VIEW_HIST + view_ns.bit_length()] += 1
+        rec[_RENDER_HIST + render_ns.bit_length()] += 1
+
+    def snapshot(self):
+        '''Merges the statistics of all threads.
+
+        Returns a ``dict`` mapping ``(scope, endpoint, )`` to a ``dict``
+        containing the request ``count``, and for each of the ``'match'``,
+        ``'view'`` and ``'render'`` stages, a ``dict`` with the
+        ``total_ns``, ``mean_ns``, estimated ``p50_ns`` and ``p99_ns``, and
+        the ``histogram`` counts by bucket.
+
+        '''
+
+        with self._lock:
+            self._retire_dead()
+            merged = {}
+            _merge_into(merged, self._retired)
+            tables = [table for _, table in self._tables]
+
+        for table in tables:
+            _merge_into(merged, table)
+
+        return {
+                key: _summarize(rec)
+                for key, rec in six.iteritems(merged)
+                }
+
+    def reset(self):
+        '''Discards everything recorded so far.'''
+
+        with self._lock:
+            self._retired.clear()
+            for _, table in self._tables:
+                table.clear()
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / stats / views
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals, division
+
+import six
+
+from . import stats_hub
+from ..shortcuts import http, view
+
+
+@http('weiyu-route-stats')
+@view
+def route_stats_view(request):
+    routes, snapshot = [], stats_hub.route_snapshot()
+    for (scope, endpoint), stats in six.iteritems(snapshot):
+        stats['scope'] = scope
+        stats['endpoint'] = six.text_type(endpoint)
+        routes.append(stats)
+
+    routes.sort(key=lambda x: x['count'], reverse=True)
+
+    return (
+            200,
+            {'enabled': stats_hub.enabled, 'routes': routes, },
+            {},
+            )
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# weiyu / utilities / asyncio helpers
+#
+# Copyright (C) 2014 Wang Xuerui <idontknw.wang-at-gmail-dot-com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+asyncio helpers
+~~~~~~~~~~~~~~~
+
+This module uses Python 3 syntax, and must only be imported there.
+
+'''
+
+from __future__ import unicode_literals, division
+
+__all__ = [
+        'view_response',
+        ]
+
+from ..reflex.classes import ReflexResponse
+
+
+async def view_response(awaitable, request):
+    '''Awaits the result of an ``async def`` view, and wraps it into a
+    :class:`~weiyu.reflex.classes.ReflexResponse` like
+    :func:`~weiyu.utils.decorators.view` does for the synchronous ones.
+
+    '''
+
+    status, content, context = await awaitable
+    return ReflexResponse(
+            status,
+            content,
+            context,
+            request,
+            )
+
+
+# vim:set ai et ts=4 sw=4 sts=4 fenc=utf-8:
@@ -29,10 +29,17 @@ import decorator
 
 from ..reflex.classes import ReflexResponse
 from ..helpers.annotation import annotate
+from ..helpers.misc import isawaitable
 
 
 def _view_func_(fn, request, *args, **kwargs):
-    status, content, context = fn(request, *args, **kwargs)
+    result = fn(request, *args, **kwargs)
+    if isawaitable(result):
+        # an async def view, only possible on Python 3
+        from .aio import view_response
+        return view_response(result, request)
+
+    status, content, context = result
     return ReflexResponse(
             status,
             content,
@@ -45,6 +52,10 @@ def view(fn):
     '''View decorator to avoid having to
     ``from weiyu.reflex.classes import ReflexResponse`` everywhere.
 
+    ``async def`` views are supported too, in which case the decorated
+    view returns an awaitable of the response. Only the asyncio adapter can
+    serve such views.
+
     '''
 
     return decorator.decorator(_view_func_, fn)
@@ -57,6 +68,10 @@ def only_methods(methods=None):
 
     Must occur *after* the ``@view`` decorator.
 
+    The methods are also picked up when the view is put into a router, so
+    requests using other methods are answered with 405 right after
+    routing, before the rest of request processing takes place.
+
     '''
 
     methods = set(['GET', ] if methods is None else methods)
@@ -26,6 +26,7 @@ __all__ = [
 import sys
 import os
 import inspect
+import importlib
 from socket import gethostname
 
 from ..adapters import adapter_hub
@@ -116,6 +117,27 @@ def cli_server_tornado(managed, application=None, port=None, hostname=None):
     ioloop.IOLoop.instance().start()
 
 
+@expose_flavor('asyncio')
+def cli_server_asyncio(managed, application=None, port=None, hostname=None):
+    try:
+        importlib.import_module('..adapters.http.asyncio_', __package__)
+    except (ImportError, SyntaxError):
+        # the adapter needs asyncio and async/await, i.e. Python 3.7+
+        print(
+                'import of the asyncio adapter failed, bailing',
+                file=sys.stderr,
+                )
+        sys.exit(1)
+
+    port = get_port_number() if not managed and port is None else port
+
+    if not managed and application is None:
+        # like Tornado, the adapter is the server itself
+        application = adapter_hub.make_app('asyncio')
+
+    application.serve_forever('0.0.0.0', port)
+
+
 @expose_flavor('socketio')
 def cli_server_socketio(
         managed,